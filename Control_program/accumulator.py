@@ -0,0 +1,126 @@
+import numpy as np
+import collections
+import threading
+import queue
+import time
+
+class SpectrumAccumulator():
+    """ Keeps a running sum of FFT power spectra (dumps) in memory.
+
+    Used instead of writing every dump to a temporary file and stacking
+    the files after the measurement. The sum is kept in float64 to avoid
+    loss of precision for long integrations. Dumps are added from the
+    GNUradio thread while the measurement thread reads the result, so
+    all access is protected by a lock."""
+
+    def __init__(self, fftsize):
+        self.fftsize = int(fftsize)
+        self.lock = threading.Lock()
+        # Optional object with an add(dumps, timestamp) function, e.g. a
+        # WaterfallWriter, which is given every dump.
+        self.recorder = None
+        # Optional object with an apply(dumps, timestamp) function returning
+        # dumps shifted in frequency before stacking, e.g. a DopplerTracker.
+        self.doppler_tracker = None
+        self.reset()
+
+    def reset(self):
+        """Forget all data added so far."""
+        with self.lock:
+            self.sum = np.zeros(self.fftsize, dtype=np.float64)
+            self.count = 0
+
+    def add(self, dumps):
+        """Add one dump, or a 2D array of dumps with one spectrum per row."""
+        dumps = np.asarray(dumps).reshape((-1, self.fftsize))
+        if len(dumps) == 0:
+            return
+        timestamp = time.time()
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.add(dumps, timestamp)
+        doppler_tracker = self.doppler_tracker
+        if doppler_tracker is not None:
+            dumps = doppler_tracker.apply(dumps, timestamp)
+        with self.lock:
+            self.sum += dumps.sum(axis=0, dtype=np.float64)
+            self.count += len(dumps)
+
+    def set_recorder(self, recorder):
+        self.recorder = recorder
+
+    def set_doppler_tracker(self, doppler_tracker):
+        self.doppler_tracker = doppler_tracker
+
+    def get_count(self):
+        return self.count
+
+    def get_spectrum(self):
+        """Returns the mean of all dumps added so far, or None if no data."""
+        with self.lock:
+            if self.count == 0:
+                return None
+            # Normalise power spectrum to be invariant of
+            # integration time
+            return self.sum/self.count
+
+# Running mean spectra published during a measurement. seq increases by one
+# for every snapshot, elapsed is the time since the measurement started [s]
+# and sig/ref are the mean spectra so far, or None if no data (yet).
+SpectrumSnapshot = collections.namedtuple('SpectrumSnapshot', ['seq', 'elapsed', 'sig', 'ref'])
+
+class SnapshotBuffer():
+    """ Holds the latest snapshot published by one thread for other threads
+    to read, e.g. a preview of the spectrum for the GUI.
+
+    No lock is needed, since publishing only replaces the reference to an
+    immutable snapshot, which is atomic in Python. Readers therefore always
+    get a complete snapshot and never block the publishing thread."""
+
+    def __init__(self):
+        self.snapshot = None
+
+    def publish(self, snapshot):
+        self.snapshot = snapshot
+
+    def get(self):
+        """Returns the latest snapshot, or None if nothing published yet."""
+        return self.snapshot
+
+class FileStacker():
+    """ Stacks temporary dump files into a SpectrumAccumulator in a background
+    thread, so that stacking overlaps with recording of the next files.
+
+    The stack function shall return the mean spectrum of a file, or None
+    if the file contains no complete spectrum."""
+
+    def __init__(self, accumulator, stack_function):
+        self.accumulator = accumulator
+        self.stack_function = stack_function
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, infile):
+        self.queue.put(infile)
+
+    def finish(self):
+        """Wait for all submitted files to be stacked, stop the worker thread and
+        return the mean spectrum (or None if no data)."""
+        self.queue.put(None)
+        self.thread.join()
+        return self.accumulator.get_spectrum()
+
+    def _run(self):
+        while True:
+            infile = self.queue.get()
+            if infile is None:
+                break
+            try:
+                spec = self.stack_function(infile)
+            except (OSError, ValueError) as e:
+                print("WARNING: Could not stack " + infile + ": " + str(e))
+                continue
+            if spec is not None:
+                self.accumulator.add(spec)
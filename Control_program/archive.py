@@ -0,0 +1,236 @@
+import os
+import re
+import time
+import queue
+import threading
+import collections
+
+# Columns of the archive table, besides the file columns, in insert order.
+RECORD_COLUMNS = ['observer', 'glon', 'glat', 'obsdate', 'obsfreq', 'bandwidth', 'int_time', 'telescope']
+FILE_COLUMNS = ['file_fits', 'file_png', 'file_txt']
+
+# Table used when testing with a local SQLite database instead of the
+# web archive. The MySQL table of the web archive has the same columns.
+SQLITE_SCHEMA = """CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    observer TEXT, glon TEXT, glat TEXT, obsdate INTEGER,
+    obsfreq REAL, bandwidth REAL, int_time INTEGER, telescope TEXT,
+    file_fits BLOB, file_png BLOB, file_txt BLOB)"""
+
+# An upload of one spectrum. Record is a dict with the RECORD_COLUMNS,
+# files are (fits, png, txt) filenames. Key is returned in status reports,
+# e.g. to find the spectrum again. If remove_files is set, the files are
+# deleted when the job is done.
+UploadJob = collections.namedtuple('UploadJob', ['key', 'record', 'files', 'remove_files'])
+
+# Status reported for a job
+QUEUED = 'queued'
+UPLOADING = 'uploading'
+RETRYING = 'retrying'
+DONE = 'done'
+FAILED = 'failed'
+
+class ArchiveConnection():
+    """ Connection to the archive database, described by the ARCHIVE section
+    of the config file. The 'backend' setting selects 'mysql' (default, the
+    web archive) or 'sqlite', where 'database' is the filename of a local
+    database, e.g. for testing without network. The connection is opened
+    when first needed and kept open between inserts.
+
+    retry_errors are the exceptions after which an insert may succeed if
+    tried again, i.e. lost connections and other operational errors of
+    the database, and network errors."""
+
+    def __init__(self, config):
+        self.backend = config.get('ARCHIVE', 'backend', fallback='mysql')
+        self.host = config.get('ARCHIVE', 'host', fallback='')
+        self.database = config.get('ARCHIVE', 'database')
+        self.user = config.get('ARCHIVE', 'user', fallback='')
+        self.password = config.get('ARCHIVE', 'password', fallback='')
+        self.table = config.get('ARCHIVE', 'table')
+        # The table name is part of the SQL command, and cannot be a parameter
+        if not re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', self.table):
+            raise ValueError("Invalid archive table name: " + self.table)
+        self.con = None
+        columns = RECORD_COLUMNS + FILE_COLUMNS
+        if self.backend == 'sqlite':
+            import sqlite3
+            self.db = sqlite3
+            marker = '?'
+        elif self.backend == 'mysql':
+            import MySQLdb
+            self.db = MySQLdb
+            marker = '%s'
+        else:
+            raise ValueError("Unknown archive backend: " + self.backend)
+        self.retry_errors = (self.db.OperationalError, OSError)
+        self.insert_cmd = "INSERT INTO {:s} ({:s}) VALUES ({:s})".format(
+            self.table, ', '.join(columns), ', '.join([marker]*len(columns)))
+
+    def connect(self):
+        if self.con is not None:
+            return self.con
+        if self.backend == 'sqlite':
+            self.con = self.db.connect(self.database, check_same_thread=False)
+            self.con.execute(SQLITE_SCHEMA.format(table=self.table))
+        else:
+            self.con = self.db.connect(host=self.host, passwd=self.password, db=self.database, user=self.user)
+        return self.con
+
+    def get_values(self, record, files):
+        """Returns the values of one row, with the contents of the files.
+        Raises KeyError if a column is missing in record, or OSError if a
+        file cannot be read."""
+        values = [record[name] for name in RECORD_COLUMNS]
+        for filename in files:
+            with open(filename, 'rb') as f:
+                values.append(f.read())
+        return values
+
+    def insert(self, record, files):
+        """Insert one row. The files are read once and passed as parameters
+        to the insert command, so no SQL string containing the data is built."""
+        self.insert_values(self.get_values(record, files))
+
+    def insert_values(self, values):
+        """Insert one row with values from get_values."""
+        con = self.connect()
+        cur = con.cursor()
+        try:
+            cur.execute(self.insert_cmd, values)
+            con.commit()
+        finally:
+            cur.close()
+
+    def close(self):
+        if self.con is not None:
+            try:
+                self.con.close()
+            except Exception:
+                pass
+            self.con = None
+
+def upload(config, record, files):
+    """Upload one spectrum and wait for it to finish, without retries."""
+    con = ArchiveConnection(config)
+    try:
+        con.insert(record, files)
+    finally:
+        con.close()
+
+class ArchiveUploader():
+    """ Uploads spectra to the archive in a background thread, so that the
+    user interface does not wait for the network.
+
+    Jobs are queued by submit() and uploaded in order using one connection,
+    which is kept open between jobs. If an upload fails because of the
+    database or network, the connection is closed and the upload is tried
+    again after a delay, which is doubled for every failed attempt, up to
+    max_retries times. Other errors, e.g. a missing file, fail the job at
+    once.
+
+    The callback, if given, is called as callback(key, status, message)
+    when the status of a job changes. It is called from the upload thread,
+    so a GUI shall e.g. emit a Qt signal from it."""
+
+    def __init__(self, config, callback = None, connection = None):
+        self.config = config
+        self.callback = callback
+        self.max_retries = config.getint('ARCHIVE', 'max_retries', fallback=3)
+        self.retry_delay = config.getfloat('ARCHIVE', 'retry_delay', fallback=2.0) # s
+        self.connection = connection
+        # Why no connection could be made, reported for every job
+        self.connection_error = None
+        self.queue = queue.Queue()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, key, record, files, remove_files = False):
+        self.queue.put(UploadJob(key, record, tuple(files), remove_files))
+        self._report(key, QUEUED, "Upload queued.")
+
+    def get_pending(self):
+        """Returns the approximate number of jobs waiting to be uploaded."""
+        return self.queue.qsize()
+
+    def wait(self):
+        """Wait until all submitted jobs are done."""
+        self.queue.join()
+
+    def stop(self, wait = True):
+        """Stop the upload thread. If wait is set, the jobs already submitted
+        are uploaded first, otherwise waiting jobs are dropped."""
+        if not wait:
+            self.stopping.set()
+        self.queue.put(None)
+        self.thread.join()
+
+    def _report(self, key, status, message):
+        if self.callback is not None:
+            self.callback(key, status, message)
+
+    def _run(self):
+        if self.connection is None:
+            try:
+                self.connection = ArchiveConnection(self.config)
+            except Exception as e:
+                self.connection_error = "Archive upload not available: " + str(e)
+                print("WARNING: " + self.connection_error)
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    break
+                if self.connection is None:
+                    self._report(job.key, FAILED, self.connection_error)
+                elif self.stopping.is_set():
+                    self._report(job.key, FAILED, "Upload cancelled.")
+                else:
+                    self._upload(job)
+            finally:
+                self.queue.task_done()
+        if self.connection is not None:
+            self.connection.close()
+
+    def _upload(self, job):
+        self._report(job.key, UPLOADING, "Uploading to archive.")
+        try:
+            values = self.connection.get_values(job.record, job.files)
+        except (KeyError, OSError) as e:
+            # Would fail again, so not retried
+            self._report(job.key, FAILED, "Upload failed, invalid job: " + str(e))
+        else:
+            self._insert(job, values)
+        if job.remove_files:
+            for filename in job.files:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+    def _insert(self, job, values):
+        delay = self.retry_delay
+        attempt = 0
+        while True:
+            try:
+                self.connection.insert_values(values)
+                self._report(job.key, DONE, "Uploaded to archive.")
+                break
+            except self.connection.retry_errors as e:
+                # Do not reuse a connection which may be broken
+                self.connection.close()
+                attempt += 1
+                if attempt > self.max_retries or self.stopping.is_set():
+                    self._report(job.key, FAILED, "Upload failed: " + str(e))
+                    break
+                self._report(job.key, RETRYING, "Upload failed, retrying in {:.1f} s: {:s}".format(delay, str(e)))
+                if self.stopping.wait(delay):
+                    self._report(job.key, FAILED, "Upload cancelled.")
+                    break
+                delay *= 2
+            except Exception as e:
+                # E.g. a value not accepted by the database, which would fail again
+                self._report(job.key, FAILED, "Upload failed: " + str(e))
+                break
@@ -0,0 +1,136 @@
+from dumpfile import *
+import threading
+import time
+
+# Outputs of the receiver selector
+NULL = 0 # Blanking, data thrown away
+SIG = 1 # Signal
+REF = 2 # Reference
+
+class ReceiverBackend():
+    """ Interface used by Measurement to control a receiver.
+
+    Implemented by SALSA_Receiver (receiver.py) for the USRP and by
+    SyntheticReceiver (synthetic.py) for simulated data. A receiver produces
+    averaged FFT power spectra (dumps) and routes them to the output chosen
+    by select(): nowhere (NULL), signal (SIG) or reference (REF).
+    If set_band_freqs has been given both signal and reference frequencies,
+    both bands are received at the same time from one wider band and
+    routed to SIG and REF for any output except NULL.
+    In "memory" sink mode dumps are added to sig_accumulator and
+    ref_accumulator, in "file" sink mode they are written to the file opened
+    with open_dump for that output, after a header from get_dump_header
+    (see dumpfile.py).
+
+    The receiver is also expected to provide start(), stop() and wait() to
+    control the data flow, and get/set methods for samp_rate, c_freq, gain,
+    int_time, fftsize, sink_mode and band_freqs."""
+
+    def tune(self, c_freq):
+        """Set the centre frequency [Hz] of the receiver."""
+        raise NotImplementedError()
+
+    def select(self, output):
+        """Route dumps to output NULL, SIG or REF."""
+        raise NotImplementedError()
+
+    def open_dump(self, output, filename):
+        """Start writing dumps for the given output to a new file (file sink mode)."""
+        raise NotImplementedError()
+
+    def close_dump(self, output):
+        """Close the file for the given output (file sink mode)."""
+        raise NotImplementedError()
+
+    def get_dump_header(self, output):
+        """Returns the header of a new dump file for the given output,
+        describing the data currently received."""
+        c_freq = self.get_c_freq()
+        if self.get_band_freqs() is not None:
+            c_freq = self.get_band_freqs()[0 if output == SIG else 1]
+        return DumpHeader(self.get_fftsize(), self.get_samp_rate(), c_freq, time.time(), output)
+
+class ReceiverSession():
+    """ Keeps one receiver alive between measurements.
+
+    Creating a new receiver opens the connection to the USRP, sets the gain and
+    builds the FFT chain, which takes time. Measurements instead borrow the
+    receiver from a session, which is reconfigured in place for the requested
+    frequency, bandwidth, FFT size and gain."""
+
+    def __init__(self, create_receiver):
+        # Function called as create_receiver(c_freq, int_time, samp_rate, fftsize, usrp_gain, sink_mode)
+        self.create_receiver = create_receiver
+        self.receiver = None
+        self.lock = threading.Lock()
+
+    def acquire(self, c_freq, int_time, samp_rate, fftsize, usrp_gain, sink_mode = "memory", band_freqs = None):
+        """Returns a stopped receiver configured for the given settings.
+        If band_freqs is given as (sig_freq, ref_freq), both bands are received at the same time."""
+        with self.lock:
+            if self.receiver is None:
+                self.receiver = self.create_receiver(c_freq, int_time, samp_rate, fftsize, usrp_gain, sink_mode)
+                self.receiver.set_band_freqs(band_freqs)
+                return self.receiver
+            # Make sure a previous measurement has stopped the flowgraph
+            self.receiver.stop()
+            self.receiver.wait()
+            self.receiver.set_band_freqs(band_freqs)
+            if samp_rate != self.receiver.get_samp_rate():
+                self.receiver.set_samp_rate(samp_rate)
+            if c_freq != self.receiver.get_c_freq():
+                self.receiver.set_c_freq(c_freq)
+            if usrp_gain != self.receiver.get_gain():
+                self.receiver.set_gain(usrp_gain)
+            self.receiver.set_int_time(int_time)
+            self.receiver.set_fftsize(fftsize)
+            self.receiver.set_sink_mode(sink_mode)
+            return self.receiver
+
+    def release(self):
+        """Stop the data flow, keeping the receiver (and USRP connection) open."""
+        with self.lock:
+            if self.receiver is not None:
+                self.receiver.stop()
+                self.receiver.wait()
+
+def get_integration_length(config, samp_rate):
+    """Returns N, the number of FFTs integrated per dump for the given sample rate [Hz].
+
+    Read from the 'integration_length' setting in the USRP section of the config
+    file, given as comma separated bandwidth:N pairs with bandwidth in MHz.
+    The pair with the largest bandwidth not above samp_rate is used."""
+    N = 10
+    best_bw = -1
+    for item in config.get('USRP', 'integration_length', fallback='').split(','):
+        if ':' not in item:
+            continue
+        (bw, n) = item.split(':')
+        bw = float(bw)*1e6
+        if bw <= samp_rate*(1+1e-9) and bw > best_bw:
+            best_bw = bw
+            N = int(n)
+    return N
+
+_sessions = {}
+
+def get_receiver_session(config, username):
+    """Returns the receiver session shared by all measurements in this program.
+
+    The backend is chosen by the 'backend' setting in the USRP section of the
+    config file, either "usrp" (default) or "synthetic"."""
+    backend = config.get('USRP', 'backend', fallback='usrp')
+    if backend not in _sessions:
+        if backend == "synthetic":
+            from synthetic import SyntheticReceiver
+            def create_receiver(c_freq, int_time, samp_rate, fftsize, usrp_gain, sink_mode):
+                return SyntheticReceiver(c_freq, int_time, samp_rate, fftsize, config, usrp_gain, sink_mode)
+        elif backend == "usrp":
+            # Imported here since GNUradio is only needed for the real receiver
+            from receiver import SALSA_Receiver
+            def create_receiver(c_freq, int_time, samp_rate, fftsize, usrp_gain, sink_mode):
+                return SALSA_Receiver(c_freq, int_time, samp_rate, fftsize, username, config, usrp_gain, sink_mode)
+        else:
+            raise ValueError("Unknown receiver backend " + backend + " in config file.")
+        _sessions[backend] = ReceiverSession(create_receiver)
+    return _sessions[backend]
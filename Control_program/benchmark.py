@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# Benchmark of the measurement and post-processing pipeline using the
+# synthetic receiver, i.e. without USRP or telescope.
+# Usage: ./benchmark.py [configfile]
+import sys
+import os
+import time
+import configparser
+import ephem
+from measurement import *
+from synthetic import SyntheticReceiver
+
+def get_site(config):
+    site = ephem.Observer()
+    site.date = ephem.now()
+    site.lat = ephem.degrees(config.get('SITE', 'latitude'))
+    site.long = ephem.degrees(config.get('SITE', 'longitude'))
+    site.elevation = config.getfloat('SITE', 'elevation')
+    site.pressure = 0 # Do not correct for atmospheric refraction
+    site.name = config.get('SITE', 'name')
+    return site
+
+def get_session(config):
+    def create_receiver(c_freq, int_time, samp_rate, fftsize, usrp_gain, sink_mode):
+        return SyntheticReceiver(c_freq, int_time, samp_rate, fftsize, config, usrp_gain, sink_mode)
+    return ReceiverSession(create_receiver)
+
+def run(config, session, switched, int_time, nchans = 256, bw = 2.5e6):
+    site = get_site(config)
+    if switched:
+        sig_time = ref_time = int_time/4.0
+    else:
+        sig_time = int_time
+        ref_time = 0
+    measurement = Measurement(1420.4e6, 1418.4e6, switched, int_time, sig_time, ref_time, bw, 45.0, 180.0, site, nchans, "benchmark", config, 0, 0, 40, "Galactic", session = session)
+    t0 = time.time()
+    measurement.measure()
+    t1 = time.time()
+    sigspec = measurement.signal_spec
+    sigspec.auto_edit_bad_data()
+    if switched:
+        refspec = measurement.reference_spec
+        refspec.auto_edit_bad_data()
+        sigspec.data = 285*(sigspec.data-refspec.data)/refspec.data
+    t2 = time.time()
+    sigspec.decimate_channels(nchans)
+    t3 = time.time()
+    sigspec.shift_to_vlsr_frame()
+    t4 = time.time()
+    mode = "switched" if switched else "unswitched"
+    print("{:10s} int_time={:5.1f} s".format(mode, int_time))
+    print("    measure + stack:    {:8.3f} s (overhead {:6.3f} s)".format(t1-t0, t1-t0-int_time))
+    print("    RFI removal:        {:8.3f} s".format(t2-t1))
+    print("    decimation:         {:8.3f} s".format(t3-t2))
+    print("    VLSR correction:    {:8.3f} s".format(t4-t3))
+
+def batch_cleaning(config, nspectra = 2000, fftsize = 4096, bw = 2.5e6):
+    # RFI removal of a stack of spectra, e.g. a map cube, in one call
+    receiver = SyntheticReceiver(1420.4e6, 0, bw, fftsize, config, 40)
+    data = receiver.get_dumps(nspectra, receiver.model)
+    t0 = time.time()
+    clean_spectra(data, get_rfi_mask(get_known_RFI(config), 1420.4e6, bw, fftsize))
+    t1 = time.time()
+    print("Batch RFI removal: {:d} spectra in {:.3f} s".format(nspectra, t1-t0))
+
+def throughput(config, duration = 5.0, fftsize = 4096, bw = 2.5e6):
+    # Produce dumps as fast as possible and count them
+    config.set('SYNTHETIC', 'dump_rate', '0')
+    receiver = SyntheticReceiver(1420.4e6, duration, bw, fftsize, config, 40)
+    receiver.select(SIG)
+    receiver.start()
+    time.sleep(duration)
+    receiver.stop()
+    receiver.wait()
+    rate = receiver.ndumps/duration
+    print("Synthetic receiver throughput: {:.0f} dumps/s, {:.1f} Mchannels/s".format(rate, 1e-6*rate*fftsize))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        configfile = sys.argv[1]
+    else:
+        configfile = os.path.dirname(os.path.realpath(__file__)) + '/SALSA.config.default'
+    config = configparser.ConfigParser()
+    config.read(configfile)
+    config.set('USRP', 'backend', 'synthetic')
+    if not config.has_section('SYNTHETIC'):
+        config.add_section('SYNTHETIC')
+    session = get_session(config)
+    for sink_mode in ["memory", "file"]:
+        print("Sink mode: " + sink_mode)
+        config.set('USRP', 'sink_mode', sink_mode)
+        run(config, session, False, 10)
+        run(config, session, True, 20)
+    batch_cleaning(config)
+    throughput(config)
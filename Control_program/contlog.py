@@ -1,4 +1,8 @@
 #!/usr/bin/python3
+import sys
+import time
+import numpy as np
+from PyQt5 import QtWidgets, QtCore
 from telescope import *
 import configparser
 from measurement import *
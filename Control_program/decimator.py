@@ -0,0 +1,43 @@
+import numpy as np
+from scipy import signal
+from fractions import Fraction
+
+class Decimator():
+    """ Reduces the number of channels of spectra from nchans to outchans,
+    after low pass filtering to avoid aliasing.
+
+    Works like scipy.signal.decimate with ftype='fir', but the filter is
+    designed once and any number of output channels is supported: the
+    spectra are resampled by the rational factor outchans/nchans, so
+    e.g. 4096 channels can be reduced to 1000. Used on one spectrum or a
+    2D array with one spectrum per row."""
+
+    def __init__(self, nchans, outchans):
+        self.nchans = int(nchans)
+        self.outchans = int(outchans)
+        factor = Fraction(self.outchans, self.nchans)
+        self.up = factor.numerator
+        self.down = factor.denominator
+        # Same filter as scipy.signal.decimate for integer factors
+        max_rate = max(self.up, self.down)
+        self.taps = signal.firwin(20*max_rate+1, 1.0/max_rate, window='hamming')
+
+    def decimate(self, data):
+        """Returns data with outchans channels along the last axis."""
+        data = np.asarray(data)
+        if data.dtype.kind != 'f' or data.dtype == np.float16:
+            data = data.astype(np.float64)
+        out = signal.resample_poly(data, self.up, self.down, axis=-1, window=self.taps)
+        # First channel is affected by the filter edge
+        out[..., 0] = out[..., 1]
+        return out
+
+_decimators = {}
+
+def get_decimator(nchans, outchans):
+    """Returns the Decimator from nchans to outchans channels, created
+    the first time it is requested."""
+    key = (int(nchans), int(outchans))
+    if key not in _decimators:
+        _decimators[key] = Decimator(nchans, outchans)
+    return _decimators[key]
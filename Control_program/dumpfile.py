@@ -0,0 +1,99 @@
+import numpy as np
+import struct
+import os
+
+# Dump files start with a fixed size header describing the data, followed by
+# the dumps (spectra) as one row of fftsize values each. All numbers are
+# little endian. Header fields in order:
+#   magic       8 bytes, always b'SALSADMP'
+#   version     uint16
+#   band        uint8, 0 = none, 1 = signal, 2 = reference
+#   dtype       4 bytes, numpy dtype string of data, e.g. b'<f4'
+#   fftsize     uint32, number of channels per dump
+#   samp_rate   float64, sample rate (bandwidth) [Hz]
+#   c_freq      float64, centre frequency [Hz]
+#   start_time  float64, unix time of first dump [s]
+#   ndumps      uint64, number of dumps, 0 if not known when writing.
+# The header is padded to HEADER_SIZE bytes.
+MAGIC = b'SALSADMP'
+VERSION = 1
+HEADER_SIZE = 64
+HEADER = struct.Struct('<8sHB4sIdddQ')
+
+class DumpHeader():
+    """ Description of the data in a dump file."""
+
+    def __init__(self, fftsize, samp_rate, c_freq, start_time, band = 0, ndumps = 0, dtype = '<f4'):
+        self.fftsize = int(fftsize)
+        self.samp_rate = float(samp_rate)
+        self.c_freq = float(c_freq)
+        self.start_time = float(start_time)
+        self.band = int(band)
+        self.ndumps = int(ndumps)
+        self.dtype = np.dtype(dtype)
+
+    def pack(self):
+        header = HEADER.pack(MAGIC, VERSION, self.band, self.dtype.str.encode(), self.fftsize, self.samp_rate, self.c_freq, self.start_time, self.ndumps)
+        return header.ljust(HEADER_SIZE, b'\0')
+
+    @staticmethod
+    def unpack(data):
+        (magic, version, band, dtype, fftsize, samp_rate, c_freq, start_time, ndumps) = HEADER.unpack(data[:HEADER.size])
+        if magic != MAGIC:
+            raise ValueError("Not a SALSA dump file.")
+        if version > VERSION:
+            raise ValueError("Unsupported dump file version " + str(version) + ".")
+        return DumpHeader(fftsize, samp_rate, c_freq, start_time, band, ndumps, dtype.rstrip(b'\0').decode())
+
+def write_dump_header(filename, header):
+    """Create a new dump file containing only the header. Data is then appended
+    to the file, e.g. by a GNUradio file sink in append mode."""
+    with open(filename, 'wb') as f:
+        f.write(header.pack())
+
+def update_dump_count(filename, ndumps):
+    """Set the number of dumps in the header of an existing dump file."""
+    with open(filename, 'r+b') as f:
+        f.seek(HEADER.size - 8)
+        f.write(struct.pack('<Q', ndumps))
+
+def is_dump_file(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+class DumpFile():
+    """ Opens a dump file for reading. The dumps are available as
+    data, a memory mapped array with one dump per row, so no data is
+    read or copied until used."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.header = DumpHeader.unpack(f.read(HEADER_SIZE))
+        h = self.header
+        rowsize = h.fftsize*h.dtype.itemsize
+        payload = os.path.getsize(filename) - HEADER_SIZE
+        # Number of full dumps in file. Writers not knowing the number of
+        # dumps, e.g. GNUradio, leave it as zero in header.
+        ndumps = payload//rowsize
+        if h.ndumps > 0:
+            ndumps = min(ndumps, h.ndumps)
+        # Bytes after the last full dump, e.g. if the writer was interrupted.
+        self.partial_bytes = payload - ndumps*rowsize
+        if ndumps == 0:
+            self.data = np.zeros((0, h.fftsize), dtype=h.dtype)
+        else:
+            self.data = np.memmap(filename, mode = 'r', dtype = h.dtype, offset = HEADER_SIZE, shape = (ndumps, h.fftsize))
+
+    def get_ndumps(self):
+        return len(self.data)
+
+    def get_mean_spectrum(self):
+        """Returns the mean of all dumps in float64, or None if no dumps."""
+        if self.get_ndumps() == 0:
+            return None
+        return self.data.sum(axis=0, dtype=np.float64)/self.get_ndumps()
+
+    def close(self):
+        # Release the memory map, e.g. before removing the file
+        del self.data
@@ -3,11 +3,14 @@ from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar2QTAgg
 import satellites # to cope with GNSS tracking
 import sys
+import os
 import ephem
 from PyQt5 import QtGui, QtCore, QtWidgets
 sys.path.append('./')
 from telescope import *
 from measurement import *
+from archive import ArchiveUploader, DONE, FAILED
+from sdfits import save_session_to_sdfits
 from UI import Ui_MainWindow
 from UI_LH import Ui_GNSSAzElWindow # to import Az-El View window
 import numpy as np
@@ -52,6 +55,11 @@ class Worker(QtCore.QObject):
         self.measurement.measure()
         self.finished.emit()
 
+# Object used to report the status of background archive uploads to the UI.
+# The signal is emitted from the upload thread and delivered in the GUI thread.
+class UploadStatus(QtCore.QObject):
+    changed = QtCore.pyqtSignal(str, str, str)
+
 # Implement custom Thread class, according to:
 # http://stackoverflow.com/questions/6783194/background-thread-with-qthread-in-pyqt
 class Thread(QtCore.QThread):
@@ -69,11 +77,17 @@ class main_window(QtWidgets.QMainWindow, Ui_MainWindow):
         super(main_window, self).__init__()
         # Dict used to store spectra observed in this session
         self.spectra = {}
+        self.session_start = time.strftime('%Y-%m-%dT%H%M%S')
         # Set current username, used for tmp files and spectrum uploads
         self.observer = getpass.getuser()
         # Set config file location
         self.config = configparser.ConfigParser()
         self.config.read(configfile)
+        # Upload spectra to the web archive in the background
+        self.uploadstatus = UploadStatus()
+        self.uploadstatus.changed.connect(self.upload_status_changed)
+        self.uploader = ArchiveUploader(self.config, self.uploadstatus.changed.emit)
+        self.uploadcount = 0
         # Initialise telescope and UI
         self.translator = QtCore.QTranslator(self)
         self.telescope = TelescopeController(self.config)
@@ -96,6 +110,10 @@ class main_window(QtWidgets.QMainWindow, Ui_MainWindow):
         self.progresstimer = QtCore.QTimer()
         self.progresstimer.timeout.connect(self.update_progressbar)
 
+        # Define timer to redraw spectrum preview during measurement
+        self.previewtimer = QtCore.QTimer()
+        self.previewtimer.timeout.connect(self.update_preview)
+
         # Define and run UiTimer
         self.uitimer = QtCore.QTimer()
         self.uitimer.timeout.connect(self.update_Ui)
@@ -259,6 +277,56 @@ class main_window(QtWidgets.QMainWindow, Ui_MainWindow):
         self.progressBar.setValue(int(100*self.lapsedtime/self.expectedtime))
         self.progressBar_ez.setValue(int(100*self.lapsedtime/self.expectedtime))
 
+    def clear_preview(self):
+        # Line of preview plot and its y label per figure, created at first snapshot
+        self.preview_lines = {}
+        self.preview_seq = 0
+
+    def update_preview(self):
+        # Show the running mean spectrum published by the measurement, so that
+        # bad integrations (RFI, wrong target) can be aborted early.
+        if not hasattr(self, 'sigworker'):
+            return
+        measurement = self.sigworker.measurement
+        snapshot = measurement.preview.get()
+        if snapshot is None or snapshot.seq == self.preview_seq:
+            return
+        self.preview_seq = snapshot.seq
+        if snapshot.sig is not None and snapshot.ref is not None:
+            y = (snapshot.sig-snapshot.ref)/snapshot.ref
+            ylabel = 'Signal - reference [relative]'
+        elif snapshot.sig is not None:
+            y = snapshot.sig
+            ylabel = 'Intensity [arbitrary units]'
+        else:
+            return
+        n = len(y)
+        x = 1e-6*measurement.bandwidth*np.arange(-n//2, n//2)/n
+        # avoid values at the edge of the band
+        x = x[5:-5]
+        y = y[5:-5]
+        title = 'Preview, ' + str(int(snapshot.elapsed)) + ' s measured'
+        for (figure, canvas) in [(self.figure, self.canvas), (self.figure_ez, self.canvas_ez)]:
+            # Axes are made again if what is shown changes, e.g. in switched
+            # mode when the first reference data arrives after signal only.
+            if figure not in self.preview_lines or self.preview_lines[figure][1] != ylabel:
+                figure.clear()
+                ax = figure.add_subplot(111)
+                ax.set_xlabel('Measured freq.-'+ str("{:6.1f}".format(measurement.sig_freq/1e6))+' [MHz]')
+                ax.set_ylabel(ylabel)
+                ax.grid(True, color='k', linestyle='-', linewidth=0.5)
+                (line,) = ax.plot(x, y, '-')
+                self.preview_lines[figure] = (line, ylabel)
+            else:
+                # Only update data of existing line, faster than replotting
+                line = self.preview_lines[figure][0]
+                line.set_data(x, y)
+                ax = line.axes
+                ax.relim()
+                ax.autoscale_view()
+            ax.set_title(title)
+            canvas.draw_idle()
+
     def disable_receiver_controls(self):
         self.int_time_spinbox.setReadOnly(True)
         self.gain.setReadOnly(True)
@@ -393,6 +461,9 @@ class main_window(QtWidgets.QMainWindow, Ui_MainWindow):
 
         if reply == QtWidgets.QMessageBox.Yes:
             self.save()
+            self.save_session()
+            # Finish uploads already started
+            self.uploader.stop()
             event.accept()
             self.close_GNSSAzEl()
         else:
@@ -447,6 +518,7 @@ class main_window(QtWidgets.QMainWindow, Ui_MainWindow):
             self.plot_ez(self.spectra[date])
         self.aborting = False
         self.progresstimer.stop()
+        self.previewtimer.stop()
         self.clear_progressbar()
         #Make sure receiver and current thread is stopped
         if hasattr(self, 'sigthread'):
@@ -461,7 +533,9 @@ class main_window(QtWidgets.QMainWindow, Ui_MainWindow):
         spectrum = self.spectra[date]
         if not spectrum.uploaded:
             tmpdir = self.config.get('USRP', 'tmpdir')
-            tmpfile = tmpdir + '/tmp_vale_' + spectrum.observer
+            # Unique names, since files are kept until uploaded
+            self.uploadcount += 1
+            tmpfile = tmpdir + '/tmp_vale_' + spectrum.observer + '_' + str(self.uploadcount)
             # Save temporary files
             txtfile = tmpfile + '.txt'
             spectrum.save_to_txt(txtfile)
@@ -469,12 +543,29 @@ class main_window(QtWidgets.QMainWindow, Ui_MainWindow):
             spectrum.save_to_fits(fitsfile)
             pngfile = tmpfile + '.png'
             self.figure.savefig(pngfile) # current item
-            spectrum.upload_to_archive(fitsfile, pngfile, txtfile)
+            self.uploader.submit(date, spectrum.get_archive_record(), (fitsfile, pngfile, txtfile), remove_files = True)
+            # Marked as uploaded while queued, to avoid uploading twice
+            spectrum.uploaded = True
             self.btn_upload.setEnabled(False)
 
+    def upload_status_changed(self, date, status, message):
+        print("Archive upload of " + date + ": " + message)
+        self.statusBar().showMessage(date + ": " + message, 5000)
+        spectrum = self.spectra.get(date)
+        if spectrum is None:
+            return
+        if status == DONE:
+            spectrum.uploaded = True
+        elif status == FAILED:
+            # Allow user to try again
+            spectrum.uploaded = False
+            if self.listWidget_spectra.currentItem() is not None and str(self.listWidget_spectra.currentItem().text()) == date:
+                self.btn_upload.setEnabled(True)
+
     def abort_obs(self):
         print("Aborting measurement.")
         self.aborting = True
+        self.previewtimer.stop()
         if hasattr(self, 'sigthread'):
             self.sigworker.measurement.abort = True
             self.sigworker.measurement.receiver.stop()
@@ -492,6 +583,8 @@ class main_window(QtWidgets.QMainWindow, Ui_MainWindow):
         self.btn_observe.setEnabled(False)
         self.clear_progressbar()
         self.progresstimer.start(1000) # ms
+        self.clear_preview()
+        self.previewtimer.start(250) # ms, only redrawn when new data
 
         ## Use LNA if selected
         #if self.LNA_checkbox.isChecked():
@@ -564,16 +657,11 @@ class main_window(QtWidgets.QMainWindow, Ui_MainWindow):
         ax = self.figure_ez.add_subplot(111)
         # Get the obs frequency
         obsFreq=float(spectpl.obs_freq/1.0e6)
-        if (spectpl.vlsr_corr!=0):
-            if self.radioButton_velocity.isChecked():
-                x = 1e-3 * (spectpl.get_vels())
-            else:
-                x = 1e-6*(spectpl.get_freqs() )-obsFreq
+        # Cached axes, shifted to LSR if VLSR correction has been applied
+        if self.radioButton_velocity.isChecked():
+            x = spectpl.get_axes().vels_kms
         else:
-            if self.radioButton_velocity.isChecked():
-                x = 1e-3 * (spectpl.get_vels() - spectpl.vlsr_corr)
-            else:
-                x = 1e-6*(spectpl.get_freqs() - spectpl.freq_vlsr_corr )-obsFreq
+            x = spectpl.get_axes().freq_offsets
         y = spectpl.data
 
         if (spectpl.vlsr_corr!=0):
@@ -630,16 +718,11 @@ class main_window(QtWidgets.QMainWindow, Ui_MainWindow):
         ax = self.figure.add_subplot(111)
         # Get the obs frequency
         obsFreq=float(spectpl.obs_freq/1.0e6)
-        if (spectpl.vlsr_corr!=0):
-            if self.radioButton_velocity.isChecked():
-                x = 1e-3 * (spectpl.get_vels())
-            else:
-                x = 1e-6*(spectpl.get_freqs() )-obsFreq
+        # Cached axes, shifted to LSR if VLSR correction has been applied
+        if self.radioButton_velocity.isChecked():
+            x = spectpl.get_axes().vels_kms
         else:
-            if self.radioButton_velocity.isChecked():
-                x = 1e-3 * (spectpl.get_vels() - spectpl.vlsr_corr)
-            else:
-                x = 1e-6*(spectpl.get_freqs() - spectpl.freq_vlsr_corr )-obsFreq
+            x = spectpl.get_axes().freq_offsets
         y = spectpl.data
 
         if (spectpl.vlsr_corr!=0):
@@ -1130,6 +1213,25 @@ class main_window(QtWidgets.QMainWindow, Ui_MainWindow):
         self.settings.setValue("language", self.languageselector.currentIndex())
         self.settings.setValue("maintab", self.Observebase.currentIndex())
 
+    def save_session(self):
+        # Save all spectra measured since the program was started, only if
+        # a directory is given in the config file. Nothing is written else.
+        save_dir = self.config.get('SESSION', 'save_dir', fallback='').strip()
+        if save_dir == '' or len(self.spectra) == 0:
+            return
+        spectra = [self.spectra[date] for date in sorted(self.spectra)]
+        outdir = os.path.join(expanduser(save_dir), "SALSA_" + self.observer + "_" + self.session_start)
+        try:
+            files = save_session_to_dir(spectra, outdir)
+            save_session_to_txt(spectra, os.path.join(outdir, "session.txt"))
+            # FITS files without rescaling to int16, next to the text files
+            for (spectrum, txtfile) in zip(spectra, files):
+                spectrum.save_to_fits(os.path.splitext(txtfile)[0] + ".fits", bitpix = -32)
+            save_session_to_sdfits(spectra, os.path.join(outdir, "session.fits"))
+            print("Saved " + str(len(spectra)) + " spectra in " + outdir)
+        except OSError as e:
+            print("WARNING: Could not save spectra in " + outdir + ": " + str(e))
+
 
 
 class GNSSAzEl_window(QtWidgets.QMainWindow, Ui_GNSSAzElWindow ):
@@ -616,7 +616,7 @@ class main_window(QtGui.QMainWindow, Ui_MainWindow):
             spectrum.save_to_fits(fitsfile)
             pngfile = tmpfile + '.png'
             plt.savefig(pngfile) # current item
-            spectrum.upload_to_archive(fitsfile, pngfile, txtfile)
+            spectrum.upload_to_archive(fitsfile, pngfile, txtfile, self.config)
             self.btn_upload.setEnabled(False)
 
     def abort_obs(self):
@@ -0,0 +1,206 @@
+import asyncio
+import collections
+import threading
+import time
+from rot2prog import *
+
+# Position read from a telescope, altitude and azimuth in MD01 coordinates
+# [degrees] and unix time of reading.
+Position = collections.namedtuple('Position', ['name', 'time', 'al', 'az'])
+
+class AsyncMD01():
+    """ Asyncio client for one MD01, so that several telescopes can be
+    polled and commanded concurrently from one process.
+
+    run() keeps a connection to the device and sends one command every
+    interval seconds: a stop if requested, else a new target if it has
+    changed, else a status request. The MD01 gives PULS TIMEOUT errors if
+    commands are sent more often than once per second, so interval shall
+    not be smaller than 1 s. Each device has its own cadence, so adding a
+    telescope does not change the timing of the others.
+
+    Targets and stops are only stored by set_target_alaz() and stop(),
+    and sent at the next command slot. Positions read are available from
+    get_current_alaz() and as a stream from positions(). If the connection
+    fails, it is opened again after a delay, which is doubled for every
+    failure up to max_backoff."""
+
+    def __init__(self, name, host, port, timeout = 2.0, interval = 1.0, max_backoff = 30.0, ph = 10, pv = 10):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.ph = ph # Pulses per degree
+        self.pv = pv
+        self.timeout = timeout # s
+        self.interval = max(1.0, interval) # s, never more than one command per second
+        self.min_backoff = 1.0 # s
+        self.max_backoff = max_backoff # s
+        self.reader = None
+        self.writer = None
+        self.running = False
+        self.target_alaz = None
+        self.commanded_alaz = None
+        self.stop_requested = False
+        self.position = None
+        self.subscribers = []
+        self.nrequests = 0
+        self.nerrors = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Create client from the SITE and MD01 sections of a config file."""
+        return cls(config.get('SITE', 'name'),
+                   config.get('MD01', 'host'),
+                   config.getint('MD01', 'port'),
+                   config.getfloat('MD01', 'timeout', fallback=2.0),
+                   config.getfloat('MD01', 'interval', fallback=1.0),
+                   config.getfloat('MD01', 'max_backoff', fallback=30.0),
+                   config.getint('MD01', 'ph', fallback=10),
+                   config.getint('MD01', 'pv', fallback=10))
+
+    def set_target_alaz(self, al, az):
+        """Move to altitude and azimuth [degrees] at the next command slot.
+        The position is rounded to the 0.1 degree resolution of the MD01.
+        Raises ValueError if the MD01 cannot move there."""
+        target = (round(al, 1), round(az, 1))
+        set_command(target[0], target[1], self.ph, self.pv) # Check angles
+        self.target_alaz = target
+
+    def stop(self):
+        """Stop movement at the next command slot and forget the target."""
+        self.target_alaz = None
+        self.stop_requested = True
+
+    def get_current_alaz(self):
+        """Returns the latest position read as (al, az), or None if not read yet."""
+        if self.position is None:
+            return None
+        return (self.position.al, self.position.az)
+
+    async def positions(self):
+        """Async generator of Position tuples, one for every position read.
+        A slow consumer only gets the latest position."""
+        queue = asyncio.Queue(maxsize=1)
+        self.subscribers.append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.subscribers.remove(queue)
+
+    async def run(self):
+        """Send commands until close() is called."""
+        loop = asyncio.get_event_loop()
+        self.running = True
+        backoff = 0
+        while self.running:
+            start = loop.time()
+            try:
+                await self._step()
+                backoff = 0
+                delay = self.interval
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                self.nerrors += 1
+                self._close()
+                backoff = min(self.max_backoff, max(self.min_backoff, 2*backoff))
+                delay = max(self.interval, backoff)
+                print("WARNING: {:s}: MD01 at {}:{} failed ({:s}), retrying in {:.0f} s".format(
+                    self.name, self.host, self.port, str(e) or type(e).__name__, delay))
+            # Wait for next command slot, counted from start of this command
+            await asyncio.sleep(max(0, start + delay - loop.time()))
+        # A stop requested just before close(), e.g. when quitting, is
+        # still sent in the next slot, so the telescope is not left moving.
+        if self.stop_requested:
+            try:
+                await self._step()
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                self.nerrors += 1
+                print("WARNING: {:s}: MD01 at {}:{} failed ({:s}), could not stop telescope".format(
+                    self.name, self.host, self.port, str(e) or type(e).__name__))
+        self._close()
+
+    def close(self):
+        """Stop run() after the current command, and a pending stop if
+        stop() has been called."""
+        self.running = False
+
+    async def _step(self):
+        if self.writer is None:
+            (self.reader, self.writer) = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout)
+        if self.stop_requested:
+            reply = await self._request(STOP)
+            self.stop_requested = False
+            self.commanded_alaz = None
+            self._publish(decode_reply(reply))
+        elif self.target_alaz is not None and self.target_alaz != self.commanded_alaz:
+            target = self.target_alaz
+            await self._request(set_command(target[0], target[1], self.ph, self.pv))
+            self.commanded_alaz = target
+        else:
+            reply = await self._request(STATUS)
+            self._publish(decode_reply(reply))
+
+    async def _request(self, msg):
+        self.nrequests += 1
+        self.writer.write(msg)
+        await self.writer.drain()
+        reply = await asyncio.wait_for(self.reader.readexactly(REPLY_SIZE), self.timeout)
+        check_reply(reply)
+        return reply
+
+    def _publish(self, alaz):
+        self.position = Position(self.name, time.time(), alaz[0], alaz[1])
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(self.position)
+
+    def _close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+class MD01Array():
+    """ Runs AsyncMD01 clients for several telescopes concurrently.
+
+    Either await run() from an asyncio program, or call start() to run
+    the clients in an event loop in a background thread, e.g. from a
+    program that is not based on asyncio. The functions of the clients
+    which only store a target or return the latest position may then be
+    called from the main thread."""
+
+    def __init__(self, clients):
+        self.clients = list(clients)
+        self.loop = None
+        self.thread = None
+
+    def __getitem__(self, i):
+        return self.clients[i]
+
+    def __len__(self):
+        return len(self.clients)
+
+    async def run(self):
+        await asyncio.gather(*[client.run() for client in self.clients])
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_until_complete, args=(self.run(),))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop all clients, and the background thread if started. Waits
+        until stops requested from the clients have been sent."""
+        for client in self.clients:
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(client.close)
+            else:
+                client.close()
+        if self.thread is not None:
+            self.thread.join()
+            self.loop.close()
+            self.thread = None
+            self.loop = None
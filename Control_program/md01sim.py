@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# Simulator of the MD01 rotor controller and telescope, to run the control
+# program, mapper or contlog.py without telescope. Listens for Rot2Prog
+# commands on TCP, like the Ethernet module of the MD01.
+# Usage: ./md01sim.py [configfile] [--host HOST] [--port PORT]
+# and set host and port in the MD01 section of the config file used by
+# the program to test.
+import sys
+import os
+import time
+import math
+import argparse
+import asyncio
+import configparser
+from rot2prog import *
+
+class SimulatedAxis():
+    """ One axis of the telescope, which moves towards its target with
+    constant acceleration up to a maximum rate, and decelerates to stop
+    at the target."""
+
+    def __init__(self, position, rate, accel, limits):
+        self.position = float(position) # deg
+        self.velocity = 0.0 # deg/s
+        self.target = float(position)
+        self.rate = float(rate) # deg/s
+        self.accel = float(accel) # deg/s^2
+        self.limits = limits # (min, max) deg
+
+    def set_target(self, target):
+        self.target = min(self.limits[1], max(self.limits[0], target))
+
+    def stop(self):
+        # Decelerate to stop as soon as possible
+        distance = self.velocity*abs(self.velocity)/(2*self.accel)
+        self.target = self.position + distance
+
+    def halt(self):
+        # Immediate stop, e.g. at a fault
+        self.velocity = 0.0
+        self.target = self.position
+
+    def is_moving(self):
+        return self.velocity != 0.0 or self.position != self.target
+
+    def advance(self, dt):
+        distance = self.target - self.position
+        if abs(distance) < 1e-9 and abs(self.velocity) <= self.accel*dt:
+            self.position = self.target
+            self.velocity = 0.0
+            return
+        # Fastest velocity from which we can still stop at target
+        wanted = math.copysign(min(self.rate, math.sqrt(2*self.accel*abs(distance))), distance)
+        dv = min(self.accel*dt, max(-self.accel*dt, wanted - self.velocity))
+        self.velocity += dv
+        step = self.velocity*dt
+        if step*distance > 0 and abs(step) >= abs(distance):
+            # Reached target within this step
+            self.position = self.target
+            self.velocity = 0.0
+        else:
+            self.position += step
+
+class SimulatedMD01():
+    """ Model of an MD01 with a telescope on an azimuth-altitude mount.
+
+    Settings are read from the MD01SIM section of the config file, with
+    defaults if missing:
+        rate_az, rate_al: Maximum slew rate of each axis [deg/s].
+        accel_az, accel_al: Acceleration of each axis [deg/s^2].
+        min_interval: Shortest time between commands [s], a bit less than
+            one second to allow for timer jitter. If a command comes
+            sooner, the MD01 goes into the PULS TIMEOUT fault, where the
+            telescope stops and set commands are ignored until the MD01
+            is restarted.
+        restart_time: Time for the MD01 to restart [s].
+    The telescope starts in the stow position, the altitude is limited
+    to minal and maxal of the MD01 section. Positions are read with the
+    resolution of the pulses per degree ph and pv, and reported in units
+    of 0.1 degrees, as by the MD01.
+
+    Time is given by the clock function, so that a test can advance
+    time without waiting."""
+
+    def __init__(self, config, clock = time.monotonic):
+        self.clock = clock
+        self.ph = config.getint('MD01', 'ph', fallback=10)
+        self.pv = config.getint('MD01', 'pv', fallback=10)
+        self.min_interval = config.getfloat('MD01SIM', 'min_interval', fallback=0.9)
+        self.restart_time = config.getfloat('MD01SIM', 'restart_time', fallback=19.0)
+        self.az = SimulatedAxis(config.getfloat('MD01', 'stowaz'),
+                                config.getfloat('MD01SIM', 'rate_az', fallback=1.0),
+                                config.getfloat('MD01SIM', 'accel_az', fallback=2.0),
+                                AZ_RANGE)
+        self.al = SimulatedAxis(config.getfloat('MD01', 'stowal'),
+                                config.getfloat('MD01SIM', 'rate_al', fallback=1.0),
+                                config.getfloat('MD01SIM', 'accel_al', fallback=2.0),
+                                (config.getfloat('MD01', 'minal'), config.getfloat('MD01', 'maxal')))
+        self.step = 0.01 # Time step of simulation [s]
+        self.time = self.clock()
+        self.last_command = None
+        self.fault = None
+        self.restart_done = 0
+        # Statistics
+        self.ncommands = 0
+        self.nfaults = 0
+
+    def update(self):
+        """Move axes to the current time."""
+        now = self.clock()
+        while self.time < now:
+            dt = min(self.step, now - self.time)
+            self.az.advance(dt)
+            self.al.advance(dt)
+            self.time += dt
+
+    def get_alaz(self):
+        """Returns the position read by the MD01, rounded to the nearest pulse."""
+        self.update()
+        return (round(self.al.position*self.pv)/self.pv, round(self.az.position*self.ph)/self.ph)
+
+    def is_restarting(self):
+        return self.clock() < self.restart_done
+
+    def handle(self, packet):
+        """Returns the reply to a command packet, or None if there is no reply.
+        Raises MD01Error if the packet is invalid."""
+        (command, al, az, ph, pv) = decode_command(packet)
+        self.update()
+        now = self.clock()
+        self.ncommands += 1
+        if command == 'restart':
+            self.az.halt()
+            self.al.halt()
+            self.fault = None
+            self.last_command = None
+            self.restart_done = now + self.restart_time
+            return None
+        if self.last_command is not None and now - self.last_command < self.min_interval and self.fault is None:
+            self.fault = 'PULS TIMEOUT'
+            self.nfaults += 1
+            self.az.halt()
+            self.al.halt()
+            print("MD01 simulator: PULS TIMEOUT, {:.2f} s since last command".format(now - self.last_command))
+        self.last_command = now
+        if command == 'stop':
+            self.az.stop()
+            self.al.stop()
+        elif command == 'set' and self.fault is None:
+            self.az.set_target(az)
+            self.al.set_target(al)
+        elif command == 'calibrate':
+            self.az.position = self.az.target = az
+            self.al.position = self.al.target = al
+        elif command == 'reset':
+            self.az.position = self.az.target = 0.0
+            self.al.position = self.al.target = 0.0
+        return encode_reply(*self.get_alaz(), self.ph, self.pv)
+
+class MD01Server():
+    """ TCP server giving access to a SimulatedMD01, like the MD01 Ethernet
+    module. If several clients connect, they control the same MD01."""
+
+    def __init__(self, md01, host = '127.0.0.1', port = 2323):
+        self.md01 = md01
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self.start()
+        print("MD01 simulator listening on {}:{}".format(self.host, self.port))
+        async with self.server:
+            await self.server.serve_forever()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    async def _handle(self, reader, writer):
+        try:
+            data = b''
+            while not self.md01.is_restarting():
+                packet = data + await reader.readexactly(REPLY_SIZE+1 - len(data))
+                data = b''
+                try:
+                    reply = self.md01.handle(packet)
+                except MD01Error as e:
+                    print("MD01 simulator: " + str(e))
+                    # Resynchronize on the next start byte, like the MD01,
+                    # instead of reading packets at a fixed offset
+                    i = packet.find(bytes([START]), 1)
+                    if i > 0:
+                        data = packet[i:]
+                    continue
+                if reply is None:
+                    # Restarting, connection is lost
+                    break
+                writer.write(reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='MD01 simulator')
+    parser.add_argument('configfile', nargs='?',
+                        default=os.path.dirname(os.path.realpath(__file__)) + '/SALSA.config.default',
+                        help='config file with MD01 and MD01SIM sections')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=2323, help='port to listen on')
+    args = parser.parse_args()
+    config = configparser.ConfigParser()
+    config.read(args.configfile)
+    server = MD01Server(SimulatedMD01(config), args.host, args.port)
+    try:
+        asyncio.get_event_loop().run_until_complete(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -1,16 +1,21 @@
-from receiver import *
+from backend import *
+from accumulator import *
+from waterfall import *
+from dumpfile import *
 from spectrum import *
+from scheduler import *
+from vlsr import *
 import ephem
 import matplotlib.pyplot as plt
 import numpy as np
 import math
 import os
 import time
-from multiprocessing.pool import ThreadPool as Pool
+import threading
 
 class Measurement:
 
-    def __init__(self, c_freq, ref_freq, switched, int_time, sig_time, ref_time, bandwidth, alt, az, site, noutchans, username, config, offset_alt, offset_az, usrp_gain, coordsys, satellite = ""):
+    def __init__(self, c_freq, ref_freq, switched, int_time, sig_time, ref_time, bandwidth, alt, az, site, noutchans, username, config, offset_alt, offset_az, usrp_gain, coordsys, satellite = "", session = None):
         # Copy everything to make sure immutable operations
         # do not change the original input objects in case
         # we pass references to this constructor.
@@ -51,87 +56,97 @@ class Measurement:
         self.ref_time = ref_time
         self.coordsys = coordsys
         self.satellite = satellite
-        self.abort = False
+        # Used to abort measurement from GUI thread, see abort property
+        self.cancel_token = CancelToken()
+        # Waterfall cubes written during measurement, if enabled
+        self.waterfall_files = []
+        # Running mean spectra published every preview_interval seconds
+        # during the measurement, e.g. to be shown by the GUI.
+        self.preview = SnapshotBuffer()
+        self.preview_interval = config.getfloat('USRP', 'preview_interval', fallback=1.0)
+        self.preview_thread = None
 
         self.outfile = outfile =  config.get('USRP', 'tmpdir') + "/SALSA_" + username
+        # Either stack spectra in memory while measuring, or write them
+        # to temporary files which are stacked after the measurement.
+        self.sink_mode = config.get('USRP', 'sink_mode', fallback='memory')
         
-        # Create receiver object to run GNUradio flowgraph.
+        # Borrow receiver object to run GNUradio flowgraph from a session
+        # which is kept between measurements, to avoid reconnecting to the USRP.
         # Using both upper and lower sideband, so bandwidth is equal to 
         # sampling rate, not half.
-        self.receiver = SALSA_Receiver(c_freq, int_time, bandwidth, self.fftsize, self.observer, config, self.usrp_gain)
+        # In wideband switch mode, signal and reference are received at the same time
+        # from one wider band, instead of switching the LO between them.
+        self.wideband = self.switched and config.get('USRP', 'switch_mode', fallback='lo') == "wideband"
+        if self.wideband:
+            band_freqs = (self.sig_freq, self.ref_freq)
+        else:
+            band_freqs = None
+        if session is None:
+            session = get_receiver_session(config, username)
+        self.session = session
+        self.receiver = session.acquire(self.sig_freq, self.int_time, self.bandwidth, self.fftsize, self.usrp_gain, self.sink_mode, band_freqs)
+
+    @property
+    def abort(self):
+        return self.cancel_token.is_cancelled()
+
+    @abort.setter
+    def abort(self, value):
+        # Setting abort wakes up the measurement thread immediately
+        if value:
+            self.cancel_token.cancel()
 
     def measure(self):
+       if self.sink_mode == "memory":
+            self.receiver.sig_accumulator.reset()
+            self.receiver.ref_accumulator.reset()
+            self.start_waterfall()
+            self.start_doppler_tracking()
+       elif self.switched == True:
+            # Stack closed signal and reference files in background while
+            # measuring, so post-processing time does not grow with loops.
+            self.sig_stacker = FileStacker(SpectrumAccumulator(self.fftsize), self.stack_measured_FFTs)
+            self.ref_stacker = FileStacker(SpectrumAccumulator(self.fftsize), self.stack_measured_FFTs)
+            self.pending_sig = None
+            self.pending_ref = None
        self.receiver.start()
+       self.start_preview()
+       self.sigCount = 0 #Counter for signal and reference files
+       self.refCount = 0
+       scheduler = SwitchScheduler(self.cancel_token)
        if self.switched == True:
-            self.sigCount = 0 #Counter for signal and reference files
-            self.refCount = 0
-            self.signal_time = 0 #Actual signal time
-            self.reference_time = 0
-                        
-            t_end = time.time() + self.int_time #Run loop for total observation time
-            while time.time() <= t_end and self.abort == False:
-                self.receiver.uhd_usrp_source_0.set_center_freq(self.sig_freq, 0) #Switch to signal frequency
-                time.sleep(10e-3) #Sleep in order for LO to lock and GNURadio stream to clear out, can be lowered
-                self.receiver.lock()
-                self.receiver.signal_file_sink_1.open(self.outfile + "_sig" + str(self.sigCount)) #Switch to signal file sink
-                self.receiver.unlock()
-                self.receiver.blks2_selector_0.set_output_index(1) #Switch GNURadio stream to signal file sink (switching just file sinks also works but this functions as extra security)
-                t_end2 = time.time() + self.sig_time
-                start = time.time()
-                print("Measuring signal...")
-                while time.time() <= t_end2 and time.time() <= t_end and self.abort == False: #Continue stream to signal file sink for set signal time
-                      continue
-                self.receiver.blks2_selector_0.set_output_index(0) #Switch to null sink for blanking time
-                self.receiver.lock()
-                self.receiver.signal_file_sink_1.close() #Close current file sink
-                self.receiver.unlock()
-                end = time.time()
-                self.signal_time += (end-start)
-                self.sigCount +=1
-                self.receiver.uhd_usrp_source_0.set_center_freq(self.ref_freq, 0) #Switch to reference frequency
-                time.sleep(10e-3)
-                self.receiver.lock()
-                self.receiver.signal_file_sink_2.open(self.outfile + "_ref" + str(self.refCount)) #Switch to reference file sink
-                self.receiver.unlock()
-                self.receiver.blks2_selector_0.set_output_index(2) #Switch GNURadio stream to reference file sink
-                t_end3 = time.time() + self.ref_time
-                start1 = time.time()
-                print("...done.")
-                print("Measuring reference...")
-                while time.time() <= t_end3 and time.time() <= t_end and self.abort == False:
-                      continue
-                self.receiver.blks2_selector_0.set_output_index(0)
-                self.receiver.lock()
-                self.receiver.signal_file_sink_2.close()
-                self.receiver.unlock()
-                end1 = time.time()
-                self.reference_time += (end1-start1)
-                self.refCount +=1
-                print("...done.")
-        
-            self.sigList = [] #Init signal file sink list
-            self.refList = []
-
-            for i in range(self.sigCount):
-                item = self.outfile + "_sig" + str(i) #Append items depending on the amount of files
-                self.sigList.append(item)
-            for i in range(self.refCount):
-                item = self.outfile + "_ref" + str(i)
-                self.refList.append(item)
-                        
-            #Incase loop starts at end of integration time (empty files might occur)
-            if os.path.getsize(self.outfile + "_sig" + str(self.sigCount-1)) == 0:
-                self.sigList.remove(self.outfile + "_sig" + str(self.sigCount-1))
-                self.refList.remove(self.outfile + "_ref" + str(self.refCount-1))                               
-            elif os.path.getsize(self.outfile + "_ref" + str(self.refCount-1)) == 0:
-                self.refList.remove(self.outfile + "_ref" + str(self.refCount-1))
+            if self.wideband:
+                # Both signal and reference measured during the whole observation time
+                both_phase = Phase("both", self.int_time, self.start_both, self.stop_both)
+                times = scheduler.run([both_phase], self.int_time, loop = False)
+                times["sig"] = times["ref"] = times["both"]
+            else:
+                sig_phase = Phase("sig", self.sig_time, self.start_signal, self.stop_signal)
+                ref_phase = Phase("ref", self.ref_time, self.start_reference, self.stop_reference)
+                #Run loop for total observation time
+                times = scheduler.run([sig_phase, ref_phase], self.int_time)
+            self.session.release()
+            self.stop_preview()
+            self.stop_waterfall()
+            self.stop_doppler_tracking()
+            self.signal_time = times["sig"] #Actual signal time
+            self.reference_time = times["ref"]
 
             print("Actual Signal time: ", self.signal_time)
             print("Actual Reference time: ", self.reference_time) 
-            #Stack all the data
+            if self.sink_mode == "memory":
+                # Spectra already stacked in memory during the measurement
+                sig_spec = self.receiver.sig_accumulator.get_spectrum()
+                ref_spec = self.receiver.ref_accumulator.get_spectrum()
+            else:
+                # Most files already stacked during the measurement,
+                # only the last ones remain.
+                sig_spec = self.finish_stacking(self.sig_stacker, self.pending_sig)
+                ref_spec = self.finish_stacking(self.ref_stacker, self.pending_ref)
             # Multiply with 1000 to get higher raw intensity numbers for printout
-            self.sig_spec = 1000*self.stack_all_data(self.sigList)
-            self.ref_spec = 1000*self.stack_all_data(self.refList)
+            self.sig_spec = [1000*self.check_spectrum(sig_spec)]
+            self.ref_spec = [1000*self.check_spectrum(ref_spec)]
                
             if self.abort == False:
                 #Calculates mean value for all signal and reference data
@@ -140,49 +155,208 @@ class Measurement:
                 self.signal_spec = SALSA_spectrum(self.SIG_data, self.receiver.get_samp_rate(), self.receiver.get_fftsize(), self.sig_freq, self.site, self.alt, self.az, self.int_time, self.observer, self.config, self.offset_alt, self.offset_az, self.coordsys, self.satellite)
                 self.reference_spec = SALSA_spectrum(self.REF_data, self.receiver.get_samp_rate(), self.receiver.get_fftsize(), self.ref_freq, self.site, self.alt, self.az, self.int_time, self.observer, self.config, self.offset_alt, self.offset_az, self.coordsys, self.satellite)
        else:#Unswitched measurement
-            self.receiver.uhd_usrp_source_0.set_center_freq(self.sig_freq, 0)
-            time.sleep(10e-3)
-            self.receiver.lock()
-            self.receiver.signal_file_sink_1.open(self.outfile + "_sig")
-            self.receiver.unlock()
-            self.receiver.blks2_selector_0.set_output_index(1)
-            end = time.time() + self.sig_time
-            while time.time() <= end and self.abort == False:
-                 continue
-            self.receiver.blks2_selector_0.set_output_index(0)
-            self.receiver.lock()
-            self.receiver.signal_file_sink_1.close()
-            self.receiver.unlock()
+            sig_phase = Phase("sig", self.sig_time, self.start_signal, self.stop_signal)
+            scheduler.run([sig_phase], self.sig_time, loop = False)
+            self.session.release()
+            self.stop_preview()
+            self.stop_waterfall()
+            self.stop_doppler_tracking()
                         
             if self.abort == False:
                 # Multiply with 1000 to get higher raw intensity numbers for printout
-                spec = 1000*self.stack_measured_FFTs(self.outfile + "_sig")
+                if self.sink_mode == "memory":
+                    spec = self.receiver.sig_accumulator.get_spectrum()
+                else:
+                    spec = self.stack_measured_FFTs(self.outfile + "_sig" + str(self.sigCount-1))
+                spec = 1000*self.check_spectrum(spec)
                 self.signal_spec = SALSA_spectrum(spec, self.receiver.get_samp_rate(), self.receiver.get_fftsize(), self.sig_freq, self.site, self.alt, self.az, self.int_time, self.observer, self.config, self.offset_alt, self.offset_az, self.coordsys, self.satellite)
-               
-    def stack_all_data(self, files):
-        pool = Pool(processes=4)
-        spectra = pool.map(self.stack_measured_FFTs, files)
-        pool.terminate()
-        return spectra
+
+    def start_waterfall(self):
+        """If enabled in config file, store every dump in a waterfall cube
+        on disk, in addition to the stacked spectrum."""
+        self.waterfall_files = []
+        if not self.config.getboolean('USRP', 'waterfall', fallback=False):
+            return
+        dtype = self.config.get('USRP', 'waterfall_dtype', fallback='float16')
+        chan_avg = self.config.getint('USRP', 'waterfall_chan_avg', fallback=1)
+        outdir = self.config.get('USRP', 'waterfall_dir', fallback=self.config.get('USRP', 'tmpdir'))
+        dump_period = get_integration_length(self.config, self.bandwidth)*self.fftsize/self.bandwidth
+        date = self.site.date.datetime().strftime('%Y-%m-%dT%H%M%S')
+        bands = [("sig", SIG, self.sig_freq, self.receiver.sig_accumulator)]
+        if self.switched:
+            bands.append(("ref", REF, self.ref_freq, self.receiver.ref_accumulator))
+        for (band, output, freq, accumulator) in bands:
+            filename = outdir + "/SALSA_" + self.observer + "_" + date + "_" + band + ".wf"
+            header = DumpHeader(self.fftsize, self.bandwidth, freq, time.time(), output)
+            accumulator.set_recorder(WaterfallWriter(filename, header, dump_period, dtype, chan_avg))
+            self.waterfall_files.append(filename)
+        print("Storing waterfall data in " + ", ".join(self.waterfall_files))
+
+    def stop_waterfall(self):
+        if self.sink_mode != "memory":
+            return
+        for accumulator in [self.receiver.sig_accumulator, self.receiver.ref_accumulator]:
+            if accumulator.recorder is not None:
+                accumulator.recorder.close()
+                accumulator.set_recorder(None)
+
+    def start_doppler_tracking(self):
+        """If enabled in config file, shift every dump in frequency to
+        compensate for the change of observed velocity of the target
+        during the measurement, before stacking. The final spectrum then
+        corresponds to the start of the measurement, for which the
+        VLSR correction is calculated."""
+        if not self.config.getboolean('USRP', 'doppler_tracking', fallback=False):
+            return
+        # Pointing in J2000, as in SALSA_spectrum
+        (ra, dec) = self.site.radec_of(self.az*np.pi/180.0, self.alt*np.pi/180.0)
+        pointing = ephem.FixedBody()
+        pointing._ra = ra
+        pointing._dec = dec
+        pointing._epoch = ephem.now()
+        pointing.compute(self.site)
+        target = ephem.Equatorial(pointing, epoch=ephem.J2000)
+        start_time = (float(self.site.date) - float(ephem.Date('1970/1/1')))*86400.0
+        dump_period = get_integration_length(self.config, self.bandwidth)*self.fftsize/self.bandwidth
+        tracker = DopplerTracker(float(target.ra), float(target.dec), start_time, HI_REST_FREQ,
+                                 self.bandwidth/self.fftsize, dump_period, float(self.site.lat), float(self.site.long))
+        # Same shift for reference, to keep the band-pass aligned with the signal
+        self.receiver.sig_accumulator.set_doppler_tracker(tracker)
+        self.receiver.ref_accumulator.set_doppler_tracker(tracker)
+
+    def stop_doppler_tracking(self):
+        if self.sink_mode != "memory":
+            return
+        self.receiver.sig_accumulator.set_doppler_tracker(None)
+        self.receiver.ref_accumulator.set_doppler_tracker(None)
+
+    def get_preview_accumulators(self):
+        """Returns the signal and reference accumulators holding the data
+        measured so far, or None where not available during measurement."""
+        if self.sink_mode == "memory":
+            if self.switched:
+                return (self.receiver.sig_accumulator, self.receiver.ref_accumulator)
+            return (self.receiver.sig_accumulator, None)
+        elif self.switched:
+            # Only files already stacked, so preview lags one switch cycle
+            return (self.sig_stacker.accumulator, self.ref_stacker.accumulator)
+        else:
+            # Unswitched file measurements are stacked after the measurement
+            return (None, None)
+
+    def start_preview(self):
+        if self.preview_interval <= 0:
+            return
+        self.preview_start = time.time()
+        self.preview_done = threading.Event()
+        self.preview_thread = threading.Thread(target=self._run_preview)
+        self.preview_thread.daemon = True
+        self.preview_thread.start()
+
+    def stop_preview(self):
+        if self.preview_thread is not None:
+            self.preview_done.set()
+            self.preview_thread.join()
+            self.preview_thread = None
+
+    def _run_preview(self):
+        seq = 0
+        (sig_acc, ref_acc) = self.get_preview_accumulators()
+        while not self.preview_done.wait(self.preview_interval):
+            if sig_acc is None:
+                continue
+            sig = sig_acc.get_spectrum()
+            ref = None
+            if ref_acc is not None:
+                ref = ref_acc.get_spectrum()
+            if sig is None and ref is None:
+                continue
+            seq += 1
+            # Multiply with 1000 as the final spectra
+            self.preview.publish(SpectrumSnapshot(seq, time.time()-self.preview_start,
+                None if sig is None else 1000*sig, None if ref is None else 1000*ref))
+
+    def start_signal(self):
+        self.receiver.tune(self.sig_freq) #Switch to signal frequency
+        self.cancel_token.sleep(10e-3) #Sleep in order for LO to lock and GNURadio stream to clear out, can be lowered
+        if self.sink_mode == "file":
+            self.receiver.open_dump(SIG, self.outfile + "_sig" + str(self.sigCount)) #Switch to signal file sink
+        self.receiver.select(SIG) #Switch GNURadio stream to signal sink (switching just file sinks also works but this functions as extra security)
+        print("Measuring signal...")
+
+    def stop_signal(self):
+        self.receiver.select(NULL) #Switch to null sink for blanking time
+        if self.sink_mode == "file":
+            self.receiver.close_dump(SIG) #Close current file sink
+            if self.switched == True:
+                self.pending_sig = self.submit_for_stacking(self.sig_stacker, self.pending_sig, self.outfile + "_sig" + str(self.sigCount))
+        self.sigCount +=1
+        print("...done.")
+
+    def start_reference(self):
+        self.receiver.tune(self.ref_freq) #Switch to reference frequency
+        self.cancel_token.sleep(10e-3)
+        if self.sink_mode == "file":
+            self.receiver.open_dump(REF, self.outfile + "_ref" + str(self.refCount)) #Switch to reference file sink
+        self.receiver.select(REF) #Switch GNURadio stream to reference sink
+        print("Measuring reference...")
+
+    def stop_reference(self):
+        self.receiver.select(NULL)
+        if self.sink_mode == "file":
+            self.receiver.close_dump(REF)
+            self.pending_ref = self.submit_for_stacking(self.ref_stacker, self.pending_ref, self.outfile + "_ref" + str(self.refCount))
+        self.refCount +=1
+        print("...done.")
+
+    def start_both(self):
+        if self.sink_mode == "file":
+            self.receiver.open_dump(SIG, self.outfile + "_sig" + str(self.sigCount))
+            self.receiver.open_dump(REF, self.outfile + "_ref" + str(self.refCount))
+        self.receiver.select(SIG) # Starts recording of both bands
+        print("Measuring signal and reference...")
+
+    def stop_both(self):
+        self.receiver.select(NULL)
+        if self.sink_mode == "file":
+            self.receiver.close_dump(SIG)
+            self.receiver.close_dump(REF)
+            self.pending_sig = self.submit_for_stacking(self.sig_stacker, self.pending_sig, self.outfile + "_sig" + str(self.sigCount))
+            self.pending_ref = self.submit_for_stacking(self.ref_stacker, self.pending_ref, self.outfile + "_ref" + str(self.refCount))
+        self.sigCount +=1
+        self.refCount +=1
+        print("...done.")
+
+    def submit_for_stacking(self, stacker, pending, closed):
+        # The file sink only finishes writing a closed file when it receives
+        # data for the next file, so we stack the previous file of this band
+        # and keep the one just closed as pending.
+        if pending is not None:
+            stacker.submit(pending)
+        return closed
+
+    def finish_stacking(self, stacker, pending):
+        if pending is not None:
+            stacker.submit(pending)
+        return stacker.finish()
+
+    def check_spectrum(self, spec):
+        if spec is None:
+            print("WARNING: No spectra received during measurement.")
+            spec = np.zeros(self.receiver.get_fftsize())
+        return spec
 
     def stack_measured_FFTs(self,infile):
-        fftsize = self.receiver.get_fftsize() 
-        samp_rate = self.receiver.get_samp_rate()
-
-        # Load FFT segments as memory mapped file in case it is large
-        signal = np.memmap(infile, mode = 'r', dtype=np.float32)
-        #print np.size(signal)# 19999744 for 10s data, but should be 2e7...
-        # Will take only full spectra to stack, not the missing last(or first) samples.
-        nspec = int(signal.size/fftsize) # Now floored to contain only full spectra
-        goodpoints = nspec*fftsize # The number of good samples (excluding last partial spectra)
-        signal = signal[0:goodpoints]
-        spec = signal.reshape((nspec,fftsize))
-        spec = spec.sum(axis=0)
-        # Normalise power spectrum to be invariant of
-        # integration time
-        spec = spec/(1.0*nspec)
+        # FFT segments are memory mapped, in case the file is large.
+        # Only full spectra are stacked, not a missing last part.
+        dumpfile = DumpFile(infile)
+        if dumpfile.partial_bytes > 0:
+            print("WARNING: Ignoring " + str(dumpfile.partial_bytes) + " bytes of partial spectrum in " + infile)
+        # Normalise power spectrum to be invariant of integration time.
+        # None if no full spectrum in file, e.g. if loop starts at end of integration time.
+        spec = dumpfile.get_mean_spectrum()
         # Clean up temporary object and file
-        del signal
+        dumpfile.close()
         os.remove(infile)
         return spec
         
@@ -16,12 +16,30 @@ from gnuradio.fft import window
 from gnuradio.filter import firdes
 from optparse import OptionParser
 from gnuradio import filter
+from accumulator import *
+from backend import *
+import numpy as np
 import time
 import threading
 
-class SALSA_Receiver(gr.top_block):
+class accumulator_sink(gr.sync_block):
+    """ GNUradio sink which adds every incoming FFT vector to a SpectrumAccumulator
+    instead of writing it to disk."""
 
-    def __init__(self, c_freq, int_time, samp_rate, fftsize, username, config, usrp_gain):
+    def __init__(self, fftsize, accumulator):
+        gr.sync_block.__init__(self,
+            name="accumulator_sink",
+            in_sig=[(np.float32, fftsize)],
+            out_sig=None)
+        self.accumulator = accumulator
+
+    def work(self, input_items, output_items):
+        self.accumulator.add(input_items[0])
+        return len(input_items[0])
+
+class SALSA_Receiver(gr.top_block, ReceiverBackend):
+
+    def __init__(self, c_freq, int_time, samp_rate, fftsize, username, config, usrp_gain, sink_mode = "memory"):
         gr.top_block.__init__(self, "Salsa Receiver")
 
         ##################################################
@@ -34,10 +52,21 @@ class SALSA_Receiver(gr.top_block):
         self.fftsize = fftsize
         self.c_freq = c_freq
         self.probe_var = probe_var = 0
+        # "memory" keeps running sums of the spectra in RAM,
+        # "file" writes every spectrum to a temporary file.
+        self.sink_mode = sink_mode
+        # None when receiving one band, else (sig_freq, ref_freq) to
+        # receive signal and reference bands at the same time.
+        self.band_freqs = None
+        self.max_samp_rate = config.getfloat('USRP', 'max_samp_rate', fallback=25e6)
         
-        #Integrate 10 FFTS using IIR block and keep 1 in N, increase for higher bandwidths to lower processing times.
+        # "iir" integrates 10 FFTS using IIR block and keeps 1 in N,
+        # "boxcar" sums exactly N FFTs per output spectrum so all samples are used.
+        # N is set per bandwidth in config file, larger N for higher bandwidths to lower processing times.
+        self.config = config
+        self.integration = config.get('USRP', 'integration', fallback='iir')
         self.alpha = 0.1
-        self.N = 10
+        self.N = get_integration_length(config, samp_rate)
 
         ##################################################
         # Blocks
@@ -54,47 +83,143 @@ class SALSA_Receiver(gr.top_block):
         self.uhd_usrp_source_0.set_samp_rate(samp_rate)
         self.uhd_usrp_source_0.set_center_freq(c_freq, 0)
         self.uhd_usrp_source_0.set_gain(self.gain, 0)
-        
-        self.fft_vxx_0 = fft.fft_vcc(fftsize, True, (window.blackmanharris(fftsize)), True, 1)
-        self.blocks_vector_to_stream_0 = blocks.vector_to_stream(gr.sizeof_float*1, fftsize)
-        self.blocks_stream_to_vector_0 = blocks.stream_to_vector(gr.sizeof_gr_complex*1, fftsize)
-        self.blocks_complex_to_mag_squared_0 = blocks.complex_to_mag_squared(fftsize)
-        self.single_pole_iir_filter_xx_0 = filter.single_pole_iir_filter_ff(self.alpha, fftsize)
-        self.blocks_keep_one_in_n_0 = blocks.keep_one_in_n(gr.sizeof_float*fftsize, self.N)
-
-
-        #Signal and reference file sinks
-        self.signal_file_sink_1 = blocks.file_sink(gr.sizeof_float*1, self.outfile, False)
-        self.signal_file_sink_1.set_unbuffered(False)
-        self.signal_file_sink_2 = blocks.file_sink(gr.sizeof_float*1, self.outfile, False)
-        self.signal_file_sink_2.set_unbuffered(False)
-        self.blocks_null_sink = blocks.null_sink(gr.sizeof_float*1)	
-		#Selector for switch
-        #self.blks2_selector_0 = grc_blks2.selector(
-        self.blks2_selector_0 = blocks.selector(
-            itemsize=gr.sizeof_float*1,
-            input_index=0,
-            output_index=0,
-        )
-		
-        ##################################################
-        # Connections
-        ##################################################
-        self.connect((self.uhd_usrp_source_0, 0), (self.blocks_stream_to_vector_0, 0))
-        self.connect((self.blocks_stream_to_vector_0, 0), (self.fft_vxx_0, 0))
-        self.connect((self.fft_vxx_0, 0), (self.blocks_complex_to_mag_squared_0, 0))
-        self.connect((self.blocks_complex_to_mag_squared_0, 0), (self.single_pole_iir_filter_xx_0, 0))
-        self.connect((self.single_pole_iir_filter_xx_0, 0), (self.blocks_keep_one_in_n_0, 0))
-        self.connect((self.blocks_keep_one_in_n_0, 0), (self.blocks_vector_to_stream_0, 0))
-        self.connect((self.blocks_vector_to_stream_0, 0), (self.blks2_selector_0, 0))
-        
-        #Selector connections
-        self.connect((self.blks2_selector_0, 1), (self.signal_file_sink_1, 0))
-        self.connect((self.blks2_selector_0, 2), (self.signal_file_sink_2, 0))
-		
-    	#Null sink connection
+
+        self.build_chain()
+
+    def build_chain(self):
+        """Create and connect all blocks after the USRP source. Called again
+        by set_fftsize, set_sink_mode, set_samp_rate and set_band_freqs, with
+        the flowgraph stopped, so that the USRP connection can be kept while
+        changing these settings."""
+        fftsize = self.fftsize
+        if self.sink_mode == "memory":
+            #Signal and reference accumulators
+            self.sig_accumulator = SpectrumAccumulator(fftsize)
+            self.ref_accumulator = SpectrumAccumulator(fftsize)
+            self.signal_accumulator_sink_1 = accumulator_sink(fftsize, self.sig_accumulator)
+            self.signal_accumulator_sink_2 = accumulator_sink(fftsize, self.ref_accumulator)
+        else:
+            #Signal and reference file sinks
+            #Appending, since open_dump writes a header before data
+            self.signal_file_sink_1 = blocks.file_sink(gr.sizeof_float*1, self.outfile, True)
+            self.signal_file_sink_1.set_unbuffered(False)
+            self.signal_file_sink_2 = blocks.file_sink(gr.sizeof_float*1, self.outfile, True)
+            self.signal_file_sink_2.set_unbuffered(False)
+        if self.band_freqs is None:
+            self.build_single_band_chain()
+        else:
+            self.build_dual_band_chain()
+
+    def build_spectrum_chain(self, source):
+        """Create and connect blocks computing integrated power spectra
+        from the complex stream at the given source block. Returns the last block."""
+        fftsize = self.fftsize
+        stream_to_vector = blocks.stream_to_vector(gr.sizeof_gr_complex*1, fftsize)
+        fft_vxx = fft.fft_vcc(fftsize, True, (window.blackmanharris(fftsize)), True, 1)
+        complex_to_mag_squared = blocks.complex_to_mag_squared(fftsize)
+        self.connect((source, 0), (stream_to_vector, 0))
+        self.connect((stream_to_vector, 0), (fft_vxx, 0))
+        self.connect((fft_vxx, 0), (complex_to_mag_squared, 0))
+        if self.integration == "boxcar":
+            integrate = blocks.integrate_ff(self.N, fftsize)
+            # Divide sum by N to keep the same levels as in IIR mode
+            multiply_const = blocks.multiply_const_vff([1.0/self.N]*fftsize)
+            self.connect((complex_to_mag_squared, 0), (integrate, 0))
+            self.connect((integrate, 0), (multiply_const, 0))
+            return multiply_const
+        else:
+            single_pole_iir_filter = filter.single_pole_iir_filter_ff(self.alpha, fftsize)
+            keep_one_in_n = blocks.keep_one_in_n(gr.sizeof_float*fftsize, self.N)
+            self.connect((complex_to_mag_squared, 0), (single_pole_iir_filter, 0))
+            self.connect((single_pole_iir_filter, 0), (keep_one_in_n, 0))
+            return keep_one_in_n
+
+    def build_single_band_chain(self):
+        fftsize = self.fftsize
+        self.blocks_integrated = self.build_spectrum_chain(self.uhd_usrp_source_0)
+        if self.sink_mode == "memory":
+            self.blocks_null_sink = blocks.null_sink(gr.sizeof_float*fftsize)
+            #Selector for switch, passing whole FFT vectors
+            self.blks2_selector_0 = blocks.selector(
+                itemsize=gr.sizeof_float*fftsize,
+                input_index=0,
+                output_index=0,
+            )
+            self.connect((self.blocks_integrated, 0), (self.blks2_selector_0, 0))
+            #Selector connections
+            self.connect((self.blks2_selector_0, 1), (self.signal_accumulator_sink_1, 0))
+            self.connect((self.blks2_selector_0, 2), (self.signal_accumulator_sink_2, 0))
+        else:
+            self.blocks_vector_to_stream_0 = blocks.vector_to_stream(gr.sizeof_float*1, fftsize)
+            self.blocks_null_sink = blocks.null_sink(gr.sizeof_float*1)
+            #Selector for switch
+            #self.blks2_selector_0 = grc_blks2.selector(
+            self.blks2_selector_0 = blocks.selector(
+                itemsize=gr.sizeof_float*1,
+                input_index=0,
+                output_index=0,
+            )
+            self.connect((self.blocks_integrated, 0), (self.blocks_vector_to_stream_0, 0))
+            self.connect((self.blocks_vector_to_stream_0, 0), (self.blks2_selector_0, 0))
+            #Selector connections
+            self.connect((self.blks2_selector_0, 1), (self.signal_file_sink_1, 0))
+            self.connect((self.blks2_selector_0, 2), (self.signal_file_sink_2, 0))
+
+        #Null sink connection
         self.connect((self.blks2_selector_0, 0), (self.blocks_null_sink, 0))
 
+    def build_dual_band_chain(self):
+        """Signal and reference bands are both inside the wider band sampled by the USRP.
+        Each band is shifted to zero frequency, low pass filtered and decimated to
+        samp_rate, and then gets its own FFT chain. Instead of a selector, a copy
+        block per band is enabled while measuring."""
+        fftsize = self.fftsize
+        (usrp_freq, usrp_rate, decim) = self.get_usrp_settings()
+        taps = firdes.low_pass(1.0, usrp_rate, 0.45*self.samp_rate, 0.1*self.samp_rate)
+        if self.sink_mode == "memory":
+            itemsize = gr.sizeof_float*fftsize
+            sinks = [self.signal_accumulator_sink_1, self.signal_accumulator_sink_2]
+        else:
+            itemsize = gr.sizeof_float*1
+            sinks = [self.signal_file_sink_1, self.signal_file_sink_2]
+        self.band_copies = []
+        for (band_freq, sink) in zip(self.band_freqs, sinks):
+            xlating_filter = filter.freq_xlating_fir_filter_ccc(decim, taps, band_freq-usrp_freq, usrp_rate)
+            self.connect((self.uhd_usrp_source_0, 0), (xlating_filter, 0))
+            integrated = self.build_spectrum_chain(xlating_filter)
+            copy = blocks.copy(itemsize)
+            copy.set_enabled(False)
+            if self.sink_mode == "memory":
+                self.connect((integrated, 0), (copy, 0))
+            else:
+                vector_to_stream = blocks.vector_to_stream(gr.sizeof_float*1, fftsize)
+                self.connect((integrated, 0), (vector_to_stream, 0))
+                self.connect((vector_to_stream, 0), (copy, 0))
+            self.connect((copy, 0), (sink, 0))
+            self.band_copies.append(copy)
+
+    def get_usrp_settings(self):
+        """Returns the centre frequency [Hz], sample rate [Hz] and decimation factor
+        used by the USRP for the current settings."""
+        if self.band_freqs is None:
+            return (self.c_freq, self.samp_rate, 1)
+        (sig_freq, ref_freq) = self.band_freqs
+        # Smallest integer decimation giving a wide band covering both bands
+        decim = int(np.ceil((abs(sig_freq-ref_freq) + self.samp_rate)/self.samp_rate))
+        if self.samp_rate*decim > self.max_samp_rate:
+            raise ValueError("Signal and reference frequencies too far apart to be received at the same time.")
+        return (0.5*(sig_freq+ref_freq), self.samp_rate*decim, decim)
+
+    def set_usrp(self):
+        (usrp_freq, usrp_rate, decim) = self.get_usrp_settings()
+        self.uhd_usrp_source_0.set_samp_rate(usrp_rate)
+        self.uhd_usrp_source_0.set_center_freq(usrp_freq, 0)
+
+    def rebuild_chain(self):
+        # Flowgraph must be stopped when calling this
+        self.disconnect_all()
+        self.build_chain()
+
 # QT sink close method reimplementation
 
     def get_samp_rate(self):
@@ -102,7 +227,22 @@ class SALSA_Receiver(gr.top_block):
 
     def set_samp_rate(self, samp_rate):
         self.samp_rate = samp_rate
-        self.uhd_usrp_source_0.set_samp_rate(self.samp_rate)
+        self.set_usrp()
+        N = get_integration_length(self.config, samp_rate)
+        if N != self.N or self.band_freqs is not None:
+            # Flowgraph must be stopped when N or dual band filters change
+            self.N = N
+            self.rebuild_chain()
+
+    def get_band_freqs(self):
+        return self.band_freqs
+
+    def set_band_freqs(self, band_freqs):
+        # Flowgraph must be stopped when calling this
+        if band_freqs != self.band_freqs:
+            self.band_freqs = band_freqs
+            self.set_usrp()
+            self.rebuild_chain()
 
     def get_outfile(self):
         return self.outfile
@@ -128,15 +268,56 @@ class SALSA_Receiver(gr.top_block):
         return self.fftsize
 
     def set_fftsize(self, fftsize):
-        self.fftsize = fftsize
+        # Flowgraph must be stopped when calling this
+        if fftsize != self.fftsize:
+            self.fftsize = fftsize
+            self.rebuild_chain()
+
+    def get_sink_mode(self):
+        return self.sink_mode
+
+    def set_sink_mode(self, sink_mode):
+        # Flowgraph must be stopped when calling this
+        if sink_mode != self.sink_mode:
+            self.sink_mode = sink_mode
+            self.rebuild_chain()
 
     def get_c_freq(self):
         return self.c_freq
 
     def set_c_freq(self, c_freq):
         self.c_freq = c_freq
-        self.uhd_usrp_source_0.set_center_freq(self.c_freq, 0)
+        if self.band_freqs is None:
+            self.uhd_usrp_source_0.set_center_freq(self.c_freq, 0)
         
+    def tune(self, c_freq):
+        self.set_c_freq(c_freq)
+
+    def select(self, output):
+        if self.band_freqs is None:
+            self.blks2_selector_0.set_output_index(output)
+        else:
+            # Both bands are recorded at the same time
+            for copy in self.band_copies:
+                copy.set_enabled(output != NULL)
+
+    def open_dump(self, output, filename):
+        write_dump_header(filename, self.get_dump_header(output))
+        self.lock()
+        self.get_file_sink(output).open(filename)
+        self.unlock()
+
+    def close_dump(self, output):
+        self.lock()
+        self.get_file_sink(output).close()
+        self.unlock()
+
+    def get_file_sink(self, output):
+        if output == SIG:
+            return self.signal_file_sink_1
+        else:
+            return self.signal_file_sink_2
+
     def get_probe_var(self):
         return self.probe_var
 
@@ -0,0 +1,151 @@
+import numpy as np
+from scipy import ndimage
+import functools
+
+# Known RFI as centre frequency and width in MHz, used if not given in config file.
+# This list contains peaks which are not properly picked by by the MWF filter.
+DEFAULT_KNOWN_RFI = [[1420.4+4.595, 0.02],
+                     [1420.4-0.392, 0.02],
+                     [1420.4+0.182, 0.02],
+                     [1420.4+-0.4, 0.035],
+                     ]
+
+def get_known_RFI(config):
+    """Returns the known RFI as a tuple of (centre frequency, width) in MHz.
+
+    Read from the 'known_RFI' setting in the RFI section of the config file,
+    given as comma separated freq:width pairs in MHz."""
+    return parse_known_RFI(config.get('RFI', 'known_RFI', fallback=''))
+
+@functools.lru_cache(maxsize=16)
+def parse_known_RFI(items):
+    # Cached, so that all spectra share the same tuple
+    if items.strip() == '':
+        return tuple(tuple(item) for item in DEFAULT_KNOWN_RFI)
+    known_RFI = []
+    for item in items.split(','):
+        (freq, width) = item.split(':')
+        known_RFI.append((float(freq), float(width)))
+    return tuple(known_RFI)
+
+class RFIMask():
+    """ Replaces channels with known RFI by a straight line fitted to the
+    channels on both sides, for spectra with a given centre frequency,
+    bandwidth and number of channels.
+
+    Channel ranges and fits are computed once. Since a least squares line
+    is a linear function of the data, patching all RFI is then a single
+    matrix product: the patched channels are given by weights times the
+    data in the channels used for fitting. RFI items are applied in list
+    order, so overlapping items give the same result as patching one at a
+    time. Items outside the band are skipped."""
+
+    def __init__(self, known_RFI, obs_freq, bandwidth, nchans):
+        freq_res = bandwidth/nchans # Hz
+        ch0_freq = obs_freq - 0.5*bandwidth
+        # Each channel as linear combination of the original channels,
+        # updated for every RFI item, starting from identity.
+        combination = {}
+        def get_row(ch):
+            if ch not in combination:
+                combination[ch] = {ch: 1.0}
+            return combination[ch]
+        for item in known_RFI:
+            RFI_freq = item[0] *1e6
+            RFI_width = item[1]*1e6
+            ind_low = int(np.floor((RFI_freq-0.5*RFI_width - ch0_freq)/freq_res))
+            ind_high = int(np.ceil((RFI_freq+0.5*RFI_width - ch0_freq)/freq_res))
+            if not (ind_low>0 and ind_high<nchans):
+                continue
+            margin = min(ind_high-ind_low, ind_low, nchans-ind_high)
+            # Fit line to margin channels on both sides, ignoring the RFI
+            x = np.arange(ind_high-ind_low+2*margin)
+            fit_x = np.concatenate([x[:margin], x[-margin:]])
+            fit_ch = fit_x + ind_low - margin
+            patch_x = x[margin:-margin]
+            A = np.vstack([fit_x, np.ones_like(fit_x)]).T
+            # Line evaluated in RFI channels, per data point used in fit
+            weights = np.vstack([patch_x, np.ones_like(patch_x)]).T.dot(np.linalg.pinv(A))
+            fit_rows = [dict(get_row(ch)) for ch in fit_ch]
+            for (i, ch) in enumerate(range(ind_low, ind_high)):
+                row = {}
+                for (w, fit_row) in zip(weights[i], fit_rows):
+                    for (src, v) in fit_row.items():
+                        row[src] = row.get(src, 0.0) + w*v
+                combination[ch] = row
+        # Only keep channels which are changed
+        self.channels = np.array(sorted(ch for ch in combination if combination[ch] != {ch: 1.0}), dtype=int)
+        self.sources = np.array(sorted(set(src for ch in self.channels for src in combination[ch])), dtype=int)
+        col = {src: j for (j, src) in enumerate(self.sources)}
+        self.weights = np.zeros((len(self.channels), len(self.sources)))
+        for (i, ch) in enumerate(self.channels):
+            for (src, v) in combination[ch].items():
+                self.weights[i, col[src]] = v
+
+    def apply(self, data):
+        """Patch RFI in one spectrum, or in a 2D array with one spectrum
+        per row, in place. Returns data."""
+        if len(self.channels) > 0:
+            data[..., self.channels] = data[..., self.sources].dot(self.weights.T)
+        return data
+
+_masks = {}
+
+def get_rfi_mask(known_RFI, obs_freq, bandwidth, nchans):
+    """Returns the RFIMask for the given known RFI (see get_known_RFI),
+    centre frequency [Hz], bandwidth [Hz] and number of channels, computed
+    the first time it is requested."""
+    key = (tuple(tuple(item) for item in known_RFI), float(obs_freq), float(bandwidth), int(nchans))
+    if key not in _masks:
+        _masks[key] = RFIMask(known_RFI, obs_freq, bandwidth, nchans)
+    return _masks[key]
+
+# Compare-exchange network giving the median of 7 values in position 3
+MEDIAN7_NETWORK = [(0,5), (0,3), (1,6), (2,4), (0,1), (3,5), (2,6),
+                   (2,3), (3,6), (4,5), (1,4), (1,3), (3,4)]
+
+def median_filter(data, kernel_size = 7, block = 32):
+    """Running median along the last axis of one spectrum or a 2D array
+    of spectra, zero padded at the edges like scipy.signal.medfilt.
+
+    For kernel size 7 an elementwise min/max network over shifted copies of
+    the data is used, processed in blocks of rows to stay in cache."""
+    data = np.asarray(data)
+    if kernel_size != 7:
+        size = [1]*(data.ndim-1) + [kernel_size]
+        return ndimage.median_filter(data, size=size, mode='constant', cval=0.0)
+    if data.ndim == 1:
+        return median_filter(data[np.newaxis], kernel_size, block)[0]
+    n = data.shape[-1]
+    out = np.empty(data.shape, dtype=np.result_type(data.dtype, np.float32))
+    # Buffers for the 7 shifted copies and one temporary, reused for all blocks
+    rows = min(block, len(data))
+    buffers = [np.empty((rows, n), dtype=out.dtype) for k in range(8)]
+    for i in range(0, len(data), block):
+        padded = np.pad(data[i:i+block], [(0,0), (3,3)])
+        nrows = len(padded)
+        v = [buf[:nrows] for buf in buffers[:7]]
+        tmp = buffers[7][:nrows]
+        for k in range(7):
+            v[k][...] = padded[:, k:k+n]
+        for (a, b) in MEDIAN7_NETWORK:
+            np.minimum(v[a], v[b], out=tmp)
+            np.maximum(v[a], v[b], out=v[b])
+            (v[a], tmp) = (tmp, v[a])
+        out[i:i+block] = v[3]
+    return out
+
+def repair_edges(data):
+    """Remove spikes at end channels of one spectrum or a 2D array of spectra, in place."""
+    data[..., 0:1] = data[..., 2:3]
+    data[..., -2:] = data[..., -3:-2]
+    return data
+
+def clean_spectra(data, mask, kernel_size = 7):
+    """Remove RFI from one spectrum or a 2D array with one spectrum per
+    row, all with the same frequency setup: repair end channels, patch
+    known RFI with the given RFIMask and filter away the rest with a
+    running median. Returns the cleaned data, data is modified."""
+    repair_edges(data)
+    mask.apply(data)
+    return median_filter(data, kernel_size)
@@ -0,0 +1,127 @@
+# Rot2Prog protocol used by the MD01 rotor controller.
+#
+# Commands are 13 byte packets, replies are 12 byte packets:
+#Byte:    0   1    2    3    4    5    6    7    8    9    10   11  12
+#       -----------------------------------------------------------------
+#Field: | S | H1 | H2 | H3 | H4 | PH | V1 | V2 | V3 | V4 | PV | K | END |
+#       -----------------------------------------------------------------
+#Value:   57  3x   3x   3x   3x   0x   3x   3x   3x   3x   0x   xF  20 (hex)
+#
+# H1-H4 and V1-V4 are the azimuth and altitude plus 360 degrees, in units
+# of 1/PH and 1/PV degrees, as ASCII digits. PH and PV are the number of
+# pulses per degree, usually 10 (0x0A). K is the command, see COMMANDS.
+# Replies have the same layout without K, with the digits as values 0-9,
+# always in units of 0.1 degrees. PH and PV of the reply only tell the
+# pulses per degree set in the MD01, and are not used to decode angles.
+import struct
+import math
+
+START = 0x57
+END = 0x20
+REPLY_SIZE = 12
+# Units of the angles in replies, per degree
+REPLY_RESOLUTION = 10
+
+# Command byte K for each command. Commands which only take angles as
+# arguments are encoded by encode().
+COMMANDS = {'stop': 0x0F,      # Stop movement, replies with position
+            'status': 0x1F,    # Replies with position
+            'config': 0x4F,    # Replies with configuration
+            'set': 0x2F,       # Move to given position
+            'calibrate': 0xF9, # Set current position to given values, without moving
+            'reset': 0xF8,     # Set current position to zero
+            }
+
+# Restart of the MD01, a fixed packet from the manufacturer
+RESTART = bytes.fromhex("57EFBEADDE000000000000EE20")
+
+# Range of angles accepted by the MD01 [degrees]
+AZ_RANGE = (-180.0, 540.0)
+AL_RANGE = (-90.0, 180.0)
+
+class MD01Error(IOError):
+    """Raised when a command could not be sent to the MD01, or no valid reply was received."""
+    pass
+
+_COMMAND = struct.Struct('B4sB4sBBB')
+_REPLY = struct.Struct('B4BB4BBB')
+# ASCII digits of all values of the H1-H4 and V1-V4 fields
+_DIGITS = [b'%04d' % value for value in range(10000)]
+
+def _pulses(angle, pulses, angle_range):
+    if not angle_range[0] <= angle <= angle_range[1]:
+        raise ValueError("Angle {} outside range {} to {} degrees of MD01".format(angle, *angle_range))
+    value = int(round(pulses*(360.0+angle)))
+    if value > 9999:
+        raise ValueError("Angle {} cannot be encoded with {} pulses per degree".format(angle, pulses))
+    return _DIGITS[value]
+
+def encode(command, al = 0.0, az = 0.0, ph = 10, pv = 10):
+    """Returns the packet for a command in COMMANDS, with altitude and
+    azimuth [degrees] at the given number of pulses per degree. Angles
+    are rounded to the nearest pulse. Raises ValueError if an angle is
+    outside the range of the MD01."""
+    if command in ('set', 'calibrate'):
+        if not (1 <= ph <= 255 and 1 <= pv <= 255):
+            raise ValueError("Pulses per degree must be 1 to 255")
+        if math.isnan(al) or math.isnan(az):
+            raise ValueError("Invalid angle")
+        return _COMMAND.pack(START, _pulses(az, ph, AZ_RANGE), ph, _pulses(al, pv, AL_RANGE), pv, COMMANDS[command], END)
+    return _COMMAND.pack(START, bytes(4), 0, bytes(4), 0, COMMANDS[command], END)
+
+# Packets without arguments
+STOP = encode('stop')
+STATUS = encode('status')
+
+def set_command(al, az, ph = 10, pv = 10):
+    """Returns the command to move to altitude and azimuth [degrees]."""
+    return encode('set', al, az, ph, pv)
+
+def calibrate_command(al, az, ph = 10, pv = 10):
+    """Returns the command which sets the current position of the MD01
+    to the given altitude and azimuth [degrees], without moving."""
+    return encode('calibrate', al, az, ph, pv)
+
+def check_reply(data):
+    if len(data) != REPLY_SIZE or data[0] != START or data[-1] != END:
+        raise MD01Error("Invalid reply from MD01: " + data.hex())
+
+def decode_reply(data):
+    """Returns altitude and azimuth [degrees] from a reply to a status or stop command."""
+    check_reply(data)
+    (s, h1, h2, h3, h4, ph, v1, v2, v3, v4, pv, e) = _REPLY.unpack(data)
+    if max(h1, h2, h3, h4, v1, v2, v3, v4) > 9:
+        raise MD01Error("Invalid reply from MD01: " + data.hex())
+    az = (h1*1000 + h2*100 + h3*10 + h4)/REPLY_RESOLUTION - 360
+    al = (v1*1000 + v2*100 + v3*10 + v4)/REPLY_RESOLUTION - 360
+    return (al, az)
+
+# Functions below are used to act as an MD01, e.g. by the simulator
+
+_COMMAND_NAMES = dict((value, name) for (name, value) in COMMANDS.items())
+_DIGIT_VALUES = bytes.maketrans(b'0123456789', bytes(range(10)))
+_REPLY_FIELDS = struct.Struct('B4sB4sBB')
+
+def decode_command(data):
+    """Returns (command, al, az, ph, pv) from a command packet, where command
+    is a key of COMMANDS or 'restart'. Angles [degrees] are None if not
+    given by the command. Raises MD01Error if the packet is invalid."""
+    if data == RESTART:
+        return ('restart', None, None, 0, 0)
+    if len(data) != REPLY_SIZE+1 or data[0] != START or data[-1] != END or data[11] not in _COMMAND_NAMES:
+        raise MD01Error("Invalid command: " + data.hex())
+    command = _COMMAND_NAMES[data[11]]
+    if command not in ('set', 'calibrate'):
+        return (command, None, None, 0, 0)
+    (s, h, ph, v, pv, k, e) = _COMMAND.unpack(data)
+    if not (h.isdigit() and v.isdigit()) or ph == 0 or pv == 0:
+        raise MD01Error("Invalid command: " + data.hex())
+    return (command, int(v)/pv - 360, int(h)/ph - 360, ph, pv)
+
+def encode_reply(al, az, ph = 10, pv = 10):
+    """Returns the reply giving altitude and azimuth [degrees], rounded
+    to 0.1 degrees, from an MD01 set to ph and pv pulses per degree."""
+    h = min(9999, max(0, int(round(REPLY_RESOLUTION*(360.0+az)))))
+    v = min(9999, max(0, int(round(REPLY_RESOLUTION*(360.0+al)))))
+    return _REPLY_FIELDS.pack(START, _DIGITS[h].translate(_DIGIT_VALUES), ph,
+                              _DIGITS[v].translate(_DIGIT_VALUES), pv, END)
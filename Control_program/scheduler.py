@@ -0,0 +1,66 @@
+import threading
+import time
+
+class CancelToken():
+    """ Used to abort a running measurement from another thread.
+
+    Waiting is done on a threading.Event, so a waiting thread uses no CPU
+    and wakes up as soon as cancel() is called."""
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def is_cancelled(self):
+        return self.event.is_set()
+
+    def sleep(self, seconds):
+        """Wait for the given number of seconds. Returns False if cancelled while waiting."""
+        return not self.event.wait(max(0.0, seconds))
+
+class Phase():
+    """ One part of a measurement cycle, e.g. signal or reference.
+
+    The start function is called when the phase begins, e.g. to retune the LO
+    and switch the selector, and the stop function when the phase ends."""
+
+    def __init__(self, name, duration, start = None, stop = None):
+        self.name = name
+        self.duration = float(duration)
+        self.start = start
+        self.stop = stop
+
+class SwitchScheduler():
+    """ Runs a list of phases in a loop for a given total time, or until cancelled."""
+
+    def __init__(self, token):
+        self.token = token
+        self.times = {}
+        self.counts = {}
+
+    def run(self, phases, total_time, loop = True):
+        """Run all phases in order. Every phase is ended when the total time is
+        reached, and a new cycle is only started if there is time left.
+        Returns a dict with the actual time spent in every phase [s]."""
+        for phase in phases:
+            self.times[phase.name] = 0.0
+            self.counts[phase.name] = 0
+        t_end = time.time() + total_time
+        while time.time() <= t_end and not self.token.is_cancelled():
+            for phase in phases:
+                self._run_phase(phase, t_end)
+            if not loop:
+                break
+        return self.times
+
+    def _run_phase(self, phase, t_end):
+        if phase.start is not None:
+            phase.start()
+        start = time.time()
+        self.token.sleep(min(start + phase.duration, t_end) - start)
+        if phase.stop is not None:
+            phase.stop()
+        self.times[phase.name] += time.time() - start
+        self.counts[phase.name] += 1
@@ -0,0 +1,151 @@
+import numpy as np
+from astropy.io import fits
+import os
+
+# Columns of the binary table besides DATA, as FITS name, format and unit,
+# with a function giving the value for a spectrum.
+COLUMNS = [('DATE-OBS', '22A', None, lambda s: s.get_date_obs()),
+           ('EXPOSURE', 'E', 's', lambda s: s.int_time),
+           ('OBJECT', '64A', None, lambda s: s.target),
+           ('OBSERVER', '32A', None, lambda s: s.observer),
+           ('CRVAL1', 'D', 'Hz', lambda s: s.obs_freq),
+           ('CDELT1', 'D', 'Hz', lambda s: s.bandwidth/s.nchans),
+           ('CRPIX1', 'E', None, lambda s: s.nchans/2),
+           ('RESTFREQ', 'D', 'Hz', lambda s: s.rest_freq),
+           ('AZIMUTH', 'E', 'deg', lambda s: s.az),
+           ('ELEVATIO', 'E', 'deg', lambda s: s.alt),
+           ('OFFS_AZ', 'E', 'deg', lambda s: s.offset_az),
+           ('OFFS_ALT', 'E', 'deg', lambda s: s.offset_alt),
+           ('GLON', 'D', 'deg', lambda s: float(s.glon)*180/np.pi),
+           ('GLAT', 'D', 'deg', lambda s: float(s.glat)*180/np.pi),
+           ('VELO-LSR', 'E', 'km/s', lambda s: (-1)*s.vlsr_corr/1000.0), # Sign as in save_to_fits
+           ('VLSRCORR', 'D', 'Hz', lambda s: s.freq_vlsr_corr),
+           ]
+
+# numpy dtype of each FITS column format, n is the repeat count
+FORMATS = {'E': '>f4', 'D': '>f8', 'A': 'Sn'}
+BLOCK_SIZE = 2880
+
+class SDFITSWriter():
+    """ Writes many spectra, e.g. all spectra of a session or a map, to one
+    FITS file with one row per spectrum, similar to the single dish FITS
+    (SDFITS) convention.
+
+    All spectra with the same number of channels go in one binary table.
+    Rows are buffered and appended to the end of the table every
+    buffer_size spectra, and when close() is called, so that adding a
+    spectrum never rewrites the file. The number of rows in the table
+    header is updated by close(), like the number of dumps of a dump file,
+    so the file is only complete when closed. A spectrum with a different
+    number of channels starts a new table. Data is stored as float32
+    without rescaling."""
+
+    def __init__(self, filename, buffer_size = 64, telescope = 'SALSA 2m'):
+        self.filename = filename
+        self.buffer_size = int(buffer_size)
+        self.rows = []
+        # Table being written: header, its position in file, number of
+        # channels, number of rows written and numpy dtype of a row.
+        self.header = None
+        self.header_offset = 0
+        self.nchans = 0
+        self.nrows = 0
+        self.dtype = None
+        hdu = fits.PrimaryHDU()
+        hdu.header['TELESCOP'] = telescope
+        hdu.header['ORIGIN'] = 'ONSALA, SWEDEN'
+        self.file = open(filename, 'wb')
+        self.file.write(hdu.header.tostring().encode('ascii'))
+
+    def add(self, spectrum):
+        if len(self.rows) > 0 and len(self.rows[0].data) != len(spectrum.data):
+            self.flush()
+        self.rows.append(spectrum)
+        if len(self.rows) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Append buffered spectra to the end of the table."""
+        if len(self.rows) == 0:
+            return
+        nchans = len(self.rows[0].data)
+        if self.header is None or nchans != self.nchans:
+            self.close_table()
+            self.start_table(nchans)
+        data = np.zeros(len(self.rows), dtype=self.dtype)
+        data['DATA'] = [spectrum.data for spectrum in self.rows]
+        for (name, fmt, unit, value) in COLUMNS:
+            data[name] = [value(spectrum) for spectrum in self.rows]
+        self.file.write(data.tobytes())
+        self.file.flush()
+        self.nrows += len(self.rows)
+        self.rows = []
+
+    def start_table(self, nchans):
+        columns = [fits.Column(name='DATA', format=str(nchans)+'E', unit='K')]
+        # Rows are written as big endian numpy records, as stored in FITS
+        dtype = [('DATA', '>f4', (nchans,))]
+        for (name, fmt, unit, value) in COLUMNS:
+            columns.append(fits.Column(name=name, format=fmt, unit=unit))
+            dtype.append((name, FORMATS[fmt[-1]].replace('n', fmt[:-1])))
+        self.header = fits.BinTableHDU.from_columns(columns, nrows=0).header
+        self.header['EXTNAME'] = 'SINGLE DISH'
+        self.header['CTYPE1'] = 'FREQ'
+        self.dtype = np.dtype(dtype)
+        self.nchans = nchans
+        self.nrows = 0
+        self.header_offset = self.file.tell()
+        self.file.write(self.header.tostring().encode('ascii'))
+
+    def close_table(self):
+        # Pad data to a full FITS block and set the number of rows in header
+        if self.header is None:
+            return
+        size = self.nrows*self.dtype.itemsize
+        self.file.write(bytes(-size % BLOCK_SIZE))
+        self.header['NAXIS2'] = self.nrows
+        end = self.file.tell()
+        self.file.seek(self.header_offset)
+        self.file.write(self.header.tostring().encode('ascii'))
+        self.file.seek(end)
+        self.header = None
+
+    def close(self):
+        self.flush()
+        self.close_table()
+        self.file.close()
+
+def save_session_to_sdfits(spectra, outfile):
+    """Write many spectra to one SDFITS file, as rows of one table."""
+    writer = SDFITSWriter(outfile)
+    try:
+        for spectrum in spectra:
+            writer.add(spectrum)
+    finally:
+        writer.close()
+
+class SDFITSReader():
+    """ Opens a file written by SDFITSWriter. Tables are memory mapped, so
+    only the data used is read from disk."""
+
+    def __init__(self, filename):
+        self.hdulist = fits.open(filename, memmap=True)
+        self.tables = [hdu for hdu in self.hdulist[1:] if hdu.header.get('EXTNAME') == 'SINGLE DISH']
+
+    def get_nspectra(self):
+        return sum(len(table.data) for table in self.tables)
+
+    def get_column(self, name):
+        """Returns a column for all spectra. DATA is only available as
+        one array if all spectra have the same number of channels. With
+        one table, the column is memory mapped and not copied."""
+        if len(self.tables) == 1:
+            return self.tables[0].data[name]
+        return np.concatenate([table.data[name] for table in self.tables])
+
+    def get_data(self):
+        """Returns one array with one spectrum per row for every table."""
+        return [table.data['DATA'] for table in self.tables]
+
+    def close(self):
+        self.hdulist.close()
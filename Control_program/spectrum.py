@@ -5,101 +5,188 @@ from scipy import signal as signal
 from astropy.io import fits
 import math, os
 from scipy.constants import c
-import MySQLdb as mdb
 from contextlib import closing
 from datetime import datetime
+from rfi import *
+from decimator import *
+from vlsr import *
+from archive import upload
+import collections
+import functools
 
+# Axes of a spectrum, all read-only arrays with one value per channel:
+# freqs [Hz], vels [m/s], vels_kms [km/s] and freq_offsets [MHz] relative to
+# the observed centre frequency, used for plotting.
+SpectrumAxes = collections.namedtuple('SpectrumAxes', ['freqs', 'vels', 'vels_kms', 'freq_offsets'])
+
+@functools.lru_cache(maxsize=256)
+def get_spectrum_axes(center_freq, bandwidth, nchans, rest_freq, obs_freq):
+    """Returns SpectrumAxes for the given centre frequency [Hz], including any
+    VLSR shift, bandwidth [Hz], number of channels and rest frequency [Hz].
+    Computed once and shared by all spectra with the same settings, so
+    replotting spectra does not recompute or copy the axes."""
+    freqs = center_freq + bandwidth*(np.arange(nchans) - nchans//2)/nchans
+    # The -1 sign is checked by comparison with the LAB survey. The formula, including sign, is however
+    # the same as used by e.g. the VLA; see "Radio velocity" at https://science.nrao.edu/facilities/vla/docs/manuals/obsguide/modes/line#DopplerCorrection
+    vels = -1*(freqs-rest_freq)*c/rest_freq
+    axes = SpectrumAxes(freqs, vels, 1e-3*vels, 1e-6*(freqs-obs_freq))
+    for axis in axes:
+        # Shared between spectra, so must not be changed
+        axis.setflags(write=False)
+    return axes
+
+# Header of text files. Data follows as two columns.
+TXT_HEADER = """# BEGINHEADER
+# This file contains data from the SALSA 2m radio telescope.
+# DATE={date}
+# GLON and GLAT given in degrees
+# GLON={glon}
+# GLAT={glat}
+# DATA in two columns below. Col. 1 is velocity relative to LSR [km/s]. Col. 2 is uncalibrated antenna temperature [K].
+# ENDHEADER
+"""
+# Shortest text which reads back to the same value, as written by str(value)
+TXT_ROW = '%r %r\n'
+
+def save_session_to_txt(spectra, outfile, template = None):
+    """Write many spectra to one text file, as one block with header and data
+    per spectrum."""
+    with open(outfile, "w") as text_file:
+        for spectrum in spectra:
+            spectrum.write_txt(text_file, template)
+
+def save_session_to_dir(spectra, outdir, template = None):
+    """Write many spectra to one text file each in outdir, named by observer
+    and date. Returns the list of files written."""
+    os.makedirs(outdir, exist_ok=True)
+    files = []
+    for spectrum in spectra:
+        date = spectrum.site.date.datetime().strftime('%Y-%m-%dT%H%M%S')
+        outfile = os.path.join(outdir, "SALSA_" + spectrum.observer + "_" + date + ".txt")
+        with open(outfile, "w") as text_file:
+            spectrum.write_txt(text_file, template)
+        files.append(outfile)
+    return files
 
 class SALSA_spectrum:
+    # Only raw pointing and time are stored when a spectrum is created.
+    # Site, pointing, galactic coordinates and target description are
+    # computed when first used and then cached, so that creating many
+    # spectra costs little more than the data itself.
+    __slots__ = ['obs_freq', 'data', 'bandwidth', 'nchans', 'int_time', 'site_info', 'date', 'epoch',
+                 'alt', 'az', 'coordsys', 'satellite', 'observer', 'uploaded', 'freq_vlsr_corr', 'vlsr_corr',
+                 'offset_alt', 'offset_az', 'known_RFI', 'instrument',
+                 '_site', '_pointing', '_galactic', '_target']
+
+    rest_freq = HI_REST_FREQ # Hz, from Wiki.
+
     def __init__(self, data, bandwidth, nchans, cfreq, site, alt, az, int_time, username, config, offset_alt, offset_az, coordsys, satellite = ""):
         # All units shall be S.I. (Hz, etc. not MHz)
-        self.rest_freq = 1420.40575177e6 # Hz, from Wiki.
         self.obs_freq = float(cfreq)
         self.data = data[:]
         self.bandwidth = float(bandwidth)
         self.nchans = int(nchans)
         self.int_time = int(int_time)
         # Copy relevant properties from input site
-        self.site = ephem.Observer()
-        self.site.name = site.name
-        self.site.lat = site.lat
-        self.site.long = site.long
-        self.site.elevation = site.elevation
-        self.site.pressure = site.pressure
-        self.site.date = ephem.Date(site.date) # Make sure we do not keep reference to old time
+        self.site_info = (site.name, float(site.lat), float(site.long), site.elevation, site.pressure)
+        self.date = float(site.date) # Make sure we do not keep reference to old time
+        self.epoch = float(ephem.now()) # Epoch of pointing
         self.alt = alt # deg
         self.az = az # deg
-        alt_rad = self.alt*np.pi/180.0
-        az_rad = self.az*np.pi/180.0
-        (ra, dec) = self.site.radec_of(az_rad, alt_rad)
-        self.pointing = ephem.FixedBody()
-        self.pointing._ra = ra
-        self.pointing._dec = dec
-        self.pointing._epoch = ephem.now()
-        # NOTE: This will not be true for a long measurement
-        self.pointing.compute(self.site)
-        pos = ephem.Galactic(self.pointing)
-        self.glon = pos.lon
-        self.glat = pos.lat
+        self.coordsys = coordsys
+        self.satellite = satellite
+        self.observer = username
+        self.uploaded = False
+        self.freq_vlsr_corr = 0
+        self.vlsr_corr = 0
+        self.offset_alt = offset_alt
+        self.offset_az = offset_az
+        # Only the settings needed from config
+        self.known_RFI = get_known_RFI(config)
+        self.instrument = config.get('SITE', 'name')
+        self._site = None
+        self._pointing = None
+        self._galactic = None
+        self._target = None
+
+    def __getstate__(self):
+        # Cached ephem objects cannot be pickled, they are computed again when needed
+        return dict((name, getattr(self, name)) for name in self.__slots__ if not name.startswith('_'))
+
+    def __setstate__(self, state):
+        for name in self.__slots__:
+            setattr(self, name, state.get(name))
+
+    @property
+    def site(self):
+        if self._site is None:
+            site = ephem.Observer()
+            (site.name, site.lat, site.long, site.elevation, site.pressure) = self.site_info
+            site.date = ephem.Date(self.date)
+            self._site = site
+        return self._site
+
+    @property
+    def pointing(self):
+        if self._pointing is None:
+            alt_rad = self.alt*np.pi/180.0
+            az_rad = self.az*np.pi/180.0
+            (ra, dec) = self.site.radec_of(az_rad, alt_rad)
+            pointing = ephem.FixedBody()
+            pointing._ra = ra
+            pointing._dec = dec
+            pointing._epoch = ephem.Date(self.epoch)
+            # NOTE: This will not be true for a long measurement
+            pointing.compute(self.site)
+            self._pointing = pointing
+        return self._pointing
+
+    @property
+    def glon(self):
+        return self.get_galactic()[0]
+
+    @property
+    def glat(self):
+        return self.get_galactic()[1]
+
+    def get_galactic(self):
+        if self._galactic is None:
+            pos = ephem.Galactic(self.pointing)
+            self._galactic = (pos.lon, pos.lat)
+        return self._galactic
+
+    @property
+    def target(self):
+        if self._target is None:
+            self._target = self.get_target()
+        return self._target
+
+    def get_target(self):
         # Check what we are observing
+        coordsys = self.coordsys
         if coordsys == "Galactic":
             coord1 = str(round(float(repr(self.glon))*180/np.pi,1))
             coord2 = str(round(float(repr(self.glat))*180/np.pi,1))
-            self.target = 'Galactic long=' + coord1 + ', lat=' + coord2
+            return 'Galactic long=' + coord1 + ', lat=' + coord2
         elif coordsys == "GNSS":
-            self.target = 'GNSS ' + satellite + ' (alt={:6.1f}, az={:6.1f})'.format(self.alt, self.az)
+            return 'GNSS ' + self.satellite + ' (alt={:6.1f}, az={:6.1f})'.format(self.alt, self.az)
         elif coordsys == "The Sun":
-            self.target = 'The Sun (alt={:6.1f}, az={:6.1f})'.format(self.alt, self.az)
+            return 'The Sun (alt={:6.1f}, az={:6.1f})'.format(self.alt, self.az)
         elif coordsys == "The Moon":
-            self.target = 'The Moon (alt={:6.1f}, az={:6.1f})'.format(self.alt, self.az)
+            return 'The Moon (alt={:6.1f}, az={:6.1f})'.format(self.alt, self.az)
         elif coordsys == "Cas A":
-            self.target = 'Cas A (alt={:6.1f}, az={:6.1f})'.format(self.alt, self.az)
+            return 'Cas A (alt={:6.1f}, az={:6.1f})'.format(self.alt, self.az)
         else:
-            self.target = 'Obs. at alt={:6.1f}, az={:6.1f}'.format(self.alt, self.az)
-
-        self.observer = username
-        self.uploaded = False
-        self.freq_vlsr_corr = 0
-        self.vlsr_corr = 0
-        self.config = config
-        self.offset_alt = offset_alt
-        self.offset_az = offset_az
+            return 'Obs. at alt={:6.1f}, az={:6.1f}'.format(self.alt, self.az)
 
     def auto_edit_bad_data(self):
         print("Autoflagging known RFI.")
-        # Remove spikes at end channels
-        self.data[0:1] = self.data[2]
-        self.data[-2:] = self.data[-3]
-        freq_res = self.bandwidth/self.nchans # Hz
-        # List known RFI as center-frequency in MHz, and width in Mhz
-        # This list contains peaks which are not properly picked by by the MWF filter.
-        known_RFI = [[1420.4+4.595, 0.02],
-                     [1420.4-0.392, 0.02],
-                     [1420.4+0.182, 0.02],
-                     [1420.4+-0.4, 0.035],
-                     ]
-        for item in known_RFI:
-            RFI_freq = item[0] *1e6 
-            RFI_width = item[1]*1e6
-            ch0_freq = self.obs_freq - 0.5*self.bandwidth
-            ind_low = int(np.floor((RFI_freq-0.5*RFI_width - ch0_freq)/freq_res))
-            ind_high = int(np.ceil((RFI_freq+0.5*RFI_width - ch0_freq)/freq_res))
-            #print ind_low, ind_high
-            if ind_low>0 and ind_high<self.nchans:
-                #print 'Flagging', item
-                margin = min(ind_high-ind_low, ind_low, self.nchans-ind_high)
-                RFI_part = self.data[ind_low-margin:ind_high+margin]
-                xdata = np.arange(len(RFI_part))
-                weights = np.ones_like(RFI_part)
-                weights[margin:-margin] = 0.0 # Ignore RFI when fitting
-                pf = np.polyfit(xdata, RFI_part, deg=1, w=weights)
-                interpdata = np.polyval(pf, xdata)
-                self.data[ind_low:ind_high] = interpdata[margin:-margin]
-            else:
-                #print 'Skipping', item
-                pass
-        # Filter away rest of RFI with median window filter, assuming 4096 channels for 2MHz bandwidth
-        self.data = signal.medfilt(self.data, kernel_size = 7)
+        # Remove spikes at end channels, replace known RFI by interpolation
+        # and filter away rest of RFI with median window filter, see rfi.py.
+        # The RFI mask is computed once for every combination of frequency,
+        # bandwidth and channels.
+        mask = get_rfi_mask(self.known_RFI, self.obs_freq, self.bandwidth, self.nchans)
+        self.data = clean_spectra(self.data, mask)
 
     # NOT USED ANYMORE, replaced by median window filter function
     #def auto_edit_bad_data_OLD(self):
@@ -160,108 +247,86 @@ class SALSA_spectrum:
     #            pass
 
     def shift_to_vlsr_frame(self):
-        # From http://web.mit.edu/8.13/www/nsrt_software/documentation/vlsr.pdf
-        ep_target = ephem.Equatorial(self.pointing)
-        # Sun velocity apex is at 18 hr, 30 deg; convert to x, y, z
-        # geocentric celestial for dot product with source, multiply by speed
-        x0 = 20.0 * math.cos(18.0 * np.pi / 12.0) * math.cos(30.0 * np.pi / 180.0)
-        y0 = 20.0 * math.sin(18.0 * np.pi / 12.0) * math.cos(30.0 * np.pi / 180.0)
-        z0 = 20.0 * math.sin(30.0 * np.pi / 180.0)
-    
-        # Make sure we have target angles in radians
-        tg_ra_rad = float(ep_target.ra)
-        tg_dec_rad = float(ep_target.dec)
-       
-        # Calculate sinces, cosines for dot product
-        ctra = math.cos(tg_ra_rad)
-        stra = math.sin(tg_ra_rad)
-        ctdc = math.cos(tg_dec_rad)
-        stdc = math.sin(tg_dec_rad)
-    
-        # Calculate correction due to movement of Sun with respect to LSR
-        # dot product of target & apex vectors
-        vsun = x0*ctra*ctdc + y0*stra*ctdc + z0*stdc
-    
-        # get target in geocentric ecliptic system
-        ecl =  ephem.Ecliptic(ep_target)
-        tlon = ecl.lon
-        tlat = ecl.lat
-    
-        # Get sun ecliptic coordinates, in radians
-        sun = ephem.Sun()
-        sun.compute(self.site)
-        se = ephem.Ecliptic(sun)
-        slong = float(se.lon)
-    
-        # Calculate correction due to earth movement relative to the Sun
-        vorb = 30.0*math.cos(tlat)*math.sin(slong-tlon)
-    
-        # Combine both effects
-        vlsr_kmps = vsun + vorb # in km/s
-        
-        vlsr_corr = 1e3*vlsr_kmps # in m/s
-
-        self.vlsr_corr = vlsr_corr # store for this spectrum
-        # Convert and store shift also for frequency
-        self.freq_vlsr_corr = -1*self.rest_freq*self.vlsr_corr/c
+        # Uses the same vectorized calculation as for many spectra, see vlsr.py
+        ep_target = ephem.Equatorial(self.pointing, epoch=ephem.J2000)
+        (vlsr_corr, freq_vlsr_corr) = get_vlsr_corrections(float(ep_target.ra), float(ep_target.dec), float(self.site.date), self.rest_freq)
+        self.vlsr_corr = float(vlsr_corr) # store for this spectrum, in m/s
+        # Store shift also for frequency
+        self.freq_vlsr_corr = float(freq_vlsr_corr)
 
     def decimate_channels(self, outchans):
-        self.data = signal.decimate(self.data, int(self.nchans/outchans), axis=0, ftype = 'fir')
-        self.data[0] = self.data[1]
-        self.nchans = outchans
+        # Filter is designed once per number of channels, see decimator.py.
+        # Number of channels need not be a multiple of outchans.
+        self.data = get_decimator(self.nchans, outchans).decimate(self.data)
+        self.nchans = int(outchans)
 
     def get_center_freq(self):
         return self.obs_freq + self.freq_vlsr_corr
 
+    def get_axes(self):
+        """Returns the cached frequency and velocity axes of this spectrum,
+        see get_spectrum_axes. New axes are used automatically when
+        shift_to_vlsr_frame or decimate_channels change the spectrum."""
+        return get_spectrum_axes(self.get_center_freq(), self.bandwidth, self.nchans, self.rest_freq, self.obs_freq)
+
     def get_freqs(self):
-        halffft = int(0.5*self.nchans)
-        freqs = self.get_center_freq() + 0.5*self.bandwidth*np.array(range(-halffft,halffft))/(halffft)
-        return freqs
+        return self.get_axes().freqs
 
     def get_vels(self):
-        freqs = self.get_freqs()
-        # The -1 sign is checked by comparison with the LAB survey. The formula, including sign, is however
-        # the same as used by e.g. the VLA; see "Radio velocity" at https://science.nrao.edu/facilities/vla/docs/manuals/obsguide/modes/line#DopplerCorrection
-        vels = -1*(freqs-self.rest_freq)*c/self.rest_freq 
-        return vels
+        return self.get_axes().vels
+
+    def get_date_obs(self):
+        """Returns date of observation as used in FITS and text files."""
+        dateobs = self.site.date.tuple()
+        YYYY=str(dateobs[0]); MM=str(dateobs[1]); DD=str(dateobs[2]); hh = str(dateobs[3]); mm=str(dateobs[4]); ss=str(round(dateobs[5]))
+        return YYYY.zfill(4)+'-'+MM.zfill(2)+'-'+DD.zfill(2)+'T'+hh.zfill(2)+':'+mm.zfill(2)+':'+ss.zfill(4)
+
+    def get_txt_header(self, template = None):
+        """Returns the header of the text file format, filled in for this spectrum.
+        Fields available in template are date, glon, glat, observer, obs_freq, int_time
+        and target."""
+        if template is None:
+            template = TXT_HEADER
+        date = self.get_date_obs()
+        glon = float(self.glon)*180/np.pi # Degrees
+        glat = float(self.glat)*180/np.pi # Degrees
+        return template.format(date=date, glon=glon, glat=glat, observer=self.observer, obs_freq=self.obs_freq, int_time=self.int_time, target=self.target)
+
+    def write_txt(self, text_file, template = None):
+        """Write header and data columns to an open text file."""
+        text_file.write(self.get_txt_header(template))
+        # All rows formatted in one call, same output as np.savetxt but faster
+        columns = np.column_stack((self.get_axes().vels_kms, self.data))
+        text_file.write((TXT_ROW*len(columns)) % tuple(columns.ravel().tolist()))
 
     def save_to_txt(self, outfile):
-        vels = self.get_vels() * 1e-3 # km/s
-        data = self.data
         with open(outfile, "w") as text_file:
-            text_file.write("# BEGINHEADER\n")
-            text_file.write("# This file contains data from the SALSA 2m radio telescope.\n")
-            dateobs = self.site.date.tuple()
-            YYYY=str(dateobs[0]); MM=str(dateobs[1]); DD=str(dateobs[2]); hh = str(dateobs[3]); mm=str(dateobs[4]); ss=str(round(dateobs[5]))
-            date = YYYY.zfill(4)+'-'+MM.zfill(2)+'-'+DD.zfill(2)+'T'+hh.zfill(2)+':'+mm.zfill(2)+':'+ss.zfill(4)
-            text_file.write("# DATE=" + date + "\n")
-            text_file.write("# GLON and GLAT given in degrees\n")
-            text_file.write("# GLON={0}\n".format(float(self.glon)*180/np.pi)) # Degrees
-            text_file.write("# GLAT={0}\n".format(float(self.glat)*180/np.pi)) # Degrees
-            text_file.write("# DATA in two columns below. Col. 1 is velocity relative to LSR [km/s]. Col. 2 is uncalibrated antenna temperature [K].\n")
-            text_file.write("# ENDHEADER\n")
-            for i, datum in enumerate(data):
-                text_file.write("{0} {1}\n".format(vels[i], data[i]))
-
-    def save_to_fits(self, outfile):
+            self.write_txt(text_file)
+
+    def save_to_fits(self, outfile, bitpix = 16):
         # Instructions for writing FITS at https://python4astronomers.github.io/astropy/fits.html
         # Set of keywords chosen to match SalsaJ requirements.
+        # bitpix is 16 for SalsaJ, or -32 to store the data as float32 without rescaling.
         hdu = fits.PrimaryHDU()
-        datamin = np.min(self.data)
-        datamax = np.max(self.data)
         glon = float(self.glon)*180/np.pi # degrees
         glat = float(self.glat)*180/np.pi # degrees
 
-        #Since using  int16 as datatype we use bscale and bzero to keep dynamic range. 
-        # SalsaJ cannot read bitpix correctly except 16 bit. If SalsaJ could read bitpix, we could just have BITPIX -64 and skip Bscale, Bzero, i.e. just remove 
-        # astype above.
-        bscale = (datamax-datamin)/65534.0
-        bzero = datamin+bscale*32767.0
-        #hdu.header['BLANK']  = -32768
-        scaledata = (self.data - bzero)/bscale
-        hdu.data = scaledata.reshape(1, 1, self.nchans).astype(np.int16) # 16 bit for SalsaJ
-        hdu.header['BSCALE']  = bscale
-        hdu.header['BZERO']  = bzero
+        if bitpix == -32:
+            hdu.data = self.data.reshape(1, 1, self.nchans).astype(np.float32)
+        elif bitpix == 16:
+            #Since using  int16 as datatype we use bscale and bzero to keep dynamic range. 
+            # SalsaJ cannot read bitpix correctly except 16 bit.
+            datamin = np.min(self.data)
+            datamax = np.max(self.data)
+            bscale = (datamax-datamin)/65534.0
+            bzero = datamin+bscale*32767.0
+            #hdu.header['BLANK']  = -32768
+            scaledata = (self.data - bzero)/bscale
+            hdu.data = scaledata.reshape(1, 1, self.nchans).astype(np.int16) # 16 bit for SalsaJ
+            hdu.header['BSCALE']  = bscale
+            hdu.header['BZERO']  = bzero
+        else:
+            raise ValueError("Unsupported FITS bitpix " + str(bitpix) + ", use 16 or -32.")
         hdu.header['BUNIT']  = 'K'
         hdu.header['CTYPE1'] = 'FREQ'
         hdu.header['CRPIX1'] = self.nchans/2 # number of channels
@@ -282,14 +347,12 @@ class SALSA_spectrum:
         hdu.header['RESTFREQ'] = self.rest_freq # Rest frequency of line
         hdu.header['VELO-LSR'] = (-1)*self.vlsr_corr/1000.0 # in km/s, sign as needed by SalsaJ
         hdu.header['VLSRUNIT']= 'km/s'
-        dateobs = self.site.date.tuple()
-        YYYY=str(dateobs[0]); MM=str(dateobs[1]); DD=str(dateobs[2]); hh = str(dateobs[3]); mm=str(dateobs[4]); ss=str(round(dateobs[5]))
-        hdu.header['DATE-OBS'] = YYYY.zfill(4)+'-'+MM.zfill(2)+'-'+DD.zfill(2)+'T'+hh.zfill(2)+':'+mm.zfill(2)+':'+ss.zfill(4)
+        hdu.header['DATE-OBS'] = self.get_date_obs()
         datemade = ephem.now().tuple()
         YYYY=str(datemade[0]); MM=str(datemade[1]); DD=str(datemade[2]); hh = str(datemade[3]); mm=str(datemade[4]); ss=str(round(datemade[5]))
         hdu.header['DATE'] = YYYY.zfill(4)+'-'+MM.zfill(2)+'-'+DD.zfill(2)+'T'+hh.zfill(2)+':'+mm.zfill(2)+':'+ss.zfill(4)
         hdu.header['ORIGIN'] = 'ONSALA, SWEDEN'
-        hdu.header['INSTRUME'] = self.config.get('SITE', 'name')
+        hdu.header['INSTRUME'] = self.instrument
         hdu.header['OBSTIME'] = self.int_time
         hdu.header['OBSERVER'] = self.observer
         #header['OBJECT'] = 'Milky Way'
@@ -302,49 +365,24 @@ class SALSA_spectrum:
         hdu.header['AZIMUTH'] = self.az # Degrees
         hdu.header['ELEVATIO'] = self.alt # Degrees
         hdu.header['INTTIME'] = self.int_time
-        try:
-            os.remove(outfile)
-        except OSError:
-            pass
-        hdu.writeto(outfile)
-
-    def upload_to_archive(self, fitsfile, pngfile, txtfile):
-        host = self.config.get('ARCHIVE', 'host')
-        db = self.config.get('ARCHIVE', 'database')
-        user = self.config.get('ARCHIVE', 'user')
-        passwd = self.config.get('ARCHIVE', 'password')
-        table = self.config.get('ARCHIVE', 'table')
-        # Read fitsdata
-        f_fits = open(fitsfile, 'rb')
-        fitsdata = f_fits.read()
-        f_fits.close()
-
-        f_png = open(pngfile, 'rb')
-        pngdata = f_png.read()
-        f_png.close()
-        
-        f_txt = open(txtfile, 'rb')
-        txtdata = f_txt.read()
-        f_txt.close()
-
-        # Insert to database
-        con=mdb.connect(host = host, passwd=passwd, db=db, user = user)
-        cur = con.cursor()
-        mysqlcmd = "INSERT INTO ".encode() + table.encode() + " SET file_fits=\'".encode() + con.escape_string(fitsdata) + "\',".encode()
-        mysqlcmd = mysqlcmd + "observer=\'".encode() + self.observer.encode() + "\',".encode()
-        glon = str(self.glon)
-        glat = str(self.glat)
-        mysqlcmd = mysqlcmd + "glon=\'".encode() + con.escape_string(glon) + "\',".encode()
-        mysqlcmd = mysqlcmd + "glat=\'".encode() + con.escape_string(glat) + "\',".encode()
+        hdu.writeto(outfile, overwrite=True)
+
+    def get_archive_record(self):
+        """Returns the values stored with the files in the web archive, as a dict."""
         unixtime_sec = math.floor((self.site.date.datetime() - datetime(1970, 1, 1)).total_seconds())
-        mysqlcmd = mysqlcmd + "obsdate=".encode()+ str(unixtime_sec).encode() + ",".encode()
-        mysqlcmd = mysqlcmd + "obsfreq=".encode() + str(1e-6*self.obs_freq).encode()+ ",".encode()
-        mysqlcmd = mysqlcmd + "bandwidth=".encode() + str(1e-6*self.bandwidth).encode() + ",".encode()
-        mysqlcmd = mysqlcmd + "int_time=".encode() + str(self.int_time).encode() + ",".encode()
-        mysqlcmd = mysqlcmd + "telescope=\'".encode() + self.site.name.encode() + "\',".encode()
-        mysqlcmd = mysqlcmd + "file_png=\'".encode() + con.escape_string(pngdata) + "\'".encode() + ",".encode()
-        mysqlcmd = mysqlcmd + "file_txt=\'".encode() + con.escape_string(txtdata) + "\'".encode()
-        cur.execute(mysqlcmd)
+        return {'observer': self.observer,
+                'glon': str(self.glon),
+                'glat': str(self.glat),
+                'obsdate': unixtime_sec,
+                'obsfreq': 1e-6*self.obs_freq,
+                'bandwidth': 1e-6*self.bandwidth,
+                'int_time': self.int_time,
+                'telescope': self.site.name}
+
+    def upload_to_archive(self, fitsfile, pngfile, txtfile, config):
+        # Archive settings are read from the given config.
+        # Blocks until done, see archive.ArchiveUploader for background uploads.
+        upload(config, self.get_archive_record(), (fitsfile, pngfile, txtfile))
         self.uploaded = True
 
     def get_total_power(self):
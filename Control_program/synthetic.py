@@ -0,0 +1,212 @@
+from accumulator import *
+from backend import *
+import numpy as np
+import threading
+import time
+
+class SyntheticReceiver(ReceiverBackend):
+    """ Receiver backend producing simulated spectra with NumPy, no USRP needed.
+
+    Every dump is a band-pass shaped noise spectrum with an HI line
+    and a few narrow RFI spikes, at a given number of dumps per second.
+    Used to test and benchmark measurement and post-processing without
+    telescope time. Settings are read from the SYNTHETIC section of the
+    config file, with defaults if missing:
+        dump_rate: Dumps per second, 0 to produce dumps as fast as possible.
+            Default is the same rate as the USRP receiver.
+        line_amplitude: Peak of HI line relative to system temperature.
+        noise: Relative noise RMS of one dump.
+        rfi: If spikes at known RFI frequencies shall be added.
+        seed: Seed for random number generator, for reproducible data."""
+
+    rest_freq = 1420.40575177e6 # Hz
+    # RFI as centre frequency [MHz] and relative amplitude
+    RFI = [[1420.4+4.595, 2.0],
+           [1420.4-0.392, 0.5],
+           [1420.4+0.182, 0.3],
+           ]
+
+    def __init__(self, c_freq, int_time, samp_rate, fftsize, config, usrp_gain, sink_mode = "memory"):
+        self.c_freq = float(c_freq)
+        self.int_time = int_time
+        self.samp_rate = float(samp_rate)
+        self.fftsize = int(fftsize)
+        self.gain = usrp_gain
+        self.sink_mode = sink_mode
+        self.config = config
+        self.dump_rate = config.getfloat('SYNTHETIC', 'dump_rate', fallback=None)
+        self.line_amplitude = config.getfloat('SYNTHETIC', 'line_amplitude', fallback=0.2)
+        self.noise = config.getfloat('SYNTHETIC', 'noise', fallback=0.01)
+        self.rfi = config.getboolean('SYNTHETIC', 'rfi', fallback=True)
+        self.rng = np.random.default_rng(config.getint('SYNTHETIC', 'seed', fallback=None))
+        self.band_freqs = None
+        self.output = NULL
+        self.files = {}
+        self.file_dumps = {} # Number of dumps written to each open file
+        self.lock = threading.Lock()
+        self.running = threading.Event()
+        self.thread = None
+        self.ndumps = 0 # Total number of dumps produced, for benchmarking
+        self.build_chain()
+
+    def build_chain(self):
+        self.sig_accumulator = SpectrumAccumulator(self.fftsize)
+        self.ref_accumulator = SpectrumAccumulator(self.fftsize)
+        self.update_model()
+
+    def update_model(self):
+        if self.band_freqs is None:
+            self.model = self.get_model(self.c_freq)
+        else:
+            self.models = [self.get_model(freq) for freq in self.band_freqs]
+
+    def get_model(self, c_freq):
+        """Returns the noise free spectrum for the given centre frequency."""
+        n = self.fftsize
+        # Position in band, -1 to 1
+        x = np.arange(-n//2, n//2)/(0.5*n)
+        freqs = c_freq + 0.5*self.samp_rate*x
+        # Band-pass with roll-off at edges and some ripple
+        bandpass = (1.0 - 0.5*x**8) * (1.0 + 0.02*np.cos(6*np.pi*x))
+        # HI line, two components 20 km/s apart with width ~10 km/s
+        dv = 20.0/3e5*self.rest_freq # Hz
+        sigma = 10.0/3e5*self.rest_freq
+        line = np.exp(-0.5*((freqs-self.rest_freq)/sigma)**2)
+        line += 0.5*np.exp(-0.5*((freqs-self.rest_freq-dv)/sigma)**2)
+        spec = 1.0 + self.line_amplitude*line
+        if self.rfi:
+            for (rfi_freq, amplitude) in self.RFI:
+                ind = int(round((rfi_freq*1e6 - freqs[0])*n/self.samp_rate))
+                if 0 <= ind < n:
+                    spec[ind] += amplitude
+        # Scale roughly like the USRP output, which depends on gain
+        scale = 1e-3 * 10**(0.1*(self.gain-40))
+        return (scale*bandpass*spec).astype(np.float32)
+
+    def get_dumps(self, ndumps, model):
+        noise = self.rng.standard_normal((ndumps, self.fftsize), dtype=np.float32)
+        return model * (1.0 + self.noise*noise)
+
+    def start(self):
+        self.running.set()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running.clear()
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        dump_rate = self.dump_rate
+        if dump_rate is None:
+            # Same rate as the USRP receiver, one dump per N FFTs
+            dump_rate = self.samp_rate/(get_integration_length(self.config, self.samp_rate)*self.fftsize)
+        if dump_rate > 0:
+            # Produce dumps in batches of ~0.1 s
+            batch = max(1, int(round(0.1*dump_rate)))
+            interval = batch/dump_rate
+        else:
+            batch = 64
+            interval = 0
+        next_time = time.time()
+        while self.running.is_set():
+            with self.lock:
+                if self.band_freqs is None:
+                    self.store(self.output, self.get_dumps(batch, self.model))
+                elif self.output != NULL:
+                    # Both bands are recorded at the same time
+                    self.store(SIG, self.get_dumps(batch, self.models[0]))
+                    self.store(REF, self.get_dumps(batch, self.models[1]))
+                self.ndumps += batch
+            if interval > 0:
+                next_time += interval
+                time.sleep(max(0.0, next_time - time.time()))
+
+    def store(self, output, dumps):
+        if output == NULL:
+            return
+        if self.sink_mode == "memory":
+            self.get_accumulator(output).add(dumps)
+        elif output in self.files:
+            dumps.tofile(self.files[output])
+            self.file_dumps[output] += len(dumps)
+
+    def get_accumulator(self, output):
+        if output == SIG:
+            return self.sig_accumulator
+        else:
+            return self.ref_accumulator
+
+    def tune(self, c_freq):
+        self.set_c_freq(c_freq)
+
+    def select(self, output):
+        with self.lock:
+            self.output = output
+
+    def open_dump(self, output, filename):
+        write_dump_header(filename, self.get_dump_header(output))
+        with self.lock:
+            self.files[output] = open(filename, 'ab')
+            self.file_dumps[output] = 0
+
+    def close_dump(self, output):
+        with self.lock:
+            f = self.files.pop(output)
+            f.close()
+            update_dump_count(f.name, self.file_dumps.pop(output))
+
+    def get_samp_rate(self):
+        return self.samp_rate
+
+    def set_samp_rate(self, samp_rate):
+        self.samp_rate = samp_rate
+        self.update_model()
+
+    def get_int_time(self):
+        return self.int_time
+
+    def set_int_time(self, int_time):
+        self.int_time = int_time
+
+    def get_gain(self):
+        return self.gain
+
+    def set_gain(self, gain):
+        self.gain = gain
+        self.update_model()
+
+    def get_fftsize(self):
+        return self.fftsize
+
+    def set_fftsize(self, fftsize):
+        if fftsize != self.fftsize:
+            self.fftsize = fftsize
+            self.build_chain()
+
+    def get_sink_mode(self):
+        return self.sink_mode
+
+    def set_sink_mode(self, sink_mode):
+        self.sink_mode = sink_mode
+
+    def get_c_freq(self):
+        return self.c_freq
+
+    def set_c_freq(self, c_freq):
+        with self.lock:
+            self.c_freq = c_freq
+            self.update_model()
+
+    def get_band_freqs(self):
+        return self.band_freqs
+
+    def set_band_freqs(self, band_freqs):
+        with self.lock:
+            self.band_freqs = band_freqs
+            self.update_model()
@@ -2,19 +2,149 @@ import socket
 import time
 import ephem
 import numpy as np
-import sys
-from PyQt5 import QtWidgets, QtCore
 import threading
+from rot2prog import *
+from tracking import *
+
+class MD01Connection():
+    """ Persistent TCP connection to the MD01 Ethernet module.
+
+    The connection is opened when the first command is sent and then kept
+    open, since connecting for every command is slow and loads the small
+    network stack of the MD01. Replies of the Rot2Prog protocol have a fixed
+    length of 12 bytes, starting with 0x57 and ending with 0x20, so a reply
+    is read until complete instead of waiting a fixed time. Bytes left from
+    earlier commands are discarded before a new command is sent.
+
+    If sending or receiving fails, the connection is closed and a new one is
+    opened at the next command. After failures, new connections are only
+    tried after a delay, which is doubled for every failure up to max_backoff,
+    so that a missing device is not flooded with connection attempts.
+    Commands sent while waiting raise MD01Error at once."""
+
+    def __init__(self, host, port, timeout = 2.0, max_backoff = 30.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout # s
+        self.min_backoff = 1.0 # s
+        self.max_backoff = max_backoff # s
+        self.sock = None
+        self.lock = threading.Lock()
+        self.backoff = 0
+        self.next_attempt = 0 # Time when connecting may be tried again
+        # Statistics
+        self.nrequests = 0
+        self.ntimeouts = 0
+        self.nerrors = 0
+        self.nconnects = 0
+        self.failures = 0 # Failed requests in a row
+        self.last_latency = None # s
+        self.max_latency = 0 # s
+
+    def is_connected(self):
+        return self.sock is not None
+
+    def get_stats(self):
+        """Returns a dict with the number of requests, timeouts, other errors and
+        connections made, and the latest and largest request time [s]."""
+        return {'requests': self.nrequests, 'timeouts': self.ntimeouts, 'errors': self.nerrors,
+                'connects': self.nconnects, 'failures': self.failures,
+                'last_latency': self.last_latency, 'max_latency': self.max_latency}
+
+    def request(self, msg, reply = True):
+        """Send a command and return the reply as bytes, or None if reply is
+        False. Raises MD01Error if it fails."""
+        with self.lock:
+            if self.sock is None and time.time() < self.next_attempt:
+                raise MD01Error("Not connected to MD01 at {}:{}, retrying in {:.0f} s".format(self.host, self.port, self.next_attempt - time.time()))
+            self.nrequests += 1
+            t0 = time.time()
+            try:
+                self._connect()
+                self._drain()
+                self.sock.sendall(msg)
+                data = self._recv_reply() if reply else None
+            except socket.timeout as e:
+                self.ntimeouts += 1
+                self._fail()
+                raise MD01Error("Timeout waiting for MD01 at {}:{}".format(self.host, self.port)) from e
+            except MD01Error:
+                self.nerrors += 1
+                self._fail()
+                raise
+            except OSError as e:
+                self.nerrors += 1
+                self._fail()
+                raise MD01Error("Communication with MD01 at {}:{} failed: {}".format(self.host, self.port, e)) from e
+            self.last_latency = time.time() - t0
+            self.max_latency = max(self.max_latency, self.last_latency)
+            self.failures = 0
+            self.backoff = 0
+            return data
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def _connect(self):
+        if self.sock is not None:
+            return
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        self.nconnects += 1
+
+    def _drain(self):
+        # Discard any late reply to an earlier command
+        self.sock.setblocking(False)
+        try:
+            while True:
+                data = self.sock.recv(1024)
+                if not data:
+                    raise MD01Error("Connection closed by MD01")
+        except BlockingIOError:
+            pass
+        finally:
+            self.sock.settimeout(self.timeout)
+
+    def _recv_reply(self):
+        data = b''
+        while len(data) < REPLY_SIZE:
+            chunk = self.sock.recv(REPLY_SIZE - len(data))
+            if not chunk:
+                raise MD01Error("Connection closed by MD01")
+            data += chunk
+        check_reply(data)
+        return data
+
+    def _fail(self):
+        self._close()
+        self.failures += 1
+        self.backoff = min(self.max_backoff, max(self.min_backoff, 2*self.backoff))
+        self.next_attempt = time.time() + self.backoff
+
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
 
 class TelescopeController():
     """ Provides functions to communicate with the MD01 telescope driver
-    device. Communication via telnet using python socket. """
+    device. Communication via telnet using python socket. Commands are
+    sent by a TrackingEngine thread, so no Qt event loop is needed."""
 
     def __init__(self, config):
         """ Creates a new object with a connection to driver."""
         # Create connection to MD01
         self.host = config.get('MD01', 'host')
         self.port = config.getint('MD01', 'port')
+        self.connection = MD01Connection(self.host, self.port,
+                config.getfloat('MD01', 'timeout', fallback=2.0),
+                config.getfloat('MD01', 'max_backoff', fallback=30.0))
+        self.connection_ok = True
         self.site = ephem.Observer()
         self.site.date = ephem.now()
         self.site.lat = ephem.degrees(config.get('SITE', 'latitude'))
@@ -35,82 +165,80 @@ class TelescopeController():
         self.minal_deg = config.getfloat('MD01', 'minal')
         self.maxal_deg = config.getfloat('MD01', 'maxal')
 
-        # Create timer used to toggle (and update) tracking
-        self.trackingtimer = QtCore.QTimer()
-        self.trackingtimer.timeout.connect(self.do_action)
-        self.trackingtimer.start(1000) # ms. VERY IMPORTANT: Never go quicker than once per second, else PULS TIMEOUT errors.
-        self.action = ""
+        # Pulses per degree of the azimuth and altitude axes
+        self.ph = config.getint('MD01', 'ph', fallback=10)
+        self.pv = config.getint('MD01', 'pv', fallback=10)
+
         self.target_alaz = (0,0)
-        self.current_alaz = (0,0)
+
+        # Thread sending commands, at most once per second to avoid PULS TIMEOUT errors.
+        self.engine = TrackingEngine(self.md01,
+                config.getfloat('MD01', 'interval', fallback=1.0),
+                config.getfloat('MD01', 'lead_time', fallback=1.0),
+                config.getfloat('MD01', 'slew_threshold', fallback=1.0),
+                config.getfloat('MD01', 'slew_rate', fallback=1.0),
+                self.ph, self.pv,
+                config.getfloat('MD01', 'max_lead', fallback=10.0),
+                (self.minal_deg, self.maxal_deg))
+        self.engine.start()
+
+    def close(self):
+        """Stop sending commands to the MD01."""
+        self.engine.close()
+        self.connection.close()
 
     def restart(self):
-        self._stop()
-        time.sleep(1.0) # Seconds, to ensure device is ready
-        msg = bytes.fromhex("57EFBEADDE000000000000EE20")
-        self.md01(msg)
-        time.sleep(19.0) # Seconds, to ensure device is ready
-
-    def do_action(self):
-        #print(self.action)
-        if self.action=="MOVE":
-            # If we are going to move to new position, first stop
-            self._stop()
-            # Then tell us to move as next action
-            self.action="START"
-        elif self.action=="START":
-            self._start()
-            self.action=""
-        elif self.action=="STOP":
-            self._stop()
-            self.action=""
-            # Remove local memory of previous target position, else we cannot stop and restart slew to same position.
-            self.target_alaz = (-1,-1)
-        else:
-            self._get_current_alaz()
-            self.action=""
+        """Restart the MD01 and wait until done."""
+        if not self.engine.restart():
+            print("WARNING: Restart of MD01 at {}:{} not completed.".format(self.host, self.port))
+        # Remove local memory of previous target position
+        self.target_alaz = (-1,-1)
+
+    @property
+    def current_alaz(self):
+        return self.engine.get_current_alaz()
 
-    def md01(self, m):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(2)
+    def get_state(self):
+        """Returns IDLE, SLEWING or TRACKING."""
+        return self.engine.get_state()
+
+    def md01(self, m, reply = True):
+        """Send a message to the MD01 and return the reply as hex string,
+        or an empty string if no reply is expected. Returns None if the
+        message could not be sent, e.g. if the network is down."""
         try:
-            sock.connect((self.host, self.port))
-        except socket.error as e:
-            self.show_message(e)
-            sys.exit(1)
-        # Send message to MD01
-        sock.send(m)
-        time.sleep(0.01) # Seconds, to ensure message is ready, just in case
-        # Read response from MD01
-        data = sock.recv(1024)
-        sock.close()
+            data = self.connection.request(m, reply)
+            if m == RESTART:
+                # Device restarts, so the connection must be opened again
+                self.connection.close()
+        except MD01Error as e:
+            # Only report when connection is lost, not for every retry
+            if self.connection_ok:
+                print("WARNING: " + str(e))
+            self.connection_ok = False
+            return None
+        if not self.connection_ok:
+            print("Connection to MD01 restored.")
+            self.connection_ok = True
+        if data is None:
+            return ""
         # Decode bytes to hex
         return data.hex()
+
+    def get_connection_ok(self):
+        """Returns False if the latest command could not be sent to the MD01."""
+        return self.connection_ok
     
     def _set_current_azel(self,taz,tel):
         """ Set the current az el position of MD01 to the given values. NOTE: This is the actual current position reading, not the target pos.!"""
-        PH = 10 # Pulses per degree, 0A in hex
-        PV = 10 # Pulses per degree, 0A in hex
-        H = str(int(PH * (360+taz)))
-        H1 = "3"+H[0]
-        H2 = "3"+H[1]
-        H3 = "3"+H[2]
-        H4 = "3"+H[3]
-        V = str(int(PV * (360+tel)))
-        V1 = "3"+V[0]
-        V2 = "3"+V[1]
-        V3 = "3"+V[2]
-        V4 = "3"+V[3]
-        msg = bytes.fromhex("57"+H1+H2+H3+H4+"0A"+V1+V2+V3+V4+"0AF920")
-        self.md01(msg)
+        # Sent by the engine, so the one command per second limit holds
+        self.engine.calibrate(tel, taz)
        
     def stop(self):
-        self.action="STOP"
-
-    def _stop(self):
         """Stops any movement of the telescope """
-        #Format status request message as bytes
-        msg = bytes.fromhex("57000000000000000000000F20")
-        self.md01(msg)
+        self.engine.stop()
+        # Remove local memory of previous target position, else we cannot stop and restart slew to same position.
+        self.target_alaz = (-1,-1)
 
     def can_reach(self, al, az):
         """Check if telescope can reach this position. Assuming input in degrees.
@@ -128,67 +256,25 @@ class TelescopeController():
             al = round(al, 2)
             #print 'AL: Sorry, altitude' + str(al) + ' is not reachable by this telescope.'
             return False
+        if (az > AZ_RANGE[1] or az < AZ_RANGE[0]):
+            return False
         return True
 
-    def _start(self):
-        tel, taz = self.target_alaz
-        #print("Moving to (pointing corrected) alt,az ",tel, taz)
-        PH = 10 # Pulses per degree, 0A in hex
-        PV = 10 # Pulses per degree, 0A in hex
-        H = str(int(PH * (360+taz)))
-        H1 = "3"+H[0]
-        H2 = "3"+H[1]
-        H3 = "3"+H[2]
-        H4 = "3"+H[3]
-        V = str(int(PV * (360+tel)))
-        V1 = "3"+V[0]
-        V2 = "3"+V[1]
-        V3 = "3"+V[2]
-        V4 = "3"+V[3]
-        msg = bytes.fromhex("57"+H1+H2+H3+H4+"0A"+V1+V2+V3+V4+"0A2F20")
-        self.md01(msg)
-    
     def get_stow_alaz(self):
         """Returns the stow altitude and azimuth of the telescope as a tuple of decimal numbers [degrees]."""
         return (self.stowal_deg, self.stowaz_deg)
 
     def set_target_alaz(self, al, az):
-        # TODO: Fix a proper tracking loop, to check if we for some reason are stuck and not moving
-        #print("SET", al, az)
-        """Set the target altitude and azimuth of the telescope. Arguments in degrees."""
+        """Set the target altitude and azimuth of the telescope. Arguments in degrees.
+        Call repeatedly while following a moving source, so that the tracking
+        engine can estimate its motion and lead it."""
         tal, taz = self.pcor(al, az)
         if self.can_reach(tal,taz):
-            #print("SET", tal, taz)
-            new_target_alaz = (round(tal,1), round(taz,1))
-            if (new_target_alaz!=self.target_alaz):
-                #print("SET CHANGE")
-                #print("CHANGING TARGET TO (el,az) = ({0:5.1f},{1:5.1f}) from ({2:5.1f},{3:5.1f})...".format(*new_target_alaz, *self.target_alaz))
-                self.target_alaz=new_target_alaz
-                #self.action="MOVE"
-                self.action="START"
-                #print("SET ACTION", self.action)
+            self.target_alaz = (round(tal,1), round(taz,1))
+            self.engine.set_target_alaz(tal, taz)
         else: 
             raise ValueError("Cannot reach desired position. Target outside altitude range " + str(round(self.minal_deg,2)) + " to "+ str(round(self.maxal_deg,2))+" degrees. Please adjust your desired position.")
         
-    def _get_current_alaz(self):
-        """Returns the current altitude and azimuth of the telescope as a tuple of decimal numbers [degrees]."""
-        #Format status request message as bytes
-        msg = bytes.fromhex("57000000000000000000001F20")
-        ans = self.md01(msg)
-        # Extract relevant data as floating point numbers
-        H1 = float(ans[2:4])
-        H2 = float(ans[4:6])
-        H3 = float(ans[6:8])
-        H4 = float(ans[8:10])
-        V1 = float(ans[12:14])
-        V2 = float(ans[14:16])
-        V3 = float(ans[16:18])
-        V4 = float(ans[18:20])
-        # Calculate angles for Az/El
-        az = H1 * 100 + H2 * 10 + H3 + H4 / 10 -360
-        el = V1 * 100 + V2 * 10 + V3 + V4 / 10 -360
-        self.current_alaz = (el, az)
-
     def get_current_alaz(self):
         return self.invpcor(*self.current_alaz)
 
@@ -263,6 +349,7 @@ class TelescopeController():
         else:
             m = str(e)
         print(m)
+        from PyQt5 import QtWidgets
         msg = QtWidgets.QMessageBox()
         msg.setIcon(QtWidgets.QMessageBox.Information)
         msg.setText(m)
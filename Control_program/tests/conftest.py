@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import configparser
+import pytest
+
+# Modules of the control program are imported by name, as when the
+# programs are run from the Control_program directory.
+PROGRAM_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, PROGRAM_DIR)
+
+@pytest.fixture
+def config():
+    """The default config file, as used by a new installation."""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(PROGRAM_DIR, 'SALSA.config.default'))
+    return config
+
+@pytest.fixture
+def make_spectrum(config):
+    """Function returning a spectrum with the given data, as measured at
+    date towards altitude 45 and azimuth 180 degrees."""
+    import ephem
+    from benchmark import get_site
+    from spectrum import SALSA_spectrum
+    def make_spectrum(data, date = '2026/10/18 18:00'):
+        site = get_site(config)
+        site.date = ephem.Date(date)
+        return SALSA_spectrum(data, 2.5e6, len(data), 1420.4e6, site, 45.0, 180.0, 10, "test", config, 0, 0, "Galactic")
+    return make_spectrum
+
+@pytest.fixture
+def wait_until():
+    """Function waiting until condition() is true, e.g. for a thread,
+    failing the test after timeout seconds."""
+    def wait_until(condition, timeout = 5.0):
+        end = time.time() + timeout
+        while not condition():
+            assert time.time() < end
+            time.sleep(0.05)
+    return wait_until
+
+@pytest.fixture
+def md01_server(config):
+    """A simulated MD01 on a free port, served from an event loop in a
+    background thread, as a telescope would be."""
+    import asyncio
+    import threading
+    from md01sim import SimulatedMD01, MD01Server
+    server = MD01Server(SimulatedMD01(config), port=0)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start())
+    thread = threading.Thread(target=loop.run_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    # Finish handlers of connections still open before closing the loop
+    server.close()
+    async def cancel_tasks():
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    loop.run_until_complete(cancel_tasks())
+    loop.close()
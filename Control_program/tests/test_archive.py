@@ -0,0 +1,114 @@
+import os
+import time
+import sqlite3
+import threading
+import pytest
+from archive import *
+
+RECORD = {'observer': 'test', 'glon': '120:00:00.0', 'glat': '0:00:00.0', 'obsdate': 1700000000,
+          'obsfreq': 1420.4, 'bandwidth': 2.5, 'int_time': 10, 'telescope': 'Vale'}
+
+@pytest.fixture
+def archive_config(config, tmp_path):
+    config.set('ARCHIVE', 'backend', 'sqlite')
+    config.set('ARCHIVE', 'database', str(tmp_path / "archive.db"))
+    config.set('ARCHIVE', 'retry_delay', '0.1')
+    config.set('ARCHIVE', 'max_retries', '2')
+    return config
+
+@pytest.fixture
+def files(tmp_path):
+    files = []
+    for (ext, content) in [('fits', b'SIMPLE'), ('png', bytes(range(256))), ('txt', b'# BEGINHEADER\n')]:
+        filename = str(tmp_path / ("spectrum." + ext))
+        with open(filename, 'wb') as f:
+            f.write(content)
+        files.append(filename)
+    return files
+
+class StatusLog():
+    """Callback of ArchiveUploader, collecting the status reports of all jobs."""
+
+    def __init__(self):
+        self.reports = []
+        self.changed = threading.Condition()
+
+    def __call__(self, key, status, message):
+        with self.changed:
+            self.reports.append((key, status, message))
+            self.changed.notify_all()
+
+    def get_statuses(self, key):
+        return [status for (k, status, message) in self.reports if k == key]
+
+    def wait_for(self, key, status, timeout = 5.0):
+        with self.changed:
+            assert self.changed.wait_for(lambda: status in self.get_statuses(key), timeout)
+
+def test_upload_done(archive_config, files):
+    log = StatusLog()
+    uploader = ArchiveUploader(archive_config, log)
+    uploader.submit('a', RECORD, files)
+    uploader.submit('b', RECORD, files, remove_files = True)
+    uploader.wait()
+    uploader.stop()
+    assert log.get_statuses('a') == [QUEUED, UPLOADING, DONE]
+    assert log.get_statuses('b') == [QUEUED, UPLOADING, DONE]
+    assert not any(os.path.exists(filename) for filename in files)
+    con = sqlite3.connect(archive_config.get('ARCHIVE', 'database'))
+    rows = con.execute("SELECT observer, obsdate, file_png FROM salsa_archive").fetchall()
+    con.close()
+    assert rows == [('test', 1700000000, bytes(range(256)))]*2
+
+def test_retry_until_failed(archive_config, files, tmp_path):
+    # Database cannot be opened, an operational error which is retried
+    archive_config.set('ARCHIVE', 'database', str(tmp_path / "missing" / "archive.db"))
+    log = StatusLog()
+    uploader = ArchiveUploader(archive_config, log)
+    t0 = time.time()
+    uploader.submit('a', RECORD, files)
+    uploader.wait()
+    elapsed = time.time() - t0
+    uploader.stop()
+    assert log.get_statuses('a') == [QUEUED, UPLOADING, RETRYING, RETRYING, FAILED]
+    messages = [message for (key, status, message) in log.reports if status == RETRYING]
+    assert "0.1 s" in messages[0] and "0.2 s" in messages[1]
+    assert elapsed >= 0.3
+
+def test_invalid_job_not_retried(archive_config, files):
+    log = StatusLog()
+    uploader = ArchiveUploader(archive_config, log)
+    uploader.submit('a', RECORD, files[:2] + [files[2] + ".missing"])
+    uploader.submit('b', dict((k, v) for (k, v) in RECORD.items() if k != 'glon'), files)
+    uploader.wait()
+    uploader.stop()
+    assert log.get_statuses('a') == [QUEUED, UPLOADING, FAILED]
+    assert log.get_statuses('b') == [QUEUED, UPLOADING, FAILED]
+    failed = [message for (key, status, message) in log.reports if status == FAILED]
+    assert "spectrum.txt.missing" in failed[0] and "glon" in failed[1]
+
+def test_stop_without_wait(archive_config, files, tmp_path):
+    archive_config.set('ARCHIVE', 'database', str(tmp_path / "missing" / "archive.db"))
+    archive_config.set('ARCHIVE', 'retry_delay', '30')
+    log = StatusLog()
+    uploader = ArchiveUploader(archive_config, log)
+    uploader.submit('a', RECORD, files)
+    uploader.submit('b', RECORD, files)
+    log.wait_for('a', RETRYING)
+    t0 = time.time()
+    uploader.stop(wait = False)
+    assert time.time() - t0 < 5.0
+    assert log.get_statuses('a') == [QUEUED, UPLOADING, RETRYING, FAILED]
+    assert log.get_statuses('b') == [QUEUED, FAILED]
+    assert log.reports[-1] == ('b', FAILED, "Upload cancelled.")
+
+@pytest.mark.parametrize('option,value,error', [('table', 'salsa archive', "Invalid archive table name"),
+                                                ('backend', 'postgres', "Unknown archive backend")])
+def test_connection_error_reported(archive_config, files, option, value, error):
+    archive_config.set('ARCHIVE', option, value)
+    log = StatusLog()
+    uploader = ArchiveUploader(archive_config, log)
+    uploader.submit('a', RECORD, files)
+    uploader.stop()
+    assert log.get_statuses('a') == [QUEUED, FAILED]
+    assert error in log.reports[-1][2]
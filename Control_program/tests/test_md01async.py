@@ -0,0 +1,28 @@
+from md01async import *
+
+def test_array_stop_sends_pending_stop(md01_server, wait_until):
+    md01 = md01_server.md01
+    client = AsyncMD01("test", md01_server.host, md01_server.port)
+    array = MD01Array([client])
+    array.start()
+    client.set_target_alaz(45.0, 200.0)
+    wait_until(lambda: md01.al.target == 45.0)
+    # Stop and quit at once, as the tracking program does
+    client.stop()
+    array.stop()
+    assert not client.stop_requested
+    assert md01.al.target != 45.0 and md01.az.target != 200.0
+    assert md01.nfaults == 0
+
+def test_close_without_stop(md01_server, wait_until):
+    md01 = md01_server.md01
+    client = AsyncMD01("test", md01_server.host, md01_server.port)
+    array = MD01Array([client])
+    array.start()
+    client.set_target_alaz(45.0, 200.0)
+    wait_until(lambda: md01.al.target == 45.0)
+    ncommands = md01.ncommands
+    array.stop()
+    # Telescope keeps moving to the target
+    assert md01.ncommands <= ncommands + 1
+    assert md01.al.target == 45.0
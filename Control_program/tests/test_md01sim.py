@@ -0,0 +1,154 @@
+import socket
+import time
+import pytest
+from md01sim import *
+from telescope import TelescopeController
+from tracking import IDLE, TRACKING
+
+class Clock():
+    """Clock of the simulator, advanced by the test instead of waiting."""
+
+    def __init__(self):
+        self.time = 1000.0
+
+    def __call__(self):
+        return self.time
+
+    def advance(self, dt):
+        self.time += dt
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+@pytest.fixture
+def md01(config, clock):
+    return SimulatedMD01(config, clock)
+
+def send(md01, clock, command, dt = 1.0):
+    """Send a command after dt seconds, returns the position reported."""
+    clock.advance(dt)
+    return decode_reply(md01.handle(command))
+
+def test_axis_slew_dynamics():
+    axis = SimulatedAxis(0.0, 1.0, 2.0, AZ_RANGE)
+    axis.set_target(20.0)
+    (t, dt) = (0.0, 0.01)
+    while axis.is_moving():
+        velocity = axis.velocity
+        axis.advance(dt)
+        t += dt
+        assert abs(axis.velocity) <= axis.rate + 1e-9
+        if axis.is_moving():
+            # Last step stops at the target from a low velocity
+            assert abs(axis.velocity - velocity) <= axis.accel*dt + 1e-9
+        if abs(t - 0.5) < dt/2:
+            # End of acceleration, 0.5*a*t^2 from start
+            assert axis.velocity == pytest.approx(1.0)
+            assert axis.position == pytest.approx(0.25, abs=0.02)
+        assert t < 30
+    # 0.5 s to accelerate and decelerate, 19.5 s at full rate
+    assert t == pytest.approx(20.5, abs=0.1)
+    assert axis.position == 20.0
+
+def test_axis_stop_decelerates():
+    axis = SimulatedAxis(0.0, 1.0, 2.0, AZ_RANGE)
+    axis.set_target(20.0)
+    for i in range(200):
+        axis.advance(0.01)
+    position = axis.position
+    axis.stop()
+    while axis.is_moving():
+        axis.advance(0.01)
+    # Stops within v^2/2a = 0.25 degrees
+    assert axis.position == pytest.approx(position + 0.25, abs=0.02)
+
+def test_slew_and_quantization(md01, clock):
+    assert send(md01, clock, STATUS) == (90.0, 260.0)
+    send(md01, clock, set_command(80.0, 280.0))
+    for i in range(40):
+        (al, az) = send(md01, clock, STATUS, 0.95)
+        # Reported with the 0.1 degree resolution of 10 pulses per degree
+        assert (al, az) == pytest.approx((round(md01.al.position, 1), round(md01.az.position, 1)), abs=1e-9)
+        assert (al*10, az*10) == pytest.approx((round(al*10), round(az*10)), abs=1e-9)
+    assert (al, az) == (80.0, 280.0)
+    assert not md01.az.is_moving() and not md01.al.is_moving()
+
+@pytest.mark.parametrize('ph,az,reported', [(2, 280.3, 280.5), (4, 280.3, 280.2), (10, 280.3, 280.3)])
+def test_reply_in_tenths_of_degree(config, clock, ph, az, reported):
+    # Replies are in 0.1 degrees for any pulses per degree, which are
+    # only given in the PH and PV bytes of the reply.
+    config.set('MD01', 'ph', str(ph))
+    config.set('MD01', 'pv', str(ph))
+    md01 = SimulatedMD01(config, clock)
+    send(md01, clock, set_command(80.0, az, ph, ph))
+    clock.advance(100)
+    reply = md01.handle(STATUS)
+    assert (reply[5], reply[10]) == (ph, ph)
+    assert decode_reply(reply) == pytest.approx((80.0, reported), abs=1e-9)
+    assert decode_reply(encode_reply(12.3, -45.6, ph, ph)) == pytest.approx((12.3, -45.6), abs=1e-9)
+
+def test_decode_reply_ignores_pulses():
+    # Azimuth 6400 and altitude 4500 tenths of a degree, from an MD01 set to 2 pulses per degree
+    assert decode_reply(bytes.fromhex("570604000002040500000220")) == (90.0, 280.0)
+
+def test_altitude_limits(config, md01, clock):
+    minal = config.getfloat('MD01', 'minal')
+    maxal = config.getfloat('MD01', 'maxal')
+    send(md01, clock, set_command(minal - 5.0, 260.0))
+    assert md01.al.target == minal
+    send(md01, clock, set_command(maxal + 3.0, 260.0))
+    assert md01.al.target == maxal
+    clock.advance(200)
+    assert send(md01, clock, STATUS)[0] == maxal
+
+def test_puls_timeout(md01, clock):
+    send(md01, clock, set_command(80.0, 280.0))
+    send(md01, clock, STATUS, 0.5)
+    # Telescope stops, and set commands are ignored until restarted
+    assert md01.fault == 'PULS TIMEOUT' and md01.nfaults == 1
+    assert not md01.az.is_moving()
+    position = send(md01, clock, set_command(70.0, 300.0), 2.0)
+    clock.advance(10.0)
+    assert send(md01, clock, STATUS) == position
+    clock.advance(1.0)
+    assert md01.handle(RESTART) is None
+    assert md01.is_restarting()
+    clock.advance(md01.restart_time)
+    assert not md01.is_restarting()
+    assert md01.fault is None
+    send(md01, clock, set_command(70.0, 300.0), 0.1)
+    assert md01.az.target == 300.0
+    assert md01.nfaults == 1
+
+def test_server_resynchronizes(md01_server):
+    sock = socket.create_connection((md01_server.host, md01_server.port), timeout=5)
+    try:
+        # A stray byte, and a garbled packet with a start byte inside
+        for garbage in [b'\x00', bytes([START, 0]) + STATUS[:5]]:
+            sock.sendall(garbage + STATUS)
+            reply = b''
+            while len(reply) < REPLY_SIZE:
+                reply += sock.recv(REPLY_SIZE - len(reply))
+            assert decode_reply(reply) == (90.0, 260.0)
+            time.sleep(1.0)
+    finally:
+        sock.close()
+
+def test_telescope_controller(config, md01_server, wait_until):
+    md01 = md01_server.md01
+    for axis in [md01.az, md01.al]:
+        (axis.rate, axis.accel) = (10.0, 20.0)
+    config.set('MD01', 'host', md01_server.host)
+    config.set('MD01', 'port', str(md01_server.port))
+    tel = TelescopeController(config)
+    try:
+        tel.set_target_alaz(80.0, 250.0)
+        wait_until(lambda: tel.get_state() == TRACKING and tel.is_tracking(), 10.0)
+        assert tel.get_current_alaz() == pytest.approx((80.0, 250.0), abs=0.1)
+        tel.stop()
+        wait_until(lambda: tel.get_state() == IDLE)
+        assert tel.get_connection_ok()
+        assert md01.nfaults == 0
+    finally:
+        tel.close()
@@ -0,0 +1,186 @@
+import math
+import time
+import ephem
+import numpy as np
+import pytest
+from scipy import signal
+from benchmark import get_site, get_session
+from measurement import *
+from synthetic import SyntheticReceiver
+
+@pytest.fixture
+def synthetic_config(config, tmp_path):
+    config.set('USRP', 'backend', 'synthetic')
+    config.set('USRP', 'tmpdir', str(tmp_path))
+    config.set('USRP', 'preview_interval', '0')
+    config.set('SYNTHETIC', 'dump_rate', '200')
+    config.set('SYNTHETIC', 'seed', '1')
+    return config
+
+def measure(config, sink_mode, switched):
+    config.set('USRP', 'sink_mode', sink_mode)
+    if switched:
+        (int_time, sig_time, ref_time) = (2, 0.5, 0.5)
+    else:
+        (int_time, sig_time, ref_time) = (1, 1, 0)
+    measurement = Measurement(1420.4e6, 1418.4e6, switched, int_time, sig_time, ref_time, 2.5e6, 45.0, 180.0,
+                              get_site(config), 256, "test", config, 0, 0, 40, "Galactic", session = get_session(config))
+    measurement.measure()
+    return measurement
+
+@pytest.mark.parametrize('sink_mode', ["memory", "file"])
+@pytest.mark.parametrize('switched', [False, True])
+def test_measurement_stacks_synthetic_spectra(synthetic_config, sink_mode, switched):
+    measurement = measure(synthetic_config, sink_mode, switched)
+    receiver = measurement.receiver
+    spec = measurement.signal_spec
+    assert spec.nchans == 4096
+    assert spec.bandwidth == 2.5e6
+    assert spec.obs_freq == 1420.4e6
+    # Mean of many dumps with 1% noise, scaled by 1000 as in Measurement
+    np.testing.assert_allclose(spec.data, 1000*receiver.get_model(1420.4e6), rtol=0.01)
+    if switched:
+        assert measurement.reference_spec.obs_freq == 1418.4e6
+        np.testing.assert_allclose(measurement.reference_spec.data, 1000*receiver.get_model(1418.4e6), rtol=0.01)
+    if sink_mode == "file":
+        # Temporary dump files are removed after stacking
+        assert os.listdir(synthetic_config.get('USRP', 'tmpdir')) == []
+
+def test_dump_header_round_trip():
+    header = DumpHeader(4096, 2.5e6, 1420.4e6, 1.7e9 + 0.25, REF, 123, '<f2')
+    data = header.pack()
+    assert len(data) == HEADER_SIZE
+    copy = DumpHeader.unpack(data)
+    for name in ['fftsize', 'samp_rate', 'c_freq', 'start_time', 'band', 'ndumps', 'dtype']:
+        assert getattr(copy, name) == getattr(header, name)
+    with pytest.raises(ValueError):
+        DumpHeader.unpack(b'NOTADUMP' + data[8:])
+
+def test_dump_file_from_synthetic_receiver(synthetic_config, tmp_path):
+    filename = str(tmp_path / "dump_sig")
+    receiver = SyntheticReceiver(1420.4e6, 1, 2.5e6, 4096, synthetic_config, 40, "file")
+    receiver.open_dump(SIG, filename)
+    receiver.select(SIG)
+    receiver.start()
+    time.sleep(0.3)
+    receiver.select(NULL)
+    receiver.stop()
+    receiver.wait()
+    receiver.close_dump(SIG)
+    assert is_dump_file(filename)
+    dumpfile = DumpFile(filename)
+    h = dumpfile.header
+    assert (h.fftsize, h.samp_rate, h.c_freq, h.band) == (4096, 2.5e6, 1420.4e6, SIG)
+    assert h.dtype == np.float32
+    assert h.ndumps == dumpfile.get_ndumps() > 0
+    assert dumpfile.partial_bytes == 0
+    np.testing.assert_allclose(dumpfile.get_mean_spectrum(), receiver.get_model(1420.4e6), rtol=0.01)
+    dumpfile.close()
+    # A writer which does not know the number of dumps leaves it as zero,
+    # and may be interrupted in the middle of a dump.
+    ndumps = h.ndumps
+    update_dump_count(filename, 0)
+    with open(filename, 'ab') as f:
+        f.write(bytes(10))
+    dumpfile = DumpFile(filename)
+    assert dumpfile.get_ndumps() == ndumps
+    assert dumpfile.partial_bytes == 10
+    dumpfile.close()
+
+# Post-processing as done by SALSA_spectrum before it was vectorized, used
+# to check that results are unchanged.
+
+def baseline_auto_edit_bad_data(data, obs_freq, bandwidth, nchans, known_RFI):
+    data = data.copy()
+    data[0:1] = data[2]
+    data[-2:] = data[-3]
+    freq_res = bandwidth/nchans # Hz
+    for item in known_RFI:
+        RFI_freq = item[0] *1e6
+        RFI_width = item[1]*1e6
+        ch0_freq = obs_freq - 0.5*bandwidth
+        ind_low = int(np.floor((RFI_freq-0.5*RFI_width - ch0_freq)/freq_res))
+        ind_high = int(np.ceil((RFI_freq+0.5*RFI_width - ch0_freq)/freq_res))
+        if ind_low>0 and ind_high<nchans:
+            margin = min(ind_high-ind_low, ind_low, nchans-ind_high)
+            RFI_part = data[ind_low-margin:ind_high+margin]
+            xdata = np.arange(len(RFI_part))
+            weights = np.ones_like(RFI_part)
+            weights[margin:-margin] = 0.0 # Ignore RFI when fitting
+            pf = np.polyfit(xdata, RFI_part, deg=1, w=weights)
+            interpdata = np.polyval(pf, xdata)
+            data[ind_low:ind_high] = interpdata[margin:-margin]
+    return signal.medfilt(data, kernel_size = 7)
+
+def baseline_decimate(data, nchans, outchans):
+    data = signal.decimate(data, int(nchans/outchans), axis=0, ftype = 'fir')
+    data[0] = data[1]
+    return data
+
+def baseline_vlsr_corr(spectrum):
+    ep_target = ephem.Equatorial(spectrum.pointing)
+    x0 = 20.0 * math.cos(18.0 * np.pi / 12.0) * math.cos(30.0 * np.pi / 180.0)
+    y0 = 20.0 * math.sin(18.0 * np.pi / 12.0) * math.cos(30.0 * np.pi / 180.0)
+    z0 = 20.0 * math.sin(30.0 * np.pi / 180.0)
+    ctra = math.cos(float(ep_target.ra))
+    stra = math.sin(float(ep_target.ra))
+    ctdc = math.cos(float(ep_target.dec))
+    stdc = math.sin(float(ep_target.dec))
+    vsun = x0*ctra*ctdc + y0*stra*ctdc + z0*stdc
+    ecl =  ephem.Ecliptic(ep_target)
+    sun = ephem.Sun()
+    sun.compute(spectrum.site)
+    slong = float(ephem.Ecliptic(sun).lon)
+    vorb = 30.0*math.cos(ecl.lat)*math.sin(slong-ecl.lon)
+    return 1e3*(vsun + vorb) # m/s
+
+@pytest.fixture
+def dumps(synthetic_config):
+    receiver = SyntheticReceiver(1420.4e6, 1, 2.5e6, 4096, synthetic_config, 40)
+    return 1000*receiver.get_dumps(8, receiver.model).astype(np.float64)
+
+def test_rfi_cleaning_matches_baseline(config, dumps):
+    known_RFI = get_known_RFI(config)
+    mask = get_rfi_mask(known_RFI, 1420.4e6, 2.5e6, 4096)
+    expected = [baseline_auto_edit_bad_data(spec, 1420.4e6, 2.5e6, 4096, known_RFI) for spec in dumps]
+    # One spectrum at a time, and all in one call
+    for (spec, exp) in zip(dumps, expected):
+        np.testing.assert_allclose(clean_spectra(spec.copy(), mask), exp, rtol=1e-14)
+    np.testing.assert_allclose(clean_spectra(dumps.copy(), mask), expected, rtol=1e-14)
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_median_filter_matches_medfilt(dumps, dtype):
+    data = dumps.astype(dtype)
+    expected = [signal.medfilt(spec, kernel_size = 7) for spec in data]
+    np.testing.assert_array_equal(median_filter(data), expected)
+    np.testing.assert_array_equal(median_filter(data[0]), expected[0])
+    np.testing.assert_array_equal(median_filter(data, kernel_size = 5),
+                                  [signal.medfilt(spec, kernel_size = 5) for spec in data])
+
+def test_decimator_matches_baseline(dumps):
+    decimator = get_decimator(4096, 256)
+    expected = [baseline_decimate(spec, 4096, 256) for spec in dumps]
+    np.testing.assert_allclose(decimator.decimate(dumps), expected, rtol=1e-14, atol=1e-14*np.max(np.abs(dumps)))
+    # Output channels need not divide the input channels
+    assert get_decimator(4096, 1000).decimate(dumps).shape == (len(dumps), 1000)
+
+@pytest.mark.parametrize('date', ['2020/3/20 12:00', '2023/6/21 03:00', '2026/10/18 18:00'])
+@pytest.mark.parametrize('alt,az', [(45.0, 180.0), (20.0, 90.0), (80.0, 300.0)])
+def test_vlsr_correction_matches_baseline(config, date, alt, az):
+    site = get_site(config)
+    site.date = ephem.Date(date)
+    spectrum = SALSA_spectrum(np.ones(256), 2.5e6, 256, 1420.4e6, site, alt, az, 10, "test", config, 0, 0, "Galactic")
+    spectrum.shift_to_vlsr_frame()
+    assert abs(spectrum.vlsr_corr - baseline_vlsr_corr(spectrum)) < 3.0
+    assert spectrum.freq_vlsr_corr == pytest.approx(-spectrum.rest_freq*spectrum.vlsr_corr/c)
+
+def test_sun_longitude_for_sparse_dates():
+    # Few dates over a long span are interpolated, as many dates are
+    import vlsr
+    dates = float(ephem.Date('2016/1/1')) + np.sort(np.random.default_rng(1).uniform(0, 3652, 2000))
+    t0 = time.time()
+    lon = vlsr.get_sun_ecliptic_lon(dates)
+    assert time.time() - t0 < 0.5
+    expected = np.array([vlsr.get_sun_ecliptic_lon(date) for date in dates[::20]])
+    diff = np.angle(np.exp(1j*(lon[::20] - expected)))
+    assert 30e3*np.max(np.abs(diff)) < 0.1 # m/s
@@ -0,0 +1,42 @@
+import numpy as np
+from astropy.io import fits
+from sdfits import *
+
+def test_session_in_one_table(make_spectrum, tmp_path):
+    filename = str(tmp_path / "session.fits")
+    spectra = [make_spectrum(np.arange(64, dtype=np.float64) + i) for i in range(10)]
+    writer = SDFITSWriter(filename, buffer_size = 3)
+    for spectrum in spectra:
+        writer.add(spectrum)
+    writer.close()
+    with fits.open(filename) as hdulist:
+        hdulist.verify('exception')
+        assert len(hdulist) == 2
+    reader = SDFITSReader(filename)
+    assert reader.get_nspectra() == 10
+    data = reader.get_column('DATA')
+    assert data.dtype.itemsize == 4
+    np.testing.assert_array_equal(data, [spectrum.data for spectrum in spectra])
+    assert list(reader.get_column('OBSERVER')) == ["test"]*10
+    np.testing.assert_allclose(reader.get_column('GLON'), [float(s.glon)*180/np.pi for s in spectra])
+    reader.close()
+
+def test_new_table_for_other_channel_count(make_spectrum, tmp_path):
+    filename = str(tmp_path / "session.fits")
+    writer = SDFITSWriter(filename)
+    for nchans in [64, 64, 128]:
+        writer.add(make_spectrum(np.ones(nchans)))
+    writer.close()
+    reader = SDFITSReader(filename)
+    assert reader.get_nspectra() == 3
+    assert [len(data) for data in reader.get_data()] == [2, 1]
+    assert len(reader.get_column('EXPOSURE')) == 3
+    reader.close()
+
+def test_save_session_to_sdfits(make_spectrum, tmp_path):
+    filename = str(tmp_path / "session.fits")
+    spectra = [make_spectrum(np.full(64, float(i))) for i in range(3)]
+    save_session_to_sdfits(spectra, filename)
+    reader = SDFITSReader(filename)
+    np.testing.assert_array_equal(reader.get_column('DATA')[:, 0], [0, 1, 2])
+    reader.close()
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from spectrum import *
+
+def read_rows(filename):
+    with open(filename) as f:
+        return [line for line in f if not line.startswith('#')]
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_txt_rows_match_previous_format(make_spectrum, tmp_path, dtype):
+    data = (np.random.default_rng(1).random(256)*100).astype(dtype)
+    spectrum = make_spectrum(data)
+    spectrum.save_to_txt(str(tmp_path / "spectrum.txt"))
+    vels = spectrum.get_vels()*1e-3
+    # Rows as written one at a time before
+    expected = ["{0} {1}\n".format(vels[i], data[i]) for i in range(len(data))]
+    assert read_rows(str(tmp_path / "spectrum.txt")) == expected
+
+def test_session_export(make_spectrum, tmp_path):
+    spectra = [make_spectrum(np.full(64, float(i)), '2026/10/18 18:0' + str(i)) for i in range(3)]
+    outfile = str(tmp_path / "session.txt")
+    save_session_to_txt(spectra, outfile)
+    with open(outfile) as f:
+        text = f.read()
+    assert text.count('# BEGINHEADER') == 3
+    assert len(read_rows(outfile)) == 3*64
+    files = save_session_to_dir(spectra, str(tmp_path / "session"))
+    assert len(set(files)) == 3
+    for (i, filename) in enumerate(files):
+        rows = read_rows(filename)
+        assert len(rows) == 64
+        assert float(rows[0].split()[1]) == i
@@ -0,0 +1,108 @@
+import threading
+import time
+import pytest
+from tracking import *
+
+class FakeMD01():
+    """Command function of the TrackingEngine, recording the commands sent
+    and replying with a fixed position."""
+
+    def __init__(self):
+        self.commands = []
+        self.times = []
+        self.sent = threading.Event()
+
+    def __call__(self, msg, reply = True):
+        self.commands.append(msg)
+        self.times.append(time.monotonic())
+        self.sent.set()
+        return encode_reply(45.0, 180.0).hex() if reply else ""
+
+@pytest.fixture
+def md01():
+    return FakeMD01()
+
+@pytest.fixture
+def engine(md01):
+    engine = TrackingEngine(md01)
+    engine.start()
+    yield engine
+    engine.close()
+
+def test_calibrate_sent_at_command_slot(md01, engine, wait_until):
+    engine.set_target_alaz(45.0, 180.0)
+    wait_until(lambda: engine.get_commanded_alaz() == (45.0, 180.0))
+    engine.calibrate(40.0, 170.0)
+    wait_until(lambda: calibrate_command(40.0, 170.0) in md01.commands)
+    # Target is sent again in the next slot, at most one command per second
+    wait_until(lambda: md01.commands.count(set_command(45.0, 180.0)) == 2)
+    intervals = [t1 - t0 for (t0, t1) in zip(md01.times, md01.times[1:])]
+    assert min(intervals) > 0.9
+    with pytest.raises(ValueError):
+        engine.calibrate(200.0, 170.0)
+
+def test_restart(md01, engine):
+    assert engine.restart(restart_time = 0.1)
+    i = md01.commands.index(RESTART)
+    assert md01.commands[i-1] == STOP
+    assert engine.get_state() == IDLE
+
+def test_restart_without_thread(md01):
+    engine = TrackingEngine(md01)
+    assert not engine.restart(restart_time = 0.1)
+    engine.start()
+    engine.close()
+    t0 = time.time()
+    assert not engine.restart(restart_time = 0.1)
+    assert time.time() - t0 < 1.0
+    assert md01.commands.count(RESTART) == 0
+
+def test_target_passing_north():
+    predictor = TargetPredictor()
+    for (t, az) in enumerate([358.5, 359.0, 359.5, 0.0, 0.5]):
+        predictor.add(float(t), 45.0, az)
+    assert predictor.get_rate() == pytest.approx((0.0, 0.5))
+    assert predictor.predict(5.0) == pytest.approx((45.0, 1.0))
+    assert predictor.get_latest() == (45.0, 0.5)
+    # Prediction past 360 is given in the range of the latest target
+    predictor.clear()
+    for (t, az) in enumerate([358.5, 359.0, 359.5]):
+        predictor.add(float(t), 45.0, az)
+    assert predictor.predict(4.0) == pytest.approx((45.0, 0.5))
+    # Also for a range of the MD01 other than 0 to 360
+    predictor.clear()
+    for (t, az) in enumerate([-2.0, -1.5]):
+        predictor.add(float(t), 45.0, az)
+    assert predictor.predict(3.0) == pytest.approx((45.0, -0.5))
+    assert predictor.predict(5.0) == pytest.approx((45.0, -359.5))
+
+def add_moving_target(engine, al, az, ral, raz):
+    # Target at al, az now, which has moved at ral and raz [deg/s]
+    now = time.time()
+    for dt in [-3.0, -2.0, -1.0, 0.0]:
+        engine.set_target_alaz(al + ral*dt, az + raz*dt, now + dt)
+
+def test_command_passing_north(md01):
+    engine = TrackingEngine(md01)
+    engine.current_alaz = (45.0, 359.6)
+    add_moving_target(engine, 45.0, 359.8, 0.0, 0.5)
+    # Led by 1 s past north, sent as the MD01 position of the target
+    (al, az) = engine._get_command()
+    assert engine.get_state() == TRACKING
+    assert (al, az) == pytest.approx((45.0, 0.3), abs=0.11)
+
+def test_slew_lead_limited(md01):
+    engine = TrackingEngine(md01, max_lead = 10.0)
+    engine.current_alaz = (45.0, 100.0)
+    add_moving_target(engine, 45.0, 200.0, 0.0, 0.5)
+    # 100 degrees to go, but not led by more than 10 s
+    (al, az) = engine._get_command()
+    assert engine.get_state() == SLEWING
+    assert az == pytest.approx(205.0, abs=0.2)
+
+def test_lead_within_altitude_range(md01):
+    engine = TrackingEngine(md01, al_range = (10.0, 175.0))
+    engine.current_alaz = (30.0, 100.0)
+    add_moving_target(engine, 10.5, 100.0, -0.2, 0.0)
+    # Prediction below the horizon limit, the latest target is sent instead
+    assert engine._get_command() == (10.5, 100.0)
@@ -0,0 +1,40 @@
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import pytest
+from waterfall import *
+
+def write_cube(filename, ndumps, nchans = 64, chan_avg = 1):
+    header = DumpHeader(nchans, 2.5e6, 1420.4e6, 1000.0, 1)
+    writer = WaterfallWriter(filename, header, 0.1, "float32", chan_avg)
+    dumps = np.arange(ndumps*nchans, dtype=np.float32).reshape((ndumps, nchans))
+    if ndumps > 0:
+        writer.add(dumps, 1000.0)
+    writer.close()
+    return dumps
+
+def test_cube_round_trip(tmp_path):
+    filename = str(tmp_path / "cube.wf")
+    dumps = write_cube(filename, 10, chan_avg = 2)
+    cube = WaterfallCube(filename)
+    assert cube.get_ndumps() == 10
+    assert cube.nchans == 32
+    np.testing.assert_allclose(cube.times, 1000.0 - 0.1*np.arange(9, -1, -1))
+    np.testing.assert_allclose(cube.data, dumps.reshape((10, 32, 2)).mean(axis=2))
+    cube.flag_times(999.95, 1001.0)
+    np.testing.assert_allclose(cube.get_mean_spectrum(), cube.data[:-1].mean(axis=0))
+    fig, ax = plt.subplots()
+    cube.plot(ax)
+    plt.close(fig)
+
+def test_plot_empty_cube(tmp_path):
+    filename = str(tmp_path / "empty.wf")
+    write_cube(filename, 0)
+    cube = WaterfallCube(filename)
+    assert cube.get_ndumps() == 0
+    assert cube.get_mean_spectrum() is None
+    fig, ax = plt.subplots()
+    with pytest.raises(ValueError):
+        cube.plot(ax)
+    plt.close(fig)
@@ -0,0 +1,271 @@
+import threading
+import collections
+import math
+import time
+from rot2prog import *
+
+# States of the TrackingEngine
+IDLE = 'IDLE'
+SLEWING = 'SLEWING'
+TRACKING = 'TRACKING'
+
+# Time allowed for slow replies of the MD01 during a restart [s]
+RESTART_MARGIN = 10.0
+
+def wrap180(angle):
+    """Returns angle [degrees] in the range -180 to 180."""
+    return (angle + 180.0) % 360.0 - 180.0
+
+class TargetPredictor():
+    """ Estimates the rate of motion of a target from positions given at
+    successive times, e.g. every time the user interface calculates the
+    position of the source, and predicts where the target will be.
+
+    The rate is the mean over the positions given during the last window
+    seconds. A position further than jump degrees from the predicted one
+    is taken as a new target, and the old positions are forgotten.
+
+    Azimuths are unwrapped for the rate, so that it is right when the
+    target passes 0/360 degrees, but predicted azimuths are in the same
+    360 degree range as the latest position given."""
+
+    def __init__(self, window = 30.0, jump = 1.0):
+        self.window = window # s
+        self.jump = jump # deg
+        self.samples = collections.deque()
+        self.branch = 0.0 # Start of 360 degree range of latest azimuth
+
+    def clear(self):
+        self.samples.clear()
+
+    def has_target(self):
+        return len(self.samples) > 0
+
+    def add(self, t, al, az):
+        self.branch = 360.0*math.floor(az/360.0)
+        if len(self.samples) > 0:
+            (pal, paz) = self._extrapolate(t)
+            uaz = paz + wrap180(az - paz)
+            if abs(al - pal) > self.jump or abs(uaz - paz) > self.jump:
+                self.samples.clear()
+            else:
+                az = uaz
+        self.samples.append((t, al, az))
+        while len(self.samples) > 2 and t - self.samples[0][0] > self.window:
+            self.samples.popleft()
+
+    def get_rate(self):
+        """Returns rate of altitude and azimuth [deg/s]."""
+        if len(self.samples) < 2:
+            return (0.0, 0.0)
+        (t0, al0, az0) = self.samples[0]
+        (t1, al1, az1) = self.samples[-1]
+        if t1 - t0 <= 0:
+            return (0.0, 0.0)
+        return ((al1 - al0)/(t1 - t0), (az1 - az0)/(t1 - t0))
+
+    def get_latest(self):
+        """Returns the latest altitude and azimuth [degrees] given."""
+        (t1, al1, az1) = self.samples[-1]
+        return (al1, self.branch + az1 % 360.0)
+
+    def predict(self, t):
+        """Returns altitude and azimuth [degrees] of target at time t."""
+        (al, az) = self._extrapolate(t)
+        return (al, self.branch + az % 360.0)
+
+    def _extrapolate(self, t):
+        # Position at time t, with unwrapped azimuth
+        (t1, al1, az1) = self.samples[-1]
+        (ral, raz) = self.get_rate()
+        return (al1 + ral*(t - t1), az1 + raz*(t - t1))
+
+class TrackingEngine():
+    """ Moves the telescope to a target, and keeps it on a moving target,
+    by sending commands to the MD01 from its own thread, so no Qt event
+    loop is needed.
+
+    One command is sent every interval seconds. The MD01 can only be sent
+    a position, where it stops, and positions have a resolution of 0.1
+    degrees. Sending the latest target position therefore keeps the
+    telescope behind a moving source. Instead, the rate of the target is
+    estimated from successive calls to set_target_alaz(), and the position
+    the target will have after lead_time seconds is sent, so that the
+    telescope is as much ahead of the source as behind.
+
+    The state is IDLE without target, SLEWING while further than
+    slew_threshold degrees from the target, and TRACKING when close.
+    When slewing, the lead time also includes the time to reach the
+    target at slew_rate, so that the telescope arrives where the target
+    will be. The target is never extrapolated more than max_lead seconds,
+    and never outside the altitude range al_range [degrees], where the
+    latest target position is sent instead. Commands are sent through the
+    function md01(msg, reply), which returns the reply as a hex string, or
+    None if it failed."""
+
+    def __init__(self, md01, interval = 1.0, lead_time = 1.0, slew_threshold = 1.0, slew_rate = 1.0, ph = 10, pv = 10,
+                 max_lead = 10.0, al_range = AL_RANGE):
+        self.md01 = md01
+        self.interval = max(1.0, interval) # s, never more than one command per second
+        self.lead_time = lead_time # s
+        self.slew_threshold = slew_threshold # deg
+        self.slew_rate = slew_rate # deg/s
+        self.max_lead = max(lead_time, max_lead) # s
+        self.al_range = al_range # deg
+        self.ph = ph # Pulses per degree
+        self.pv = pv
+        self.predictor = TargetPredictor(jump=slew_threshold)
+        self.lock = threading.Lock()
+        self.state = IDLE
+        self.current_alaz = (0, 0)
+        self.commanded_alaz = None
+        self.stop_requested = False
+        self.restart_requested = None
+        self.calibrate_requested = None
+        self.closing = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        """Stop the thread. The telescope is not stopped."""
+        self.closing.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def set_target_alaz(self, al, az, t = None):
+        """Set target altitude and azimuth [degrees] at unix time t, default now.
+        Call again when the target has moved, to update the estimated rate."""
+        if t is None:
+            t = time.time()
+        with self.lock:
+            self.predictor.add(t, al, az)
+            self.stop_requested = False
+
+    def stop(self):
+        """Stop the telescope at the next command and forget the target."""
+        with self.lock:
+            self.predictor.clear()
+            self.stop_requested = True
+
+    def calibrate(self, al, az):
+        """Set the position read by the MD01 to altitude and azimuth
+        [degrees] at the next command. The target is sent again after.
+        Raises ValueError if the MD01 cannot be set to the position."""
+        calibrate_command(al, az, self.ph, self.pv) # Check angles
+        with self.lock:
+            self.calibrate_requested = (al, az)
+
+    def restart(self, restart_time = 19.0):
+        """Restart the MD01 and wait until done. Returns False if the
+        restart was not done, because the thread is not running or the
+        restart did not finish in time."""
+        if self.thread is None or self.closing.is_set():
+            return False
+        done = threading.Event()
+        request = (restart_time, done)
+        with self.lock:
+            self.predictor.clear()
+            self.restart_requested = request
+        # Wait for next command slot, stop and restart
+        if done.wait(restart_time + 2*self.interval + RESTART_MARGIN):
+            return True
+        with self.lock:
+            # Do not restart later, when no one is waiting
+            if self.restart_requested is request:
+                self.restart_requested = None
+        return done.is_set()
+
+    def get_state(self):
+        return self.state
+
+    def get_current_alaz(self):
+        """Returns the latest position read from the MD01 [degrees]."""
+        return self.current_alaz
+
+    def get_commanded_alaz(self):
+        """Returns the latest position sent to the MD01, or None."""
+        return self.commanded_alaz
+
+    def get_target_rate(self):
+        """Returns estimated rate of target altitude and azimuth [deg/s]."""
+        with self.lock:
+            return self.predictor.get_rate()
+
+    def _run(self):
+        while not self.closing.is_set():
+            start = time.monotonic()
+            self._step()
+            # Wait for next command slot, counted from start of this command
+            self.closing.wait(max(0, start + self.interval - time.monotonic()))
+
+    def _step(self):
+        with self.lock:
+            restart = self.restart_requested
+            self.restart_requested = None
+            calibrate = self.calibrate_requested
+            self.calibrate_requested = None
+            stop = self.stop_requested
+            self.stop_requested = False
+            target = self._get_command()
+        if restart is not None:
+            (restart_time, done) = restart
+            self._read_reply(self.md01(STOP))
+            time.sleep(self.interval) # Seconds, to ensure device is ready
+            self.md01(RESTART, reply=False)
+            time.sleep(restart_time) # Seconds, to ensure device is ready
+            self.state = IDLE
+            self.commanded_alaz = None
+            done.set()
+        elif calibrate is not None:
+            self.md01(calibrate_command(calibrate[0], calibrate[1], self.ph, self.pv), reply=False)
+            self.commanded_alaz = None
+        elif stop:
+            self._read_reply(self.md01(STOP))
+            self.state = IDLE
+            self.commanded_alaz = None
+        elif target is not None and target != self.commanded_alaz:
+            if self.md01(set_command(target[0], target[1], self.ph, self.pv)) is not None:
+                self.commanded_alaz = target
+        else:
+            self._read_reply(self.md01(STATUS))
+
+    def _get_command(self):
+        # Returns the position to send, and updates the state.
+        # Called with lock held.
+        if not self.predictor.has_target():
+            self.state = IDLE
+            return None
+        now = time.time()
+        (tal, taz) = self.predictor.predict(now)
+        (cal, caz) = self.current_alaz
+        distance = max(abs(tal - cal), abs(taz - caz))
+        # Use larger threshold to leave tracking, to avoid toggling state
+        if distance > 2*self.slew_threshold or (self.state != TRACKING and distance > self.slew_threshold):
+            self.state = SLEWING
+            lead = min(self.max_lead, self.lead_time + distance/self.slew_rate)
+        else:
+            self.state = TRACKING
+            lead = self.lead_time
+        (al, az) = self.predictor.predict(now + lead)
+        command = (round(al*self.pv)/self.pv, round(az*self.ph)/self.ph)
+        try:
+            if not self.al_range[0] <= command[0] <= self.al_range[1]:
+                raise ValueError("Altitude outside range of telescope")
+            set_command(command[0], command[1], self.ph, self.pv)
+        except ValueError:
+            # Prediction outside the range of the telescope, use latest target
+            (al, az) = self.predictor.get_latest()
+            command = (round(al*self.pv)/self.pv, round(az*self.ph)/self.ph)
+        return command
+
+    def _read_reply(self, ans):
+        if ans:
+            try:
+                self.current_alaz = decode_reply(bytes.fromhex(ans))
+            except MD01Error as e:
+                print("WARNING: " + str(e))
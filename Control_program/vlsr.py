@@ -0,0 +1,138 @@
+import numpy as np
+import ephem
+from scipy.constants import c
+
+# Rest frequency of the HI line [Hz]
+HI_REST_FREQ = 1420.40575177e6
+# Obliquity of the ecliptic at J2000 [rad]
+OBLIQUITY = np.radians(23.4392911)
+# Sun velocity apex is at 18 hr, 30 deg; convert to x, y, z
+# geocentric celestial for dot product with source, multiply by speed
+APEX = 20.0*np.array([np.cos(18.0*np.pi/12.0)*np.cos(30.0*np.pi/180.0),
+                      np.sin(18.0*np.pi/12.0)*np.cos(30.0*np.pi/180.0),
+                      np.sin(30.0*np.pi/180.0)]) # km/s
+
+# Grid [days] on which the Sun is computed with ephem for many dates, and
+# the number of dates from which the grid is used
+SUN_GRID = 1.0
+SUN_GRID_MIN_DATES = 100
+
+def get_sun_ecliptic_lon(dates):
+    """Returns ecliptic longitude [rad] of the Sun, referred to the J2000
+    equinox, for ephem dates (days since 1899 December 31 12:00 UT).
+
+    Computed with ephem, as for a single spectrum. For many dates, ephem
+    is only used every SUN_GRID days over the span of the dates, and the
+    longitude is interpolated in between, which changes the VLSR
+    correction by less than 0.1 m/s."""
+    dates = np.asarray(dates, dtype=np.float64)
+    if dates.size < SUN_GRID_MIN_DATES:
+        return np.reshape([_get_sun_ecliptic_lon(date) for date in dates.ravel()], dates.shape)
+    start = np.floor(dates.min()/SUN_GRID)*SUN_GRID
+    grid = start + SUN_GRID*np.arange(int(np.ceil((dates.max()-start)/SUN_GRID)) + 1)
+    lon = np.unwrap([_get_sun_ecliptic_lon(date) for date in grid])
+    return np.interp(dates, grid, lon)
+
+def _get_sun_ecliptic_lon(date):
+    sun = ephem.Sun()
+    sun.compute(ephem.Date(date))
+    return float(ephem.Ecliptic(sun).lon)
+
+def get_vlsr_corrections(ra, dec, dates, rest_freq):
+    """Returns (vlsr_corr, freq_vlsr_corr), the LSR velocity correction [m/s]
+    and the corresponding frequency shift [Hz] at rest_freq [Hz], for
+    arrays of J2000 RA and Dec [rad] and ephem dates of observation.
+    Inputs are broadcast against each other.
+
+    From http://web.mit.edu/8.13/www/nsrt_software/documentation/vlsr.pdf"""
+    ra = np.asarray(ra, dtype=np.float64)
+    dec = np.asarray(dec, dtype=np.float64)
+    # Calculate sinces, cosines for dot product
+    ctra = np.cos(ra)
+    stra = np.sin(ra)
+    ctdc = np.cos(dec)
+    stdc = np.sin(dec)
+
+    # Calculate correction due to movement of Sun with respect to LSR
+    # dot product of target & apex vectors
+    vsun = APEX[0]*ctra*ctdc + APEX[1]*stra*ctdc + APEX[2]*stdc
+
+    # get target in geocentric ecliptic system
+    se = np.sin(OBLIQUITY)
+    ce = np.cos(OBLIQUITY)
+    tlat = np.arcsin(stdc*ce - ctdc*se*stra)
+    tlon = np.arctan2(stra*ctdc*ce + stdc*se, ctra*ctdc)
+
+    # Calculate correction due to earth movement relative to the Sun
+    slong = get_sun_ecliptic_lon(dates)
+    vorb = 30.0*np.cos(tlat)*np.sin(slong-tlon)
+
+    # Combine both effects
+    vlsr_corr = 1e3*(vsun + vorb) # in m/s
+    freq_vlsr_corr = -1*rest_freq*vlsr_corr/c
+    return (vlsr_corr, freq_vlsr_corr)
+
+def get_rotation_corrections(ra, dec, dates, lat, lon):
+    """Returns velocity [m/s] of an observer at latitude and east longitude
+    [rad] towards RA and Dec [rad], due to the rotation of the Earth, for
+    arrays of ephem dates. Not part of the LSR correction above, but the
+    fastest changing part of the observed velocity during a measurement."""
+    d = np.asarray(dates, dtype=np.float64) + ephem.julian_date(0) - 2451545.0 # Days since J2000
+    # Greenwich mean sidereal time, then hour angle of target
+    gmst = np.radians(15.0*(18.697374558 + 24.06570982441908*d))
+    ha = gmst + lon - np.asarray(ra, dtype=np.float64)
+    # Rotation speed at equator is 465.1 m/s, towards east
+    return -465.1*np.cos(lat)*np.cos(dec)*np.sin(ha)
+
+def unix_to_ephem_date(times):
+    """Convert unix times [s] to ephem dates [days]."""
+    return np.asarray(times, dtype=np.float64)/86400.0 + float(ephem.Date('1970/1/1'))
+
+class DopplerTracker():
+    """ Shifts dumps in frequency to compensate for the change of the LSR
+    velocity correction during a measurement, so that long integrations
+    do not smear spectral lines when dumps are stacked.
+
+    Every dump is shifted to the frame at start_time (unix time), i.e. the
+    time for which the correction of the final spectrum is calculated.
+    If the site latitude and longitude [rad] are given, the change due
+    to the rotation of the Earth is also compensated.
+    The shift is done by multiplying the Fourier transform of each dump
+    with a linear phase, which also works for fractions of a channel.
+    Channels shifted out at one band edge come back at the other edge,
+    which only affects the edge channels for the small shifts involved.
+    Used as doppler tracker of a SpectrumAccumulator."""
+
+    def __init__(self, ra, dec, start_time, rest_freq, chan_width, dump_period, lat = None, lon = None):
+        self.ra = float(ra) # J2000 [rad]
+        self.dec = float(dec)
+        self.lat = lat
+        self.lon = lon
+        self.rest_freq = float(rest_freq)
+        self.chan_width = float(chan_width) # Hz
+        self.dump_period = float(dump_period) # Time between dumps [s]
+        self.start_freq_corr = self.get_freq_corrections(start_time)
+
+    def get_freq_corrections(self, times):
+        dates = unix_to_ephem_date(times)
+        (vlsr_corr, freq_vlsr_corr) = get_vlsr_corrections(self.ra, self.dec, dates, self.rest_freq)
+        if self.lat is not None:
+            vrot = get_rotation_corrections(self.ra, self.dec, dates, self.lat, self.lon)
+            freq_vlsr_corr = freq_vlsr_corr - self.rest_freq*vrot/c
+        return freq_vlsr_corr
+
+    def get_shifts(self, times):
+        """Returns the shift [channels] to apply to dumps received at the given unix times."""
+        return (self.get_freq_corrections(times) - self.start_freq_corr)/self.chan_width
+
+    def apply(self, dumps, timestamp):
+        """Returns dumps, one spectrum per row, received at the given unix time,
+        shifted to the frame at start_time. Earlier rows in the batch are
+        given earlier times, one dump period apart."""
+        (n, nchans) = dumps.shape
+        times = timestamp - self.dump_period*np.arange(n-1, -1, -1)
+        shifts = self.get_shifts(times)
+        k = np.arange(nchans//2 + 1)
+        phase = np.exp(-2j*np.pi*np.outer(shifts, k)/nchans)
+        shifted = np.fft.irfft(np.fft.rfft(dumps, axis=1)*phase, n=nchans, axis=1)
+        return shifted.astype(dumps.dtype)
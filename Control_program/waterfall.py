@@ -0,0 +1,117 @@
+from dumpfile import *
+import numpy as np
+import threading
+import os
+
+class WaterfallWriter():
+    """ Writes every dump of a measurement to a time/channel cube on disk.
+
+    Used as recorder of a SpectrumAccumulator. To keep the cube small, dumps
+    may be averaged over chan_avg adjacent channels and stored as float16.
+    The cube is a dump file (see dumpfile.py) described by header, the
+    header of the received dumps. Timestamps (unix time, float64) of
+    every dump are written to filename.time."""
+
+    def __init__(self, filename, header, dump_period, dtype = "float16", chan_avg = 1):
+        self.filename = filename
+        self.fftsize = header.fftsize
+        self.dump_period = float(dump_period) # Time between dumps [s]
+        self.dtype = np.dtype(dtype)
+        self.chan_avg = int(chan_avg)
+        if self.fftsize % self.chan_avg != 0:
+            raise ValueError("Number of channels must be a multiple of chan_avg.")
+        self.nchans = self.fftsize//self.chan_avg
+        self.ndumps = 0
+        self.lock = threading.Lock()
+        write_dump_header(filename, DumpHeader(self.nchans, header.samp_rate, header.c_freq, header.start_time, header.band, 0, self.dtype))
+        self.datafile = open(filename, 'ab')
+        self.timefile = open(filename + '.time', 'wb')
+
+    def add(self, dumps, timestamp):
+        """Append dumps, one spectrum per row, received at the given unix time.
+        Earlier rows in the batch are given earlier times, one dump period apart."""
+        n = len(dumps)
+        cube = dumps.reshape((n, self.nchans, self.chan_avg)).mean(axis=2)
+        times = timestamp - self.dump_period*np.arange(n-1, -1, -1)
+        with self.lock:
+            if self.datafile is not None:
+                cube.astype(self.dtype).tofile(self.datafile)
+                times.astype(np.float64).tofile(self.timefile)
+                self.ndumps += n
+
+    def close(self):
+        with self.lock:
+            self.datafile.close()
+            self.timefile.close()
+            self.datafile = None
+            self.timefile = None
+            update_dump_count(self.filename, self.ndumps)
+
+class WaterfallCube():
+    """ Reads a cube written by WaterfallWriter as memory mapped arrays,
+    so that large cubes can be used without reading them into RAM."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        dumpfile = DumpFile(filename)
+        self.header = dumpfile.header
+        self.nchans = self.header.fftsize
+        # Only full spectra, in case file was not closed properly
+        ndumps = min(dumpfile.get_ndumps(), os.path.getsize(filename + '.time')//8)
+        self.data = dumpfile.data[:ndumps]
+        if ndumps == 0:
+            self.times = np.zeros(0)
+        else:
+            self.times = np.memmap(filename + '.time', mode = 'r', dtype = np.float64, shape = (ndumps,))
+        self.flags = np.zeros(ndumps, dtype=bool) # True for flagged (bad) dumps
+
+    def get_ndumps(self):
+        return len(self.times)
+
+    def get_total_power(self, block = 1024):
+        """Returns the mean of every dump, computed in blocks of rows."""
+        power = np.zeros(self.get_ndumps())
+        for i in range(0, self.get_ndumps(), block):
+            power[i:i+block] = self.data[i:i+block].mean(axis=1, dtype=np.float64)
+        return power
+
+    def flag_outliers(self, nsigma = 5.0):
+        """Flag dumps whose total power differs from the median by more than nsigma
+        times the robust standard deviation, e.g. because of RFI bursts."""
+        power = self.get_total_power()
+        median = np.median(power)
+        std = 1.4826*np.median(np.abs(power-median))
+        self.flags |= np.abs(power-median) > nsigma*std
+        return self.flags
+
+    def flag_times(self, tstart, tend):
+        """Flag all dumps between the given unix times."""
+        self.flags |= (self.times >= tstart) & (self.times <= tend)
+        return self.flags
+
+    def get_mean_spectrum(self, block = 1024):
+        """Returns the mean of all unflagged dumps, or None if all are flagged."""
+        total = np.zeros(self.nchans)
+        count = 0
+        for i in range(0, self.get_ndumps(), block):
+            good = ~self.flags[i:i+block]
+            total += self.data[i:i+block][good].sum(axis=0, dtype=np.float64)
+            count += np.count_nonzero(good)
+        if count == 0:
+            return None
+        return total/count
+
+    def plot(self, ax, maxrows = 1000):
+        """Plot the cube as a waterfall on the given matplotlib axes.
+        At most maxrows dumps are read, evenly spread over the cube.
+        Raises ValueError if the cube has no dumps."""
+        if self.get_ndumps() == 0:
+            raise ValueError("No dumps recorded in waterfall cube " + self.filename + ".")
+        step = max(1, int(np.ceil(self.get_ndumps()/float(maxrows))))
+        rows = np.array(self.data[::step], dtype=np.float32)
+        rows[self.flags[::step]] = np.nan
+        t = self.times[::step] - self.times[0]
+        ax.imshow(rows, aspect='auto', origin='lower', interpolation='nearest',
+                  extent=[0, self.nchans, t[0], t[-1]])
+        ax.set_xlabel('Channel')
+        ax.set_ylabel('Time since start [s]')
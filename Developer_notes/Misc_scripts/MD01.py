@@ -28,6 +28,10 @@
 import socket
 import time
 import sys
+import os
+# Packets are built by the rot2prog module of the control program
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'Control_program'))
+from rot2prog import *
 # Create connection object
 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 # Connect to MD-01 via ethernet interface, using default config (as in manual).
@@ -45,19 +49,7 @@ else :
     sock.connect((tel, 23))  # Assume IP given, connect to that
 
 def set_azel(taz,tel):
-    PH = 10 # Pulses per degree, 0A in hex
-    PV = 10 # Pulses per degree, 0A in hex
-    H = str(int(PH * (360+taz)))
-    H1 = "3"+H[0]
-    H2 = "3"+H[1]
-    H3 = "3"+H[2]
-    H4 = "3"+H[3]
-    V = str(int(PV * (360+tel)))
-    V1 = "3"+V[0]
-    V2 = "3"+V[1]
-    V3 = "3"+V[2]
-    V4 = "3"+V[3]
-    msg = bytes.fromhex("57"+H1+H2+H3+H4+"0A"+V1+V2+V3+V4+"0A2F20")
+    msg = set_command(tel, taz)
     print("SETMSG", msg.hex())
     # Send message
     sock.send(msg)
@@ -68,19 +60,7 @@ def set_azel(taz,tel):
     print("SET", ans)
 
 def calibrate(taz,tel):
-    PH = 10 # Pulses per degree, 0A in hex
-    PV = 10 # Pulses per degree, 0A in hex
-    H = str(int(PH * (360+taz)))
-    H1 = "3"+H[0]
-    H2 = "3"+H[1]
-    H3 = "3"+H[2]
-    H4 = "3"+H[3]
-    V = str(int(PV * (360+tel)))
-    V1 = "3"+V[0]
-    V2 = "3"+V[1]
-    V3 = "3"+V[2]
-    V4 = "3"+V[3]
-    msg = bytes.fromhex("57"+H1+H2+H3+H4+"0A"+V1+V2+V3+V4+"0AF920")
+    msg = calibrate_command(tel, taz)
     print("SETMSG", msg.hex())
     # Send message
     sock.send(msg)
@@ -92,9 +72,8 @@ def calibrate(taz,tel):
 
 def reset():
     # Set az/el to 0
-    #Format status request message as bytes
     #Content taken from the XLS files supplied by RF HAM DESIGN
-    msg = bytes.fromhex("5700000000000000000000F820")
+    msg = encode('reset')
     # Send message
     sock.send(msg)
     # Read response from MD-01
@@ -104,11 +83,8 @@ def reset():
     print("RESET", ans)
 
 def stop():
-    #Format status request message as bytes
-    #Content taken from the XLS files supplied by RF HAM DESIGN
-    msg = bytes.fromhex("57000000000000000000000F20")
     # Send message
-    sock.send(msg)
+    sock.send(STOP)
     # Read response from MD-01
     data = sock.recv(1024)
     # Decode bytes to hex
@@ -116,34 +92,17 @@ def stop():
     print("STOP", ans)
 
 def get_azel():
-    #Format status request message as bytes
-    #Content taken from the XLS files supplied by RF HAM DESIGN
-    msg = bytes.fromhex("57000000000000000000001F20")
     # Send message
-    sock.send(msg)
+    sock.send(STATUS)
     # Read response from MD-01
     data = sock.recv(1024)
-    # Decode bytes to hex
-    ans = data.hex()
-    print("GET",ans)
-    # Extract relevant data as floating point numbers
-    H1 = float(ans[2:4])
-    H2 = float(ans[4:6])
-    H3 = float(ans[6:8])
-    H4 = float(ans[8:10])
-    V1 = float(ans[12:14])
-    V2 = float(ans[14:16])
-    V3 = float(ans[16:18])
-    V4 = float(ans[18:20])
-    # Calculate angles for Az/El
-    az = H1 * 100 + H2 * 10 + H3 + H4 / 10 -360
-    el = V1 * 100 + V2 * 10 + V3 + V4 / 10 -360
+    print("GET",data.hex())
+    el, az = decode_reply(data)
     return az, el
 
 def get_config():
-    #Format status request message as bytes
     #Content taken from the XLS files supplied by RF HAM DESIGN
-    msg = bytes.fromhex("57000000000000000000004F20")
+    msg = encode('config')
     # Send message
     sock.send(msg)
     # Read response from MD-01
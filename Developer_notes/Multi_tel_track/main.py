@@ -188,5 +188,9 @@ if __name__ == '__main__':
     # Create one MD01 object for each config file (each telescope)
     for cf in configs:
         tels.append(MD01(cf))
+    # Poll and command all telescopes concurrently in the background
+    array = MD01Array([tel.client for tel in tels])
+    array.start()
     # Start control loop
     control_loop(tels)
+    array.stop()
@@ -1,14 +1,28 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import sys
+import os
 import time
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'Control_program'))
+from dumpfile import *
 
-
+# Usage: stack_to_arrayfile.py datafile outfile
+# for dump files with header written by the control program, or
+#        stack_to_arrayfile.py datafile fftsize samp_rate cfreq outfile
+# for raw float32 files without header.
 datafile = sys.argv[1]
-fftsize = int(sys.argv[2]) # 
-samp_rate = float(sys.argv[3]) # MSamples/s, i.e. bandwidth is half in MHz.
-cfreq = float(sys.argv[4])
-outfile = sys.argv[5]
+if is_dump_file(datafile):
+    dumpfile = DumpFile(datafile)
+    fftsize = dumpfile.header.fftsize
+    samp_rate = dumpfile.header.samp_rate
+    cfreq = dumpfile.header.c_freq
+    outfile = sys.argv[2]
+else:
+    dumpfile = None
+    fftsize = int(sys.argv[2]) # 
+    samp_rate = float(sys.argv[3]) # MSamples/s, i.e. bandwidth is half in MHz.
+    cfreq = float(sys.argv[4])
+    outfile = sys.argv[5]
 
 def stack_FFT_file(infile):
     # Load FFT segments as memory mapped file in case it is large
@@ -27,7 +41,10 @@ def stack_FFT_file(infile):
     return spec
 
 halffft = int(0.5*fftsize)
-spec = stack_FFT_file(datafile)
+if dumpfile is not None:
+    spec = dumpfile.get_mean_spectrum()
+else:
+    spec = stack_FFT_file(datafile)
 freqs = 0.5*samp_rate*np.array(range(-halffft,halffft))/(halffft)
 f = open(outfile, 'w')
 a = np.array([spec, samp_rate, fftsize, cfreq])